@@ -1,22 +1,35 @@
+import time
+_startup_t0 = time.perf_counter()
+
 from flask import Flask, render_template, request, jsonify, send_from_directory
 import threading
 import os
-import pandas as pd
-import time
 
-# Services
-from services.scraper import scrape_jobs
-from services.raw_job_parser import parse_raw_job_text # IMPORT ADDED
-from services.job_rewriter import rewrite_jobs
-from services.cv_converter import convert_cv_to_txt
-from services.cv_rewriter import rewrite_cv
-from services.matcher import calculate_matches
-from services.cross_encoder_matcher import calculate_cross_matches # IMPORT ADDED
-from services.explain import explain_matches # IMPORT ADDED
+# Services: registered lazily, each heavy module (torch, transformers, selenium...) is only
+# imported when its step first runs or during the optional warm-up (JOBAPP_WARMUP=1)
+from services.registry import lazy_service, start_warm_up, get_status
 from utils.logger import logger
+from utils.checkpoint import read_checkpoint
+from utils.artifacts import read_csv, read_text, load_manifest as load_artifacts
+from utils.profiling import profile_call, PROFILE_DIR
+from services.skill_index import SkillIndex, split_items, INDEX_PATH as SKILL_INDEX_PATH
+
+scrape_jobs = lazy_service('scrape_jobs')
+parse_raw_job_text = lazy_service('parse_raw_job_text')
+parse_raw_job_texts = lazy_service('parse_raw_job_texts')
+rewrite_jobs = lazy_service('rewrite_jobs')
+convert_cv_to_txt = lazy_service('convert_cv_to_txt')
+rewrite_cv = lazy_service('rewrite_cv')
+calculate_matches = lazy_service('calculate_matches')
+calculate_cross_matches = lazy_service('calculate_cross_matches')
+run_matching = lazy_service('run_matching')
+explain_matches = lazy_service('explain_matches')
+explain_match = lazy_service('explain_match')
 
 app = Flask(__name__)
 DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
+# Ads files uploaded for bulk parsing, kept apart from the pipeline artifacts
+UPLOADS_DIR = os.path.join(DATA_DIR, 'uploads')
 
 # Ensure data dir exists
 if not os.path.exists(DATA_DIR):
@@ -31,16 +44,42 @@ def index():
 def get_logs():
     return jsonify(logger.get_logs())
 
+@app.route('/api/startup')
+def get_startup():
+    """App import time, service modules imported so far (with their cost) and warm-up state."""
+    return jsonify({"app_import_seconds": round(STARTUP_SECONDS, 3), **get_status()})
+
+@app.route('/api/artifacts')
+def get_artifacts():
+    """Version of every artifact of data/ (run id, inputs hash, row count), to refresh previews only on change."""
+    return jsonify(load_artifacts())
+
 @app.route('/api/files/<filename>')
 def download_file(filename):
+    # Top-level files of data/ only: caches, checkpoints, indexes and uploads stay private
     return send_from_directory(DATA_DIR, filename)
 
-def run_task(task_id, task_func, *args, **kwargs):
-    """Helper to run tasks in a separate thread"""
+@app.route('/api/profiles/<filename>')
+def download_profile(filename):
+    """Profile files written by profiled tasks (data/profiles/)."""
+    return send_from_directory(PROFILE_DIR, filename)
+
+def profile_requested():
+    """Profiling flag of a step request: ?profile=1 or "profile": true in the JSON body."""
+    if request.args.get('profile', '').lower() in ('1', 'true', 'yes'):
+        return True
+    data = request.get_json(silent=True) or {}
+    return bool(data.get('profile'))
+
+def run_task(task_id, task_func, *args, profile=False, **kwargs):
+    """Helper to run tasks in a separate thread (optionally under the CPU / torch profilers)"""
     def wrapper():
         try:
             logger.start_task(task_id)
-            task_func(*args, progress_callback=logger.log, **kwargs)
+            if profile:
+                profile_call(task_id, task_func, *args, progress_callback=logger.log, **kwargs)
+            else:
+                task_func(*args, progress_callback=logger.log, **kwargs)
             logger.finish_task()
         except Exception as e:
             logger.error_task(str(e))
@@ -49,10 +88,16 @@ def run_task(task_id, task_func, *args, **kwargs):
     thread.start()
 
 # --- PREVIEW ENDPOINTS ---
+def running_checkpoint(task_id):
+    """Partial rows of `task_id`, only while it runs: once finished or failed, previews show the last CSV."""
+    if logger.active_task != task_id or logger.task_state != "RUNNING":
+        return None
+    return read_checkpoint(task_id)
+
 @app.route('/api/preview/step1')
 def preview_step1():
     try:
-        df = pd.read_csv(os.path.join(DATA_DIR, "jobs_raw.csv"))
+        df = read_csv(os.path.join(DATA_DIR, "jobs_raw.csv"))
         return jsonify(df.head(3).to_dict(orient='records'))
     except Exception as e:
         return jsonify({"error": str(e)})
@@ -60,7 +105,11 @@ def preview_step1():
 @app.route('/api/preview/step2')
 def preview_step2():
     try:
-        df = pd.read_csv(os.path.join(DATA_DIR, "jobs_rewritten.csv"))
+        # Run in progress: offers rewritten so far
+        partial = running_checkpoint('step2')
+        if partial is not None:
+            return jsonify(partial)
+        df = read_csv(os.path.join(DATA_DIR, "jobs_rewritten.csv"))
         # Show specific columns
         cols = ['Poste', 'Entreprise', 'Resume_IA']
         return jsonify(df[cols].fillna("").to_dict(orient='records'))
@@ -70,8 +119,7 @@ def preview_step2():
 @app.route('/api/preview/step3')
 def preview_step3():
     try:
-        with open(os.path.join(DATA_DIR, "cv_converted.txt"), 'r', encoding='utf-8') as f:
-            content = f.read() # Full content
+        content = read_text(os.path.join(DATA_DIR, "cv_converted.txt"))
         return jsonify({"content": content})
     except Exception as e:
         return jsonify({"error": str(e)})
@@ -79,34 +127,24 @@ def preview_step3():
 @app.route('/api/preview/step4')
 def preview_step4():
     try:
-        with open(os.path.join(DATA_DIR, "cv_synthesized.txt"), 'r', encoding='utf-8') as f:
-            content = f.read()
+        content = read_text(os.path.join(DATA_DIR, "cv_synthesized.txt"))
         return jsonify({"content": content})
     except Exception as e:
         return jsonify({"error": str(e)})
 
+# Steps 5, 6 and the unified matching write the same ranked file (data/matches.csv)
 @app.route('/api/preview/step5')
-def preview_step5():
-    try:
-        df = pd.read_csv(os.path.join(DATA_DIR, "final_matches.csv"))
-        # Return top 5 matches with more details
-        cols = ['Poste', 'Entreprise', 'match_score', 'Lien', 'Resume_IA', 'Missions']
-        # Filter cols that actually exist
-        existing_cols = [c for c in cols if c in df.columns]
-        result = df[existing_cols].head(5).fillna("").to_dict(orient='records')
-        return jsonify(result)
-    except Exception as e:
-        return jsonify({"error": str(e)})
-
 @app.route('/api/preview/step6')
-def preview_step6():
+@app.route('/api/preview/matching')
+def preview_matching():
     try:
-        df = pd.read_csv(os.path.join(DATA_DIR, "final_matches_cross.csv"))
-        # Return top 5 matches with more details
-        cols = ['Poste', 'Entreprise', 'match_score', 'Lien', 'Resume_IA', 'Missions']
-        # Filter cols that actually exist
+        df = read_csv(os.path.join(DATA_DIR, "matches.csv"))
+        # One artifact, every score column side by side
+        cols = ['Poste', 'Entreprise', 'match_score', 'bi_score', 'cross_score', 'bm25_score', 'Lien', 'Resume_IA', 'Missions']
         existing_cols = [c for c in cols if c in df.columns]
         result = df[existing_cols].head(5).fillna("").to_dict(orient='records')
+        for rank, row in enumerate(result):
+            row['rank'] = rank
         return jsonify(result)
     except Exception as e:
         return jsonify({"error": str(e)})
@@ -114,17 +152,58 @@ def preview_step6():
 @app.route('/api/preview/step7')
 def preview_step7():
     try:
-        df = pd.read_csv(os.path.join(DATA_DIR, "explained_matches.csv"))
+        partial = running_checkpoint('step7')
+        if partial is not None:
+            return jsonify(partial)
+        df = read_csv(os.path.join(DATA_DIR, "explained_matches.csv"))
         # Return top 5 matches with explanations
-        cols = ['Poste', 'Entreprise', 'match_score', 'Explanation']
+        cols = ['Poste', 'Entreprise', 'match_score', 'Explanation', 'Verdict', 'Explanation_Mode']
         # Filter cols that actually exist
         existing_cols = [c for c in cols if c in df.columns]
         result = df[existing_cols].fillna("").to_dict(orient='records')
+        # Rank lets the UI request missing explanations on demand
+        for rank, row in enumerate(result):
+            row['rank'] = rank
         return jsonify(result)
     except Exception as e:
         return jsonify({"error": str(e)})
 
 
+# --- SKILL INDEX ---
+# Loaded once and kept between searches; reloaded when step 2 (or a prefilter) rewrites the file
+_skill_index = None
+_skill_index_stamp = None
+_skill_index_lock = threading.Lock()
+
+def cached_skill_index():
+    global _skill_index, _skill_index_stamp
+    try:
+        stat = os.stat(SKILL_INDEX_PATH)
+        stamp = (stat.st_mtime_ns, stat.st_size)
+    except FileNotFoundError:
+        stamp = None
+    with _skill_index_lock:
+        if _skill_index is None or stamp != _skill_index_stamp:
+            _skill_index = SkillIndex.load(SKILL_INDEX_PATH)
+            _skill_index_stamp = stamp
+        return _skill_index
+
+@app.route('/api/skills/search')
+def search_skills():
+    """Offers requiring the given skills (?skills=python,spark&seniority=senior&any=1), from the skill index."""
+    t0 = time.perf_counter()
+    try:
+        index = cached_skill_index()
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        return jsonify({"error": f"Index des compétences illisible, relancez l'étape 2 : {e}"}), 503
+    keys = index.query(split_items(request.args.get('skills', '')),
+                       request.args.get('seniority') or None,
+                       any_skill=request.args.get('any', '') in ('1', 'true'))
+    offers = [{"key": key, **{k: index.docs[key][k] for k in ('Poste', 'Entreprise', 'seniority', 'skills')}}
+              for key in sorted(keys)]
+    return jsonify({"count": len(offers), "total": len(index),
+                    "elapsed_ms": round((time.perf_counter() - t0) * 1000, 2), "offers": offers})
+
 # --- STEP 1: SCRAPING / RAW INPUT ---
 @app.route('/api/step1', methods=['POST'])
 def step1_scrape():
@@ -133,18 +212,43 @@ def step1_scrape():
     
     if mode == 'text':
         raw_text = data.get('text', '')
-        run_task('step1', parse_raw_job_text, raw_text=raw_text)
+        run_task('step1', parse_raw_job_text, profile=profile_requested(), raw_text=raw_text)
+    elif mode == 'bulk':
+        # Many ads in one payload (separated by '---' lines) and/or an uploaded .txt file
+        raw_text = data.get('text', '')
+        filename = data.get('filename')
+        file_path = os.path.join(UPLOADS_DIR, os.path.basename(filename)) if filename else None
+        run_task('step1', parse_raw_job_texts, profile=profile_requested(),
+                 raw_text=raw_text,
+                 file_path=file_path,
+                 delimiter=data.get('delimiter') or None,
+                 append=bool(data.get('append', True)))
     else:
         keyword = data.get('keyword', 'Data Analyst')
         num_jobs = int(data.get('num_jobs', 5))
-        run_task('step1', scrape_jobs, keyword=keyword, num_jobs=num_jobs)
+        run_task('step1', scrape_jobs, profile=profile_requested(), keyword=keyword, num_jobs=num_jobs)
         
     return jsonify({"status": "started"})
 
+@app.route('/api/step1/upload', methods=['POST'])
+def upload_ads_file():
+    if 'file' not in request.files:
+        return jsonify({"error": "No file part"}), 400
+    file = request.files['file']
+    if file.filename == '':
+        return jsonify({"error": "No selected file"}), 400
+
+    filename = os.path.basename(file.filename)
+    if not filename.lower().endswith('.txt'):
+        return jsonify({"error": "Seuls les fichiers .txt sont acceptés"}), 400
+    os.makedirs(UPLOADS_DIR, exist_ok=True)
+    file.save(os.path.join(UPLOADS_DIR, filename))
+    return jsonify({"status": "ok", "filename": filename})
+
 # --- STEP 2: JOB REWRITE ---
 @app.route('/api/step2', methods=['POST'])
 def step2_rewrite_jobs():
-    run_task('step2', rewrite_jobs)
+    run_task('step2', rewrite_jobs, profile=profile_requested())
     return jsonify({"status": "started"})
 
 # --- STEP 3: CV CONVERT ---
@@ -166,32 +270,107 @@ def step3_convert_cv():
     filename = data.get('filename')
     
     pdf_path = os.path.join(DATA_DIR, filename)
-    run_task('step3', convert_cv_to_txt, pdf_path=pdf_path)
+    run_task('step3', convert_cv_to_txt, profile=profile_requested(), pdf_path=pdf_path)
     return jsonify({"status": "started"})
 
 # --- STEP 4: CV REWRITE ---
 @app.route('/api/step4', methods=['POST'])
 def step4_rewrite_cv():
-    run_task('step4', rewrite_cv)
+    run_task('step4', rewrite_cv, profile=profile_requested())
     return jsonify({"status": "started"})
 
 # --- STEP 5: MATCHING ---
 @app.route('/api/step5', methods=['POST'])
 def step5_matching():
-    run_task('step5', calculate_matches)
+    run_task('step5', calculate_matches, profile=profile_requested())
     return jsonify({"status": "started"})
 
 # --- STEP 6: CROSS MATCHING ---
 @app.route('/api/step6', methods=['POST'])
 def step6_cross_matching():
-    run_task('step6', calculate_cross_matches)
+    run_task('step6', calculate_cross_matches, profile=profile_requested())
+    return jsonify({"status": "started"})
+
+# --- STEPS 5 + 6: UNIFIED MATCHING ---
+@app.route('/api/matching', methods=['POST'])
+def unified_matching():
+    data = request.get_json(silent=True) or {}
+    # Default scorers: bi-encoder and cross-encoder, ranked by the cross-encoder
+    kwargs = {'scorers': data['scorers']} if data.get('scorers') else {}
+    run_task('matching', run_matching, profile=profile_requested(),
+             rank_by=data.get('rank_by') or None, **kwargs)
     return jsonify({"status": "started"})
 
 # --- STEP 7: EXPLAIN MATCHES ---
 @app.route('/api/step7', methods=['POST'])
 def step7_explain_matches():
-    run_task('step7', explain_matches)
+    data = request.get_json(silent=True) or {}
+    # Pre-generate only the head of the ranking; the rest is explained on demand
+    top_n = data.get('top_n', 10)
+    min_score = data.get('min_score')
+    # 'heuristic': instant rationale for every row, Qwen only for the rows opened by the user
+    run_task('step7', explain_matches, profile=profile_requested(),
+             top_n=int(top_n) if top_n not in (None, '') else None,
+             min_score=float(min_score) if min_score not in (None, '') else None,
+             mode=data.get('mode') or None)
     return jsonify({"status": "started"})
 
+# On-demand explanations generated in the background, by (source, rank): the request only
+# starts the job and the UI polls the same route until the result is there
+_explain_jobs = {}
+_explain_jobs_lock = threading.Lock()
+
+def _run_explain_job(job_key):
+    source, rank = job_key
+    try:
+        result = {"status": "done", "result": explain_match(rank, source=source)}
+    except (FileNotFoundError, IndexError) as e:
+        result = {"status": "error", "error": str(e), "code": 404}
+    except Exception as e:
+        result = {"status": "error", "error": str(e), "code": 500}
+    with _explain_jobs_lock:
+        _explain_jobs[job_key] = result
+
+@app.route('/api/explain/<int:rank>', methods=['GET', 'POST'])
+def explain_single_match(rank):
+    """
+    Explanation of one match when the user opens it: served inline from the cache, otherwise
+    generated in the background ({"status": "running"}, 202) and returned by a later poll.
+    """
+    source = request.args.get('source')
+    if source not in (None, 'matching', 'step5', 'step6', 'step7'):
+        return jsonify({"error": f"Source inconnue : {source}"}), 400
+    job_key = (source, rank)
+    with _explain_jobs_lock:
+        job = _explain_jobs.get(job_key)
+        if job is not None and job["status"] != "running":
+            del _explain_jobs[job_key]
+    if job is not None:
+        if job["status"] == "done":
+            return jsonify(job["result"])
+        if job["status"] == "error":
+            return jsonify({"error": job["error"]}), job["code"]
+        return jsonify({"status": "running"}), 202
+
+    try:
+        cached = explain_match(rank, source=source, generate=False)
+    except (FileNotFoundError, IndexError) as e:
+        return jsonify({"error": str(e)}), 404
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    if cached is not None:
+        return jsonify(cached)
+
+    with _explain_jobs_lock:
+        if job_key not in _explain_jobs:
+            _explain_jobs[job_key] = {"status": "running"}
+            threading.Thread(target=_run_explain_job, args=(job_key,), daemon=True).start()
+    return jsonify({"status": "running"}), 202
+
+STARTUP_SECONDS = time.perf_counter() - _startup_t0
+
 if __name__ == '__main__':
+    # With the debug reloader, only the serving child process warms up
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        start_warm_up(progress_callback=print)
     app.run(debug=True, port=5000)
@@ -0,0 +1,354 @@
+import numpy as np
+import os
+import re
+import json
+import math
+import struct
+import hashlib
+import unicodedata
+from collections import Counter
+
+from utils.jobs import job_key, job_keys
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data')
+INDEX_PATH = os.path.join(DATA_DIR, 'index', 'bm25.bin')
+# Bumped when the file layout or the tokenization changes: an index of another version is rebuilt
+INDEX_VERSION = 2
+
+# File layout: magic, header length (uint64), JSON header (metadata, dtype / shape / offset of
+# each array), then the arrays, each aligned on _ALIGN bytes so that they can be mapped in place
+_MAGIC = b"JOBBM25\x00"
+_ALIGN = 64
+
+# Indexed fields and their weight in the term frequency (the title counts double)
+FIELD_WEIGHTS = {'Poste': 2, 'Resume_IA': 1, 'Missions': 1}
+
+K1 = 1.5
+B = 0.75
+
+# Keeps technical tokens such as c++, c#, node.js, power-bi
+_TOKEN = re.compile(r"[a-z0-9]+(?:[+#]+|[.\-][a-z0-9]+)*")
+
+STOPWORDS = {
+    "le", "la", "les", "un", "une", "des", "de", "du", "et", "ou", "en", "au", "aux", "a", "à",
+    "pour", "par", "sur", "dans", "avec", "sans", "ce", "ces", "cet", "cette", "se", "sa", "son",
+    "ses", "vos", "votre", "nos", "notre", "leur", "leurs", "qui", "que", "quoi", "dont", "est",
+    "sont", "être", "etre", "avoir", "vous", "nous", "il", "elle", "ils", "elles", "on", "ne",
+    "pas", "plus", "tres", "très", "the", "and", "of", "to", "in", "for", "with", "an", "h", "f",
+}
+
+
+def tokenize(text):
+    """Lowercased, accent-free tokens without stopwords."""
+    text = unicodedata.normalize('NFKD', str(text).lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return [t for t in _TOKEN.findall(text) if len(t) > 1 and t not in STOPWORDS]
+
+
+def document_terms(row):
+    """Weighted term frequencies of an offer over the indexed fields."""
+    counts = Counter()
+    for field, weight in FIELD_WEIGHTS.items():
+        for token in tokenize(row.get(field, '') or ''):
+            counts[token] += weight
+    return counts
+
+
+def _row_digest(row):
+    """Hash of the indexed fields: a rewritten offer keeps its job key but not its digest."""
+    parts = [str(row.get(field, '')) for field in FIELD_WEIGHTS]
+    return hashlib.sha1("\x1f".join(parts).encode('utf-8')).hexdigest()[:16]
+
+
+def _aligned(size):
+    return -(-size // _ALIGN) * _ALIGN
+
+
+def _write_binary(path, arrays, meta):
+    layout, offset = {}, 0
+    for name, array in arrays.items():
+        layout[name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+        offset += _aligned(array.nbytes)
+    header = json.dumps({"meta": meta, "arrays": layout}).encode('utf-8')
+    data_start = _aligned(len(_MAGIC) + 8 + len(header))
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(_MAGIC)
+        f.write(struct.pack('<Q', len(header)))
+        f.write(header)
+        for name, array in arrays.items():
+            f.seek(data_start + layout[name]["offset"])
+            f.write(np.ascontiguousarray(array).tobytes())
+        f.truncate(data_start + offset)
+    os.replace(tmp_path, path)
+
+
+def _read_binary(path):
+    """(metadata, arrays) of an index file; the arrays are read-only memory maps of the file."""
+    with open(path, 'rb') as f:
+        if f.read(len(_MAGIC)) != _MAGIC:
+            return {}, {}
+        (size,) = struct.unpack('<Q', f.read(8))
+        header = json.loads(f.read(size))
+    data_start = _aligned(len(_MAGIC) + 8 + size)
+    arrays = {}
+    for name, spec in header["arrays"].items():
+        shape = tuple(spec["shape"])
+        if not np.prod(shape):
+            arrays[name] = np.empty(shape, dtype=spec["dtype"])
+        else:
+            arrays[name] = np.memmap(path, dtype=spec["dtype"], mode='r', offset=data_start + spec["offset"], shape=shape)
+    return header["meta"], arrays
+
+
+def extract_cv_skills(cv_text):
+    """
+    Query text for the lexical stage: title and hard skills sections of the CV synthesis
+    (step 4 template), or the whole text when the sections are not found.
+    """
+    match = re.search(r"###\s*1\..*?(?=###\s*3\.)", cv_text, flags=re.S)
+    return match.group(0) if match else cv_text
+
+
+class BM25Index:
+    """
+    Inverted index over the offers, stored on disk as one binary file (data/index/bm25.bin)
+    whose arrays are memory-mapped on load. Postings are in CSR form: the sorted vocabulary,
+    the offset of each term, then the doc ids and term frequencies of every posting.
+
+    Extended incrementally: an offer already indexed with the same content is skipped, a
+    rewritten one (same job key, other content) replaces its postings, and `prune` drops the
+    offers that left the store, so that IDF and the average length only count current offers.
+    Replaced and dropped documents are skipped in memory and compacted away by `save`.
+    """
+
+    def __init__(self, path=INDEX_PATH):
+        self.path = path
+        self.keys = []
+        self.digests = []
+        self.lengths = []
+        self.alive = []
+        self._positions = {}
+        # Saved postings (CSR, memory-mapped) and postings added since the last save
+        self._terms = np.empty(0, dtype='S1')
+        self._offsets = np.zeros(1, dtype=np.int64)
+        self._doc_ids = np.empty(0, dtype=np.int32)
+        self._tfs = np.empty(0, dtype=np.float32)
+        self._pending = {}
+        self._stats = None
+
+    @classmethod
+    def load(cls, path=INDEX_PATH):
+        index = cls(path)
+        if os.path.exists(path):
+            meta, arrays = _read_binary(path)
+            if meta.get("version") == INDEX_VERSION:
+                index.keys = [key.decode('ascii') for key in arrays['keys']]
+                index.digests = [digest.decode('ascii') for digest in arrays['digests']]
+                index.lengths = arrays['lengths'].tolist()
+                index.alive = [True] * len(index.keys)
+                index._terms = arrays['terms']
+                index._offsets = arrays['offsets']
+                index._doc_ids = arrays['doc_ids']
+                index._tfs = arrays['tfs']
+        index._positions = {key: i for i, key in enumerate(index.keys)}
+        return index
+
+    def save(self):
+        """Writes the live documents only (renumbered), merging the pending postings into the CSR arrays."""
+        alive = np.asarray(self.alive, dtype=bool)
+        new_ids = np.cumsum(alive) - 1
+
+        pending_terms = np.asarray([term.encode('utf-8') for term in self._pending], dtype='S')
+        vocabulary = np.union1d(np.asarray(self._terms), pending_terms) if len(pending_terms) else np.asarray(self._terms)
+        term_col = [np.repeat(np.searchsorted(vocabulary, self._terms), np.diff(self._offsets))]
+        doc_col = [np.asarray(self._doc_ids, dtype=np.int64)]
+        tf_col = [np.asarray(self._tfs, dtype=np.float32)]
+        for term_id, (ids, tfs) in zip(np.searchsorted(vocabulary, pending_terms), self._pending.values()):
+            term_col.append(np.full(len(ids), term_id, dtype=np.int64))
+            doc_col.append(np.asarray(ids, dtype=np.int64))
+            tf_col.append(np.asarray(tfs, dtype=np.float32))
+        term_col, doc_col, tf_col = np.concatenate(term_col), np.concatenate(doc_col), np.concatenate(tf_col)
+
+        live = alive[doc_col]
+        term_col, doc_col, tf_col = term_col[live], new_ids[doc_col[live]], tf_col[live]
+        order = np.lexsort((doc_col, term_col))
+        counts = np.bincount(term_col, minlength=len(vocabulary))
+        used = counts > 0
+
+        arrays = {
+            "keys": np.asarray([k.encode('ascii') for k, a in zip(self.keys, self.alive) if a], dtype='S16'),
+            "digests": np.asarray([d.encode('ascii') for d, a in zip(self.digests, self.alive) if a], dtype='S16'),
+            "lengths": np.asarray(self.lengths, dtype=np.float32)[alive],
+            "terms": vocabulary[used],
+            "offsets": np.concatenate([[0], np.cumsum(counts[used])]).astype(np.int64),
+            "doc_ids": doc_col[order].astype(np.int32),
+            "tfs": tf_col[order],
+        }
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        _write_binary(self.path, arrays, {"version": INDEX_VERSION})
+
+        self.keys = [key.decode('ascii') for key in arrays['keys']]
+        self.digests = [digest.decode('ascii') for digest in arrays['digests']]
+        self.lengths = arrays['lengths'].tolist()
+        self.alive = [True] * len(self.keys)
+        self._positions = {key: i for i, key in enumerate(self.keys)}
+        self._terms, self._offsets = arrays['terms'], arrays['offsets']
+        self._doc_ids, self._tfs = arrays['doc_ids'], arrays['tfs']
+        self._pending = {}
+        self._stats = None
+
+    def __len__(self):
+        return len(self._positions)
+
+    def __contains__(self, key):
+        return key in self._positions
+
+    def positions(self, keys):
+        return np.asarray([self._positions[key] for key in keys], dtype=np.int64)
+
+    def add_documents(self, df_jobs):
+        """
+        Indexes the offers of `df_jobs` that are new or whose indexed content changed (the old
+        postings of a changed offer stop counting). Returns the number indexed.
+        """
+        changed = 0
+        for row in df_jobs.fillna('').to_dict(orient='records'):
+            key = job_key(row)
+            digest = _row_digest(row)
+            old = self._positions.get(key)
+            if old is not None:
+                if self.digests[old] == digest:
+                    continue
+                self.alive[old] = False
+            doc_id = len(self.keys)
+            terms = document_terms(row)
+            self.keys.append(key)
+            self.digests.append(digest)
+            self.lengths.append(sum(terms.values()))
+            self.alive.append(True)
+            self._positions[key] = doc_id
+            for term, tf in terms.items():
+                ids, tfs = self._pending.setdefault(term, ([], []))
+                ids.append(doc_id)
+                tfs.append(tf)
+            changed += 1
+        if changed:
+            self._stats = None
+        return changed
+
+    def prune(self, keys):
+        """Drops the indexed offers whose job key is not in `keys` (offers removed from the store). Returns the number dropped."""
+        keys = set(keys)
+        removed = [key for key in self._positions if key not in keys]
+        for key in removed:
+            self.alive[self._positions.pop(key)] = False
+        if removed:
+            self._stats = None
+        return len(removed)
+
+    def _postings(self, term):
+        """(doc ids, term frequencies) of `term`: saved postings followed by pending ones."""
+        ids, tfs = [], []
+        encoded = term.encode('utf-8')
+        i = int(np.searchsorted(self._terms, encoded))
+        if i < len(self._terms) and self._terms[i] == encoded:
+            start, end = self._offsets[i], self._offsets[i + 1]
+            ids.append(np.asarray(self._doc_ids[start:end], dtype=np.int64))
+            tfs.append(np.asarray(self._tfs[start:end], dtype=np.float32))
+        if term in self._pending:
+            ids.append(np.asarray(self._pending[term][0], dtype=np.int64))
+            tfs.append(np.asarray(self._pending[term][1], dtype=np.float32))
+        if not ids:
+            return None, None
+        return np.concatenate(ids), np.concatenate(tfs)
+
+    def _collection_stats(self):
+        """(live mask, length normalization per doc), cached until the next change."""
+        if self._stats is None:
+            alive = np.asarray(self.alive, dtype=bool)
+            lengths = np.asarray(self.lengths, dtype=np.float32)
+            avg_length = max(float(lengths[alive].mean()), 1e-6) if alive.any() else 1.0
+            self._stats = (alive, K1 * (1 - B + B * lengths / avg_length))
+        return self._stats
+
+    def score(self, query_text):
+        """
+        BM25 score of every document slot for `query_text` (query terms counted once). Replaced
+        and dropped documents score 0 and are left out of the IDF and the average length.
+        """
+        alive, norm = self._collection_stats()
+        n_docs = int(alive.sum())
+        scores = np.zeros(len(self.keys), dtype=np.float32)
+        if not n_docs:
+            return scores
+
+        for term in set(tokenize(query_text)):
+            ids, tfs = self._postings(term)
+            if ids is None:
+                continue
+            live = alive[ids]
+            ids, tfs = ids[live], tfs[live]
+            if not len(ids):
+                continue
+            idf = math.log(1 + (n_docs - len(ids) + 0.5) / (len(ids) + 0.5))
+            scores[ids] += idf * tfs * (K1 + 1) / (tfs + norm[ids])
+        return scores
+
+    def search(self, query_text, top_n=100):
+        """Top-N offers as (job key, score), best first; offers without any query term are left out."""
+        scores = self.score(query_text)
+        top_n = min(top_n, int((scores > 0).sum()))
+        if top_n <= 0:
+            return []
+        best = np.argpartition(-scores, top_n - 1)[:top_n]
+        best = best[np.argsort(-scores[best], kind='stable')]
+        return [(self.keys[i], float(scores[i])) for i in best]
+
+
+def update_index(df_jobs, path=INDEX_PATH, progress_callback=None):
+    """
+    Syncs the on-disk index with the offer store (called at ingestion, after step 2): new and
+    rewritten offers are indexed, offers no longer in `df_jobs` are dropped.
+    """
+    index = BM25Index.load(path)
+    changed = index.add_documents(df_jobs)
+    removed = index.prune(job_keys(df_jobs))
+    if changed or removed or not os.path.exists(path):
+        index.save()
+    if progress_callback:
+        progress_callback(f"Index BM25 : {changed} offre(s) indexée(s), {removed} retirée(s), {len(index)} au total.")
+    return index
+
+
+def load_index_for(df_jobs, path=INDEX_PATH, progress_callback=None):
+    """Loads the index and indexes any offer of `df_jobs` that is missing or outdated (older runs, external CSV)."""
+    index = BM25Index.load(path)
+    changed = index.add_documents(df_jobs)
+    if changed:
+        if progress_callback:
+            progress_callback(f"Index BM25 : {changed} offre(s) manquante(s) ou modifiée(s) indexée(s).")
+        index.save()
+    return index
+
+
+if __name__ == '__main__':
+    import argparse
+    import pandas as pd
+
+    parser = argparse.ArgumentParser(description="Index BM25 des offres (construction et recherche).")
+    parser.add_argument("--jobs", default=os.path.join(DATA_DIR, "jobs_rewritten.csv"), help="CSV des offres à indexer")
+    parser.add_argument("--query", default=None, help="Requête libre (défaut : compétences de data/cv_synthesized.txt)")
+    parser.add_argument("--top-n", type=int, default=10)
+    args = parser.parse_args()
+
+    df = pd.read_csv(args.jobs)
+    index = update_index(df, progress_callback=print)
+    query = args.query
+    if query is None:
+        with open(os.path.join(DATA_DIR, "cv_synthesized.txt"), 'r', encoding='utf-8') as f:
+            query = extract_cv_skills(f.read())
+    titles = {job_key(row): row.get('Poste', '') for row in df.fillna('').to_dict(orient='records')}
+    for key, score in index.search(query, top_n=args.top_n):
+        print(f"{score:7.2f}  {titles.get(key, key)}")
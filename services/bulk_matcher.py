@@ -0,0 +1,251 @@
+import pandas as pd
+import numpy as np
+import os
+import sys
+import time
+
+from services.model_loader import (
+    load_bi_encoder, load_cross_encoder, BI_ENCODER_MODEL_NAME, CROSS_ENCODER_MODEL_NAME,
+    get_quantization_mode, get_encoder_backend, free_memory,
+)
+from services.matcher import build_job_texts
+from services.cross_encoder_matcher import sigmoid
+from services.sharded_scoring import (
+    ShardedScorer, sharding_enabled, model_sharding_enabled, sharded_encode, sharded_predict,
+)
+from utils.artifacts import write_csv
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data')
+OUTPUT_DIR = os.path.join(DATA_DIR, 'bulk')
+
+JOB_INFO_COLUMNS = ['Poste', 'Entreprise', 'Lien']
+
+
+def load_cvs(cv_dir):
+    """Reads every .txt of `cv_dir` (one CV per file). Returns (cv_ids, cv_texts)."""
+    cv_ids, cv_texts = [], []
+    for filename in sorted(os.listdir(cv_dir)):
+        if not filename.lower().endswith('.txt'):
+            continue
+        with open(os.path.join(cv_dir, filename), 'r', encoding='utf-8') as f:
+            text = f.read().strip()
+        if text:
+            cv_ids.append(os.path.splitext(filename)[0])
+            cv_texts.append(text)
+    return cv_ids, cv_texts
+
+
+def top_k_indices(scores, k, axis=1):
+    """
+    Indices of the k best scores along `axis`, sorted best first.
+    argpartition keeps it linear in the number of candidates.
+    """
+    if axis == 0:
+        return top_k_indices(scores.T, k, axis=1)
+    k = min(k, scores.shape[1])
+    if k <= 0:
+        return np.empty((scores.shape[0], 0), dtype=np.int64)
+    part = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(scores, part, axis=1), axis=1, kind='stable')
+    return np.take_along_axis(part, order, axis=1)
+
+
+def encode_texts(model, cv_texts, job_texts, batch_size=32, progress_callback=None):
+    """
+    Normalized CV and offer vectors. A large offer set is encoded over worker processes
+    (JOBAPP_SCORING_WORKERS): `model` encodes one share, each worker loads its own copy.
+    """
+    cv_vectors = np.asarray(model.encode(cv_texts, batch_size=batch_size, normalize_embeddings=True), dtype=np.float32)
+    if model_sharding_enabled(len(job_texts)):
+        job_vectors = sharded_encode(job_texts, BI_ENCODER_MODEL_NAME, batch_size=batch_size, model=model,
+                                     progress_callback=progress_callback)
+    else:
+        job_vectors = np.asarray(model.encode(job_texts, batch_size=batch_size, normalize_embeddings=True), dtype=np.float32)
+    return cv_vectors, job_vectors
+
+
+def score_matrix(cv_vectors, job_vectors, progress_callback=None):
+    """
+    (n_cvs, n_jobs) matrix of cosine similarities (x100), as a single matrix product of
+    normalized vectors, sharded over worker processes / hosts for large offer sets.
+    """
+    if sharding_enabled(len(job_vectors)):
+        with ShardedScorer(job_vectors, progress_callback=progress_callback) as scorer:
+            return scorer.scores(cv_vectors) * 100
+    return cv_vectors @ job_vectors.T * 100
+
+
+def compute_score_matrix(model, cv_texts, job_texts, batch_size=32, progress_callback=None):
+    """Encodes all CVs and offers in batches and returns their score matrix (see score_matrix)."""
+    cv_vectors, job_vectors = encode_texts(model, cv_texts, job_texts, batch_size, progress_callback)
+    return score_matrix(cv_vectors, job_vectors, progress_callback)
+
+
+def rerank_top_k(model, cv_texts, job_texts, candidates, batch_size=32, progress_callback=None):
+    """Cross-encoder scores (0-100, same scale as step 6) of each CV's top-K offers."""
+    pairs = [[cv_texts[i], job_texts[j]] for i, row in enumerate(candidates) for j in row]
+    if not pairs:
+        return np.empty(candidates.shape, dtype=np.float32)
+    if model_sharding_enabled(len(pairs)):
+        scores = sharded_predict(pairs, CROSS_ENCODER_MODEL_NAME, batch_size=batch_size, progress_callback=progress_callback)
+    else:
+        scores = np.asarray(model.predict(pairs, batch_size=batch_size), dtype=np.float32)
+    return (sigmoid(scores) * 100).reshape(candidates.shape)
+
+
+def calculate_bulk_matches(cv_dir=None, jobs_csv_path=None, top_k=10, job_top_k=10, rerank=False,
+                           batch_size=32, output_dir=None, save_matrix=False, progress_callback=None):
+    """
+    Matches a pool of CVs against the offers set.
+    Writes the per-CV top-K (cv_top_matches.csv) and per-offer top-K (job_top_candidates.csv)
+    rankings to `output_dir` (default: data/bulk/). With `rerank`, the per-CV top-K is
+    re-scored with the cross-encoder and re-sorted on that score. With a sharded offer set
+    (and no `save_matrix`), both rankings come from the workers' partial top-K: the full
+    matrix is never built.
+    Returns the output directory.
+    """
+    if cv_dir is None:
+        cv_dir = os.path.join(DATA_DIR, "cv_converted")
+    if jobs_csv_path is None:
+        jobs_csv_path = os.path.join(DATA_DIR, "jobs_rewritten.csv")
+    if output_dir is None:
+        output_dir = OUTPUT_DIR
+
+    if not os.path.isdir(cv_dir):
+        if progress_callback:
+            progress_callback(f"❌ Erreur : Dossier de CVs introuvable : {cv_dir}")
+        return None
+
+    if not os.path.exists(jobs_csv_path):
+        if progress_callback:
+            progress_callback("❌ Erreur : Offres réécrites manquantes. Veuillez lancer l'étape 2.")
+        return None
+
+    # 1. Read Data
+    try:
+        cv_ids, cv_texts = load_cvs(cv_dir)
+        df_jobs = pd.read_csv(jobs_csv_path).fillna('')
+    except Exception as e:
+        if progress_callback:
+            progress_callback(f"❌ Erreur lecture fichiers : {e}")
+        return None
+
+    if not cv_texts or df_jobs.empty:
+        if progress_callback:
+            progress_callback(f"❌ Erreur : {len(cv_texts)} CV(s) et {len(df_jobs)} offre(s), rien à matcher.")
+        return None
+
+    job_texts = build_job_texts(df_jobs).tolist()
+    for col in JOB_INFO_COLUMNS:
+        if col not in df_jobs.columns:
+            df_jobs[col] = ''
+
+    # 2. Bi-encoder: full score matrix
+    if progress_callback:
+        progress_callback(f"Chargement du modèle '{BI_ENCODER_MODEL_NAME}' (précision : {get_quantization_mode()}, backend : {get_encoder_backend()})...")
+    model = load_bi_encoder(BI_ENCODER_MODEL_NAME, progress_callback=progress_callback)
+
+    if progress_callback:
+        progress_callback(f"Vectorisation de {len(cv_texts)} CVs et {len(job_texts)} offres (lots de {batch_size})...")
+    t0 = time.perf_counter()
+    cv_vectors, job_vectors = encode_texts(model, cv_texts, job_texts, batch_size, progress_callback)
+    model = None
+    free_memory()
+    os.makedirs(output_dir, exist_ok=True)
+
+    job_candidates = job_scores = None
+    if sharding_enabled(len(job_texts)) and not save_matrix:
+        # Only the rankings are needed: workers return the per-CV partial top-K of their offers,
+        # and the complete per-offer top-K (each offer lives in a single shard)
+        with ShardedScorer(job_vectors, progress_callback=progress_callback) as scorer:
+            cv_candidates, cv_scores = scorer.top_k(cv_vectors, top_k)
+            if job_top_k:
+                job_candidates, job_scores = scorer.best_queries(cv_vectors, job_top_k)
+                job_scores = job_scores * 100
+        cv_scores = cv_scores * 100
+        if progress_callback:
+            progress_callback(f"Top-{top_k} de {len(cv_texts)} CVs sur {len(job_texts)} offres en {time.perf_counter() - t0:.1f}s")
+    else:
+        scores = score_matrix(cv_vectors, job_vectors, progress_callback)
+        if progress_callback:
+            progress_callback(f"Matrice {scores.shape[0]}x{scores.shape[1]} calculée en {time.perf_counter() - t0:.1f}s")
+        if save_matrix:
+            np.save(os.path.join(output_dir, "score_matrix.npy"), scores)
+        cv_candidates = top_k_indices(scores, top_k, axis=1)
+        cv_scores = np.take_along_axis(scores, cv_candidates, axis=1)
+        if job_top_k:
+            job_candidates = top_k_indices(scores, job_top_k, axis=0)
+            job_scores = np.take_along_axis(scores.T, job_candidates, axis=1)
+
+    # 3. Per-CV top-K (optionally reranked)
+    cross_scores = None
+    if rerank:
+        if progress_callback:
+            progress_callback(f"Reranking Cross-Encoder de {cv_candidates.size} paires ({CROSS_ENCODER_MODEL_NAME})...")
+        # Sharded reranking: the workers load their own reranker, none is needed here
+        cross_model = None if model_sharding_enabled(cv_candidates.size) else \
+            load_cross_encoder(CROSS_ENCODER_MODEL_NAME, progress_callback=progress_callback)
+        cross_scores = rerank_top_k(cross_model, cv_texts, job_texts, cv_candidates, batch_size=batch_size,
+                                    progress_callback=progress_callback)
+        cross_model = None
+        free_memory()
+        order = np.argsort(-cross_scores, axis=1, kind='stable')
+        cv_candidates = np.take_along_axis(cv_candidates, order, axis=1)
+        cv_scores = np.take_along_axis(cv_scores, order, axis=1)
+        cross_scores = np.take_along_axis(cross_scores, order, axis=1)
+
+    job_info = df_jobs[JOB_INFO_COLUMNS].to_dict(orient='records')
+    cv_rows = []
+    for i, row in enumerate(cv_candidates):
+        for rank, j in enumerate(row):
+            record = {"CV_ID": cv_ids[i], "Rang": rank + 1, **job_info[j], "match_score": float(cv_scores[i, rank])}
+            if cross_scores is not None:
+                record["cross_score"] = float(cross_scores[i, rank])
+            cv_rows.append(record)
+    cv_output = os.path.join(output_dir, "cv_top_matches.csv")
+    write_csv(pd.DataFrame(cv_rows), cv_output, inputs=(jobs_csv_path, *cv_ids), index=False)
+
+    # 4. Per-offer top-K candidates
+    outputs = [cv_output]
+    if job_top_k:
+        job_rows = []
+        for j, row in enumerate(job_candidates):
+            for rank, i in enumerate(row):
+                job_rows.append({**job_info[j], "Rang": rank + 1, "CV_ID": cv_ids[i], "match_score": float(job_scores[j, rank])})
+        job_output = os.path.join(output_dir, "job_top_candidates.csv")
+        write_csv(pd.DataFrame(job_rows), job_output, inputs=(jobs_csv_path, *cv_ids), index=False)
+        outputs.append(job_output)
+
+    if progress_callback:
+        progress_callback(f"✅ Matching en masse terminé : {', '.join(outputs)}")
+
+    return output_dir
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Matching en masse : un dossier de CVs contre toutes les offres.")
+    parser.add_argument("--cv-dir", default=None, help="Dossier de CVs .txt (défaut : data/cv_converted)")
+    parser.add_argument("--jobs", default=None, help="CSV des offres (défaut : data/jobs_rewritten.csv)")
+    parser.add_argument("--top-k", type=int, default=10, help="Offres retenues par CV")
+    parser.add_argument("--job-top-k", type=int, default=10, help="Candidats retenus par offre (0 : pas de classement par offre)")
+    parser.add_argument("--rerank", action="store_true", help="Re-score le top-K de chaque CV au Cross-Encoder")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--output-dir", default=None, help="Dossier de sortie (défaut : data/bulk)")
+    parser.add_argument("--save-matrix", action="store_true", help="Sauvegarde aussi la matrice complète (.npy)")
+    args = parser.parse_args()
+
+    result = calculate_bulk_matches(
+        cv_dir=args.cv_dir,
+        jobs_csv_path=args.jobs,
+        top_k=args.top_k,
+        job_top_k=args.job_top_k,
+        rerank=args.rerank,
+        batch_size=args.batch_size,
+        output_dir=args.output_dir,
+        save_matrix=args.save_matrix,
+        progress_callback=print,
+    )
+    # Non-zero exit code for schedulers (nightly runs)
+    sys.exit(0 if result else 1)
@@ -1,8 +1,17 @@
 import pdfplumber
 import re
 import os
+import hashlib
+import json
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from utils.artifacts import write_text, record_version
 
 DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data')
+CACHE_DIR = os.path.join(DATA_DIR, 'cache', 'cv_text')
+
+# Below this page count, spawning worker processes costs more than it saves
+PARALLEL_MIN_PAGES = 4
 
 def nettoyer_texte_avance(texte: str) -> str:
     """
@@ -13,14 +22,115 @@ def nettoyer_texte_avance(texte: str) -> str:
 
     def replacer_lettres_isolees(match):
         return match.group(0).replace(" ", "")
-    
+
     texte = re.sub(r'(?:\b[A-Za-z0-9À-ÿ]\s){3,}[A-Za-z0-9À-ÿ]\b', replacer_lettres_isolees, texte)
     texte = re.sub(r'\n\s*\n', '\n\n', texte)
     texte = re.sub(r'[ \t]+', ' ', texte)
 
     return texte.strip()
 
-def convert_cv_to_txt(pdf_path, progress_callback=None):
+def hash_pdf(pdf_path):
+    """SHA-256 of the PDF content, used as cache key (same file re-uploaded => same key)."""
+    h = hashlib.sha256()
+    with open(pdf_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+def _extract_pages(pdf_path, page_numbers=None):
+    """
+    Extracts and cleans the given pages (all if None).
+    Top-level function so it can run in a worker process: pdfplumber objects are not picklable,
+    each worker re-opens the file.
+    Returns a list of (page_index, cleaned_text or None).
+    """
+    results = []
+    with pdfplumber.open(pdf_path) as pdf:
+        indices = range(len(pdf.pages)) if page_numbers is None else page_numbers
+        for i in indices:
+            texte_page = pdf.pages[i].extract_text(x_tolerance=2, y_tolerance=2)
+            results.append((i, nettoyer_texte_avance(texte_page) if texte_page else None))
+    return results
+
+def _count_pages(pdf_path):
+    with pdfplumber.open(pdf_path) as pdf:
+        return len(pdf.pages)
+
+def extract_pdf_pages(pdf_path, max_workers=None):
+    """
+    Extracts every page of a PDF, spreading pages over a process pool for multi-page documents.
+    Returns the list of page texts (None for pages without selectable text), in page order.
+    """
+    n_pages = _count_pages(pdf_path)
+    if n_pages == 0:
+        return []
+
+    max_workers = max_workers or os.cpu_count() or 1
+    n_workers = min(max_workers, n_pages)
+
+    if n_pages < PARALLEL_MIN_PAGES or n_workers < 2:
+        results = _extract_pages(pdf_path)
+    else:
+        # Contiguous page ranges, one per worker, so each worker opens the file once
+        step = -(-n_pages // n_workers)
+        chunks = [list(range(start, min(start + step, n_pages))) for start in range(0, n_pages, step)]
+        results = []
+        # Spawned, not forked: the caller is a Flask worker thread that may hold torch / CUDA state and locks
+        with ProcessPoolExecutor(max_workers=n_workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+            futures = [executor.submit(_extract_pages, pdf_path, chunk) for chunk in chunks]
+            for future in as_completed(futures):
+                results.extend(future.result())
+
+    pages = [None] * n_pages
+    for i, texte_page in results:
+        pages[i] = texte_page
+    return pages
+
+def assemble_text(pages):
+    """Builds the final text with '--- PAGE n ---' markers (pages without text are skipped)."""
+    parts = []
+    for i, texte_page in enumerate(pages):
+        if texte_page:
+            parts.append(f"\n--- PAGE {i+1} ---\n")
+            parts.append(texte_page)
+    return "".join(parts)
+
+def _cache_path(pdf_hash):
+    return os.path.join(CACHE_DIR, f"{pdf_hash}.json")
+
+def load_cached_pages(pdf_hash):
+    path = _cache_path(pdf_hash)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)['pages']
+    except Exception:
+        return None
+
+def save_cached_pages(pdf_hash, pages):
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    tmp_path = _cache_path(pdf_hash) + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({"pages": pages}, f, ensure_ascii=False)
+    os.replace(tmp_path, _cache_path(pdf_hash))
+
+def get_pdf_pages(pdf_path, use_cache=True, max_workers=None):
+    """
+    Returns (pages, from_cache). Results are cached by PDF content hash.
+    """
+    pdf_hash = hash_pdf(pdf_path) if use_cache else None
+    if use_cache:
+        pages = load_cached_pages(pdf_hash)
+        if pages is not None:
+            return pages, True
+
+    pages = extract_pdf_pages(pdf_path, max_workers=max_workers)
+    if use_cache and pages:
+        save_cached_pages(pdf_hash, pages)
+    return pages, False
+
+def convert_cv_to_txt(pdf_path, output_path=None, use_cache=True, max_workers=None, progress_callback=None):
     """
     Converts PDF CV to TXT.
     """
@@ -32,32 +142,117 @@ def convert_cv_to_txt(pdf_path, progress_callback=None):
     if progress_callback:
         progress_callback(f"Traitement de la conversion PDF : {os.path.basename(pdf_path)}")
 
-    texte_global = ""
     try:
-        with pdfplumber.open(pdf_path) as pdf:
-            if not pdf.pages:
-                if progress_callback:
-                    progress_callback("⚠️ Le PDF semble vide.")
-                return None
-
-            for i, page in enumerate(pdf.pages):
-                texte_page = page.extract_text(x_tolerance=2, y_tolerance=2)
-                if texte_page:
-                    texte_global += f"\n--- PAGE {i+1} ---\n"
-                    texte_global += nettoyer_texte_avance(texte_page)
-                else:
-                    if progress_callback:
-                        progress_callback(f"⚠️ Page {i+1} : Aucun texte sélectionnable.")
+        pages, from_cache = get_pdf_pages(pdf_path, use_cache=use_cache, max_workers=max_workers)
     except Exception as e:
         if progress_callback:
             progress_callback(f"❌ Erreur lecture PDF : {e}")
         return None
 
-    output_path = os.path.join(DATA_DIR, "cv_converted.txt")
-    with open(output_path, "w", encoding="utf-8") as f:
-        f.write(texte_global)
-    
+    if not pages:
+        if progress_callback:
+            progress_callback("⚠️ Le PDF semble vide.")
+        return None
+
+    if progress_callback:
+        if from_cache:
+            progress_callback("♻️ PDF déjà converti : texte récupéré depuis le cache.")
+        for i, texte_page in enumerate(pages):
+            if not texte_page:
+                progress_callback(f"⚠️ Page {i+1} : Aucun texte sélectionnable.")
+
+    texte_global = assemble_text(pages)
+
+    if output_path is None:
+        output_path = os.path.join(DATA_DIR, "cv_converted.txt")
+    write_text(texte_global, output_path, inputs=(pdf_path,))
+
     if progress_callback:
         progress_callback(f"✅ Conversion terminée : {output_path}")
-    
+
     return output_path
+
+def _convert_one(pdf_path, output_path, use_cache):
+    """Worker for convert_cv_directory: serial page extraction inside one process per document."""
+    try:
+        pdf_hash = hash_pdf(pdf_path) if use_cache else None
+        pages = load_cached_pages(pdf_hash) if use_cache else None
+        from_cache = pages is not None
+        if pages is None:
+            pages = [texte for _, texte in _extract_pages(pdf_path)]
+            if use_cache and pages:
+                save_cached_pages(pdf_hash, pages)
+        if not pages:
+            return pdf_path, None, "PDF vide"
+        # The parent process records the version (see utils.artifacts.record_version)
+        write_text(assemble_text(pages), output_path, record=False)
+        return pdf_path, output_path, "cache" if from_cache else "ok"
+    except Exception as e:
+        return pdf_path, None, str(e)
+
+def convert_cv_directory(input_dir, output_dir=None, use_cache=True, max_workers=None, progress_callback=None):
+    """
+    Converts every PDF of `input_dir` to TXT in parallel (one document per worker process).
+    Each CV is written to `output_dir/<name>.txt` (default: data/cv_converted/).
+    Returns the list of written paths.
+    """
+    if not os.path.isdir(input_dir):
+        if progress_callback:
+            progress_callback(f"❌ Erreur : Dossier inconnu : {input_dir}")
+        return []
+
+    if output_dir is None:
+        output_dir = os.path.join(DATA_DIR, "cv_converted")
+    os.makedirs(output_dir, exist_ok=True)
+
+    pdf_files = sorted(f for f in os.listdir(input_dir) if f.lower().endswith('.pdf'))
+    if not pdf_files:
+        if progress_callback:
+            progress_callback(f"⚠️ Aucun PDF trouvé dans {input_dir}")
+        return []
+
+    if progress_callback:
+        progress_callback(f"Conversion de {len(pdf_files)} CVs depuis {input_dir}...")
+
+    jobs = [
+        (os.path.join(input_dir, f), os.path.join(output_dir, os.path.splitext(f)[0] + ".txt"))
+        for f in pdf_files
+    ]
+
+    written = []
+    n_done = 0
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+        futures = [executor.submit(_convert_one, pdf_path, out_path, use_cache) for pdf_path, out_path in jobs]
+        for future in as_completed(futures):
+            pdf_path, out_path, status = future.result()
+            n_done += 1
+            if out_path:
+                record_version(out_path, inputs=(pdf_path,))
+                written.append(out_path)
+                msg = f"[{n_done}/{len(jobs)}] ✅ {os.path.basename(pdf_path)}" + (" (cache)" if status == "cache" else "")
+            else:
+                msg = f"[{n_done}/{len(jobs)}] ❌ {os.path.basename(pdf_path)} : {status}"
+            if progress_callback:
+                progress_callback(msg)
+
+    if progress_callback:
+        progress_callback(f"✅ Conversion en masse terminée : {len(written)}/{len(jobs)} CVs dans {output_dir}")
+
+    return sorted(written)
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Conversion PDF -> TXT d'un CV ou d'un dossier de CVs.")
+    parser.add_argument("path", help="Fichier PDF ou dossier contenant des PDF")
+    parser.add_argument("--output", help="Fichier (ou dossier en mode dossier) de sortie")
+    parser.add_argument("--workers", type=int, default=None, help="Nombre de processus")
+    parser.add_argument("--no-cache", action="store_true", help="Ignore le cache par hash du PDF")
+    args = parser.parse_args()
+
+    if os.path.isdir(args.path):
+        convert_cv_directory(args.path, output_dir=args.output, use_cache=not args.no_cache,
+                             max_workers=args.workers, progress_callback=print)
+    else:
+        convert_cv_to_txt(args.path, output_path=args.output, use_cache=not args.no_cache,
+                          max_workers=args.workers, progress_callback=print)
@@ -1,57 +1,51 @@
 import torch
-from transformers import AutoModelForCausalLM, AutoTokenizer
+from services.model_loader import load_generation_model, GENERATION_MODEL_NAME, get_quantization_mode
+from services.generation import Generator
+from services.prompt_builder import PromptBuilder
+from services.skill_index import cv_profile_json, CV_PROFILE_PATH
+from utils.artifacts import write_text
 import os
+import re
 import gc
 
 DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data')
 
-def rewrite_cv(cv_txt_path=None, progress_callback=None):
-    """
-    Rewrites CV using Qwen model.
-    """
-    if cv_txt_path is None:
-        cv_txt_path = os.path.join(DATA_DIR, "cv_converted.txt")
-        
-    if not os.path.exists(cv_txt_path):
-        if progress_callback:
-            progress_callback("❌ Erreur : Fichier cv_converted.txt non trouvé. Veuillez lancer l'étape 3.")
-        return None
+# Chunked (map-reduce) synthesis for long CVs: JOBAPP_CV_CHUNKED=auto (default) | 1 | 0.
+# In auto mode, CVs longer than CHUNKED_MIN_TOKENS are split into extracts of at most
+# CHUNK_TOKENS, each summarized into short notes (batched), and only the notes reach the
+# final template prompt, whose input is capped at MERGE_INPUT_TOKENS.
+CHUNKED_MIN_TOKENS = 1500
+CHUNK_TOKENS = 700
+MAP_MAX_NEW_TOKENS = 250
+MERGE_INPUT_TOKENS = 1200
+MAP_BATCH_SIZE = 4
 
-    # 1. Read File
-    with open(cv_txt_path, 'r', encoding='utf-8') as f:
-        cv_content = f.read()
+_PAGE_MARKER = re.compile(r"^\s*---\s*PAGE\s+\d+\s*---\s*$", re.M)
+_HEADING = re.compile(
+    r"^\s*(exp[ée]riences?|formations?|comp[ée]tences|skills|projets?|langues?|certifications?|"
+    r"education|dipl[ôo]mes?|centres? d'int[ée]r[êe]t|loisirs|profil|outils|hard ?skills|soft ?skills)\b",
+    re.I
+)
 
-    # 2. Load Model
-    model_name = "Qwen/Qwen2.5-1.5B-Instruct"
-    if progress_callback:
-        progress_callback(f"Chargement du modèle {model_name}...")
-    
-    try:
-        tokenizer = AutoTokenizer.from_pretrained(model_name)
-        model = AutoModelForCausalLM.from_pretrained(
-            model_name,
-            torch_dtype="auto",
-            device_map="auto",
-            low_cpu_mem_usage=True
-        )
-    except Exception as e:
-        if progress_callback:
-            progress_callback(f"❌ Erreur chargement modèle : {e}")
-        return None
-
-    # 3. Prompt Optimisé pour Qwen 2.5 1.5B
+MAP_PROMPT = """Voici un extrait d'un CV (partie {part}/{total}) :
+---
+{chunk}
+---
+Extrais uniquement les informations professionnelles de cet extrait sous forme de liste à puces courte :
+métier visé, compétences techniques et outils, qualités professionnelles, expériences (intitulé, secteur, durée), diplômes.
+Remplace l'identité du candidat par "Candidat". N'invente rien : si l'extrait ne contient rien d'utile, réponds "RAS"."""
 
-    system_prompt = """Tu es un assistant de synthèse RH.
+SYSTEM_PROMPT = """Tu es un assistant de synthèse RH.
     Ta fonction est de transformer les informations professionnelles d'un CV en une fiche de compétences standardisée.
     Tu dois reformuler le contenu pour qu'il soit totalement neutre et générique.
     Remplace systématiquement l'identité du candidat par le terme : "Candidat".
     Concentre-toi uniquement sur les savoir-faire, les diplômes et l'expérience métier."""
 
-    # ON INVERSE : Le CV est maintenant tout en haut
-    user_prompt = f"""
+# Final prompt: the CV (or its notes) on top, then the template to fill
+USER_PROMPT = """
     DOCUMENT À ANALYSER :
     ---
-    {cv_content}
+    {cv}
     ---
 
     INSTRUCTIONS :
@@ -80,18 +74,153 @@ def rewrite_cv(cv_txt_path=None, progress_callback=None):
     [Lister uniquement les diplômes et certificats obtenus]
     """
 
-    messages = [
-        {"role": "system", "content": system_prompt},
-        {"role": "user", "content": user_prompt}
+
+def get_chunked_mode(mode=None):
+    mode = str(mode if mode is not None else os.environ.get("JOBAPP_CV_CHUNKED", "auto")).strip().lower()
+    if mode in ("1", "true", "on"):
+        return "on"
+    if mode in ("0", "false", "off"):
+        return "off"
+    return "auto"
+
+
+def split_cv(cv_content, count_tokens, max_tokens=CHUNK_TOKENS):
+    """
+    Splits the converted CV on its '--- PAGE n ---' markers, then packs the lines of each page
+    into extracts of at most `max_tokens` tokens, preferring to cut before a section heading
+    (Expérience, Formation, Compétences...). `count_tokens(text)` gives the token count.
+    """
+    chunks = []
+    for page in _PAGE_MARKER.split(cv_content):
+        current, current_tokens = [], 0
+        lines = []
+        for line in page.splitlines():
+            if not line.strip():
+                continue
+            # A line longer than an extract (text without line breaks) is cut on words
+            words = line.split()
+            step = max(1, len(words) * max_tokens // (2 * count_tokens(line) + 1))
+            lines.extend(" ".join(words[i:i + step]) for i in range(0, len(words), step))
+        for line in lines:
+            n = count_tokens(line) + 1
+            starts_section = _HEADING.match(line) and current_tokens > max_tokens // 2
+            if current and (current_tokens + n > max_tokens or starts_section):
+                chunks.append("\n".join(current))
+                current, current_tokens = [], 0
+            current.append(line)
+            current_tokens += n
+        if current:
+            chunks.append("\n".join(current))
+    return chunks
+
+
+def _generate_batch(tokenizer, model, generator, prompts, **gen_kwargs):
+    texts = [
+        tokenizer.apply_chat_template([{"role": "user", "content": prompt}], tokenize=False, add_generation_prompt=True)
+        for prompt in prompts
     ]
+    model_inputs = tokenizer(texts, return_tensors="pt", padding=True).to(model.device)
+    generated_ids = generator.generate(**model_inputs, **gen_kwargs)
+    generated_ids = [
+        output_ids[len(input_ids):] for input_ids, output_ids in zip(model_inputs.input_ids, generated_ids)
+    ]
+    return tokenizer.batch_decode(generated_ids, skip_special_tokens=True)
+
+
+def summarize_chunks(tokenizer, model, generator, chunks, progress_callback=None):
+    """Map step: short notes for each extract, generated MAP_BATCH_SIZE extracts at a time."""
+    # Decoder-only models must be left-padded for batched generation
+    tokenizer.padding_side = "left"
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+
+    notes = []
+    for start in range(0, len(chunks), MAP_BATCH_SIZE):
+        batch = chunks[start:start + MAP_BATCH_SIZE]
+        if progress_callback:
+            progress_callback(f"Résumé des extraits {start + 1}-{start + len(batch)}/{len(chunks)}...")
+        prompts = [MAP_PROMPT.format(part=start + i + 1, total=len(chunks), chunk=chunk) for i, chunk in enumerate(batch)]
+        responses = _generate_batch(tokenizer, model, generator, prompts,
+                                    max_new_tokens=MAP_MAX_NEW_TOKENS, do_sample=False, repetition_penalty=1.1)
+        notes.extend(r.strip() for r in responses if r.strip() and r.strip().upper() != "RAS")
+    return notes
+
 
-    text = tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+def map_reduce_notes(tokenizer, model, generator, cv_content, progress_callback=None):
+    """
+    Notes replacing the full CV in the final prompt. When the notes of all extracts exceed
+    MERGE_INPUT_TOKENS, they are summarized again by groups until they fit, so that the final
+    prompt stays bounded whatever the length of the CV.
+    """
+    def count_tokens(text):
+        return len(tokenizer(text, add_special_tokens=False).input_ids)
+
+    chunks = split_cv(cv_content, count_tokens)
+    if progress_callback:
+        progress_callback(f"Synthèse découpée : {len(chunks)} extrait(s) de {CHUNK_TOKENS} tokens max.")
+    notes = summarize_chunks(tokenizer, model, generator, chunks, progress_callback)
+
+    while notes and count_tokens("\n\n".join(notes)) > MERGE_INPUT_TOKENS:
+        groups = split_cv("\n\n".join(notes), count_tokens, max_tokens=CHUNK_TOKENS)
+        if len(groups) >= len(notes):
+            # Notes that cannot be merged further: keep the head of each one
+            budget = max(1, MERGE_INPUT_TOKENS // len(notes))
+            notes = [tokenizer.decode(tokenizer(n, add_special_tokens=False).input_ids[:budget]) for n in notes]
+            break
+        if progress_callback:
+            progress_callback(f"Notes trop longues pour la fusion : regroupement en {len(groups)} résumé(s)...")
+        notes = summarize_chunks(tokenizer, model, generator, groups, progress_callback)
+
+    return "\n\n".join(notes)
+
+def rewrite_cv(cv_txt_path=None, chunked=None, progress_callback=None):
+    """
+    Rewrites CV using Qwen model.
+    Long CVs are first summarized extract by extract (see JOBAPP_CV_CHUNKED), then the notes
+    are merged into the five-section template.
+    """
+    if cv_txt_path is None:
+        cv_txt_path = os.path.join(DATA_DIR, "cv_converted.txt")
+        
+    if not os.path.exists(cv_txt_path):
+        if progress_callback:
+            progress_callback("❌ Erreur : Fichier cv_converted.txt non trouvé. Veuillez lancer l'étape 3.")
+        return None
+
+    # 1. Read File
+    with open(cv_txt_path, 'r', encoding='utf-8') as f:
+        cv_content = f.read()
+
+    # 2. Load Model
+    model_name = GENERATION_MODEL_NAME
+    if progress_callback:
+        progress_callback(f"Chargement du modèle {model_name} (précision : {get_quantization_mode()})...")
+    
+    try:
+        tokenizer, model = load_generation_model(model_name)
+        generator = Generator(model, tokenizer, stage="step4", progress_callback=progress_callback)
+    except Exception as e:
+        if progress_callback:
+            progress_callback(f"❌ Erreur chargement modèle : {e}")
+        return None
+
+    # Long CVs: map-reduce over pages / sections, the template prompt only sees the notes
+    mode = get_chunked_mode(chunked)
+    n_tokens = len(tokenizer(cv_content, add_special_tokens=False).input_ids)
+    if mode == "on" or (mode == "auto" and n_tokens > CHUNKED_MIN_TOKENS):
+        if progress_callback:
+            progress_callback(f"CV long ({n_tokens} tokens) : synthèse par extraits.")
+        cv_content = map_reduce_notes(tokenizer, model, generator, cv_content, progress_callback)
+
+    # 3. Prompt Optimisé pour Qwen 2.5 1.5B (le CV, ou ses notes, dans le budget de l'étape 4)
+    prompts = PromptBuilder(tokenizer, "step4", progress_callback=progress_callback)
+    text = prompts.build(USER_PROMPT, {"cv": cv_content}, system=SYSTEM_PROMPT)
     model_inputs = tokenizer([text], return_tensors="pt").to(model.device)
 
     if progress_callback:
         progress_callback("Génération de la synthèse CV...")
 
-    generated_ids = model.generate(
+    generated_ids = generator.generate(
         **model_inputs,
         max_new_tokens=1000,
         temperature=0.2,
@@ -106,13 +235,19 @@ def rewrite_cv(cv_txt_path=None, progress_callback=None):
     full_response = tokenizer.batch_decode(generated_ids, skip_special_tokens=True)[0]
 
     output_path = os.path.join(DATA_DIR, "cv_synthesized.txt")
-    with open(output_path, "w", encoding="utf-8") as f:
-        f.write(full_response)
+    write_text(full_response, output_path, inputs=(cv_txt_path,))
+
+    # Sections in structured form (title, hard / soft skills, level), read back by the skill filter
+    write_text(cv_profile_json(full_response), CV_PROFILE_PATH, inputs=(cv_txt_path,))
 
     if progress_callback:
         progress_callback("✅ Synthèse CV terminée.")
 
+    generator.close()
+    prompts.report()
+
     # Cleanup
+    del generator
     del model
     del tokenizer
     if torch.cuda.is_available():
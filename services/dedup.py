@@ -0,0 +1,118 @@
+import numpy as np
+import os
+import re
+import zlib
+import unicodedata
+
+# Fields compared: agencies and reposts keep the missions / profile text but change title and company
+DEDUP_FIELDS = ('Missions', 'Profil_Recherche')
+
+NUM_PERM = 128
+# 16 bands of 8 rows: pairs above ~0.7 Jaccard become candidates, then are checked against the threshold
+BANDS = 16
+SHINGLE_SIZE = 5
+DEFAULT_THRESHOLD = 0.8
+
+_WORD = re.compile(r"\w+")
+
+# Multiply-shift hash family: h(x) = (a * x + b) mod 2^64 >> 32, a odd
+_rng = np.random.default_rng(42)
+_A = (_rng.integers(0, 2**63, NUM_PERM, dtype=np.uint64) * np.uint64(2) + np.uint64(1))
+_B = _rng.integers(0, 2**63, NUM_PERM, dtype=np.uint64)
+
+
+def dedup_enabled():
+    return os.environ.get("JOBAPP_DEDUP", "1") != "0"
+
+
+def get_threshold(threshold=None):
+    return float(threshold if threshold is not None else os.environ.get("JOBAPP_DEDUP_THRESHOLD", DEFAULT_THRESHOLD))
+
+
+def shingles(text, size=SHINGLE_SIZE):
+    """Hashed word n-grams of the normalized text."""
+    text = unicodedata.normalize('NFKD', str(text).lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    words = _WORD.findall(text)
+    if not words:
+        return set()
+    if len(words) < size:
+        return {zlib.crc32(" ".join(words).encode('utf-8'))}
+    return {zlib.crc32(" ".join(words[i:i + size]).encode('utf-8')) for i in range(len(words) - size + 1)}
+
+
+def minhash(shingle_set):
+    """MinHash signature (NUM_PERM values) of a set of 32-bit shingle hashes."""
+    x = np.fromiter(shingle_set, dtype=np.uint64, count=len(shingle_set))
+    hashes = (np.outer(x, _A) + _B) >> np.uint64(32)
+    return hashes.min(axis=0)
+
+
+def offer_text(row):
+    return " ".join(str(row.get(field, '') or '') for field in DEDUP_FIELDS)
+
+
+class _UnionFind:
+    def __init__(self, n):
+        self.parent = list(range(n))
+
+    def find(self, i):
+        while self.parent[i] != i:
+            self.parent[i] = self.parent[self.parent[i]]
+            i = self.parent[i]
+        return i
+
+    def union(self, i, j):
+        ri, rj = self.find(i), self.find(j)
+        if ri != rj:
+            # The smallest index stays the root: the first occurrence represents the cluster
+            self.parent[max(ri, rj)] = min(ri, rj)
+
+
+def find_duplicates(df_jobs, threshold=None, progress_callback=None):
+    """
+    Clusters near-duplicate offers (MinHash + LSH banding over Missions and Profil_Recherche).
+    Returns the list of cluster ids aligned with the rows of `df_jobs`: the position of the
+    cluster representative (its first occurrence), so that representatives have
+    cluster_ids[i] == i.
+    """
+    threshold = get_threshold(threshold)
+    rows = df_jobs.fillna('').to_dict(orient='records')
+    n = len(rows)
+    rows_per_band = NUM_PERM // BANDS
+
+    signatures = [None] * n
+    buckets = {}
+    for i, row in enumerate(rows):
+        shingle_set = shingles(offer_text(row))
+        # Offers without text are never merged
+        if not shingle_set:
+            continue
+        signatures[i] = minhash(shingle_set)
+        for band in range(BANDS):
+            key = (band, signatures[i][band * rows_per_band:(band + 1) * rows_per_band].tobytes())
+            buckets.setdefault(key, []).append(i)
+
+    uf = _UnionFind(n)
+    for members in buckets.values():
+        if len(members) < 2:
+            continue
+        # Each member is compared to one offer per cluster already present in the bucket,
+        # so large groups of reposts stay linear instead of quadratic
+        heads = [members[0]]
+        for b in members[1:]:
+            for a in heads:
+                if uf.find(a) == uf.find(b):
+                    break
+                # Fraction of equal MinHash values estimates the Jaccard similarity
+                if np.mean(signatures[a] == signatures[b]) >= threshold:
+                    uf.union(a, b)
+                    break
+            else:
+                heads.append(b)
+
+    cluster_ids = [uf.find(i) for i in range(n)]
+    if progress_callback:
+        n_unique = len(set(cluster_ids))
+        progress_callback(f"Dédoublonnage : {n - n_unique} doublon(s) détecté(s), {n_unique} offre(s) unique(s) sur {n}.")
+    return cluster_ids
@@ -0,0 +1,329 @@
+import pandas as pd
+import numpy as np
+import torch
+import os
+import time
+import hashlib
+
+from services.model_loader import (
+    load_generation_model, load_bi_encoder, load_cross_encoder,
+    GENERATION_MODEL_NAME, BI_ENCODER_MODEL_NAME, CROSS_ENCODER_MODEL_NAME, free_memory,
+)
+from services.cross_encoder_matcher import sigmoid
+from utils.artifacts import write_csv
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data')
+EVAL_DIR = os.path.join(DATA_DIR, 'eval')
+DATASET_PATH = os.path.join(EVAL_DIR, 'resume_ats.csv')
+
+HF_DATASET = '0xnbk/resume-ats-score-v1-en'
+ATS_THRESHOLD = 0.5   # Ground truth: relevant pair
+PRED_THRESHOLD = 0.55  # Predicted match (the reranker is calibrated around 0.5)
+
+# Configurations compared by default. Keys:
+#   quantization : none / int8 / int4 (generation and encoders)
+#   backend      : torch / onnx (encoders)
+#   denoise      : Qwen extraction of job criteria and candidate profile before scoring
+#   scorer       : cross (reranker on every pair), bi (cosine), bi+cross (reranker on the top-K of the bi-encoder)
+#   rerank_top_k : with bi+cross, pairs outside the bi-encoder top-K are rejected (score 0), as a prefilter would
+CONFIGS = {
+    "full": {"quantization": "none", "backend": "torch", "denoise": True, "scorer": "cross"},
+    "int8": {"quantization": "int8", "backend": "torch", "denoise": True, "scorer": "cross"},
+    "onnx": {"quantization": "none", "backend": "onnx", "denoise": True, "scorer": "cross"},
+    "int8_onnx": {"quantization": "int8", "backend": "onnx", "denoise": True, "scorer": "cross"},
+    "bi": {"quantization": "none", "backend": "torch", "denoise": True, "scorer": "bi"},
+    "rerank_top5": {"quantization": "none", "backend": "torch", "denoise": True, "scorer": "bi+cross", "rerank_top_k": 5},
+    "raw": {"quantization": "none", "backend": "torch", "denoise": False, "scorer": "cross"},
+}
+
+JOB_SYSTEM = "You are an expert Technical Recruiter. Your goal is to extract key requirements from job descriptions."
+JOB_PROMPT = """
+    Analyze the following Job Description and extract the key requirements.
+    Output a concise list of keywords and criteria.
+
+    JOB DESCRIPTION:
+    {text}
+
+    FORMAT YOUR RESPONSE AS:
+    - Role: [Job Title]
+    - Mandatory Hard Skills: [List only the most important technical skills]
+    - Soft Skills: [List key personality traits]
+    - Experience Level: [Junior/Mid/Senior/Years]
+    """
+
+CV_SYSTEM = "You are an expert Resume Analyst. Extract the candidate's core qualifications objectively."
+CV_PROMPT = """
+    Analyze the following Resume/CV. Extract the skills and experience.
+    Ignore fluff and subjective statements.
+
+    RESUME:
+    {text}
+
+    FORMAT YOUR RESPONSE AS:
+    - Current Role: [Title]
+    - Hard Skills: [List technical tools and languages found in text]
+    - Soft Skills: [List soft skills found in text]
+    - Years of Experience: [Total estimated years]
+    """
+
+# Input truncation of the denoising prompts (characters), as in the original protocol
+MAX_INPUT_CHARS = 2000
+
+
+def download_dataset(split='validation', output_path=DATASET_PATH, progress_callback=None):
+    """
+    One-off export of the Hugging Face dataset to a local CSV (resume_text, job_description,
+    ats_score). Requires the optional `datasets` package; evaluations then run offline.
+    """
+    try:
+        from datasets import load_dataset
+    except ImportError:
+        raise RuntimeError("Le paquet 'datasets' est requis pour l'export : pip install datasets")
+
+    df = pd.DataFrame(load_dataset(HF_DATASET, split=split))
+    parts = df['text'].str.split(' SEP ', n=1, expand=True)
+    df_out = pd.DataFrame({
+        'resume_text': parts[0],
+        'job_description': parts[1].fillna('') if 1 in parts else '',
+        'ats_score': df['ats_score'],
+    })
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    write_csv(df_out, output_path, inputs=(HF_DATASET, split), index=False)
+    if progress_callback:
+        progress_callback(f"✅ Jeu d'évaluation exporté : {output_path} ({len(df_out)} paires)")
+    return output_path
+
+
+def load_dataset_file(path=DATASET_PATH, n_samples=None, seed=None):
+    """
+    Labelled pairs from a local CSV: resume_text, job_description, ats_score (0-1 or 0-100),
+    or a single 'text' column with ' SEP ' between resume and job. Fixed sample: the first
+    `n_samples` rows, or a seeded random sample.
+    """
+    df = pd.read_csv(path).fillna('')
+    if 'resume_text' not in df.columns and 'text' in df.columns:
+        parts = df['text'].str.split(' SEP ', n=1, expand=True)
+        df['resume_text'] = parts[0]
+        df['job_description'] = parts[1].fillna('') if 1 in parts else ''
+    missing = {'resume_text', 'job_description', 'ats_score'} - set(df.columns)
+    if missing:
+        raise ValueError(f"Colonnes manquantes dans {path} : {', '.join(sorted(missing))}")
+
+    if n_samples and n_samples < len(df):
+        df = df.sample(n_samples, random_state=seed) if seed is not None else df.head(n_samples)
+    df = df.reset_index(drop=True)
+    df['ats_score'] = df['ats_score'].astype(float)
+    if df['ats_score'].max() > 1.0:
+        df['ats_score'] = df['ats_score'] / 100.0
+    return df[['resume_text', 'job_description', 'ats_score']]
+
+
+def dataset_fingerprint(df):
+    digest = hashlib.sha1(pd.util.hash_pandas_object(df, index=False).values.tobytes()).hexdigest()
+    return digest[:12]
+
+
+def denoise(df, quantization="none", max_new_tokens=256, progress_callback=None):
+    """
+    Qwen extraction of the job criteria and candidate profile of every pair (greedy decoding,
+    so that the output only depends on the weights). Returns (jobs, cvs, timings).
+    """
+    t0 = time.perf_counter()
+    tokenizer, model = load_generation_model(GENERATION_MODEL_NAME, quantization=quantization, server=False)
+    load_s = time.perf_counter() - t0
+
+    def generate(system, prompt):
+        messages = [{"role": "system", "content": system}, {"role": "user", "content": prompt}]
+        text = tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+        model_inputs = tokenizer([text], return_tensors="pt").to(model.device)
+        with torch.no_grad():
+            output_ids = model.generate(**model_inputs, max_new_tokens=max_new_tokens, do_sample=False)
+        new_ids = output_ids[0][model_inputs.input_ids.shape[1]:]
+        return tokenizer.decode(new_ids, skip_special_tokens=True).strip(), len(new_ids)
+
+    jobs, cvs, pair_seconds = [], [], []
+    n_tokens = 0
+    for i, row in enumerate(df.itertuples()):
+        if progress_callback:
+            progress_callback(f"Débruitage {i + 1}/{len(df)} (génération {quantization})...")
+        t0 = time.perf_counter()
+        job, n_job = generate(JOB_SYSTEM, JOB_PROMPT.format(text=row.job_description[:MAX_INPUT_CHARS]))
+        cv, n_cv = generate(CV_SYSTEM, CV_PROMPT.format(text=row.resume_text[:MAX_INPUT_CHARS]))
+        pair_seconds.append(time.perf_counter() - t0)
+        n_tokens += n_job + n_cv
+        jobs.append(job)
+        cvs.append(cv)
+
+    # The generate closure shares these cells: rebinding them releases Qwen
+    tokenizer = model = None
+    free_memory()
+    total = sum(pair_seconds)
+    return jobs, cvs, {
+        "Chargement_generation_s": load_s,
+        "Debruitage_s": total,
+        "Debruitage_p50_ms": float(np.percentile(pair_seconds, 50)) * 1000 if pair_seconds else None,
+        "Debruitage_p95_ms": float(np.percentile(pair_seconds, 95)) * 1000 if pair_seconds else None,
+        "Tokens_par_s": n_tokens / total if total > 0 else None,
+    }
+
+
+def score_pairs(jobs, cvs, config, batch_size=16):
+    """Scores (0-1) of the (job, cv) pairs with the scorer of `config`. Returns (scores, timings)."""
+    scorer = config.get("scorer", "cross")
+    quantization, backend = config.get("quantization", "none"), config.get("backend", "torch")
+    timings = {"Chargement_scoring_s": 0.0, "Scoring_s": 0.0}
+    scores = np.zeros(len(jobs), dtype=np.float32)
+    selected = np.arange(len(jobs))
+
+    if scorer in ("bi", "bi+cross"):
+        t0 = time.perf_counter()
+        model = load_bi_encoder(BI_ENCODER_MODEL_NAME, quantization=quantization, backend=backend, server=False)
+        timings["Chargement_scoring_s"] += time.perf_counter() - t0
+        t0 = time.perf_counter()
+        job_vectors = model.encode(jobs, batch_size=batch_size, normalize_embeddings=True)
+        cv_vectors = model.encode(cvs, batch_size=batch_size, normalize_embeddings=True)
+        cosine = np.clip(np.sum(np.asarray(job_vectors) * np.asarray(cv_vectors), axis=1), 0.0, 1.0)
+        timings["Scoring_s"] += time.perf_counter() - t0
+        model = None
+        free_memory()
+        if scorer == "bi":
+            return cosine.astype(np.float32), timings
+        top_k = min(int(config.get("rerank_top_k", 5)), len(jobs))
+        selected = np.argsort(-cosine, kind='stable')[:top_k]
+
+    t0 = time.perf_counter()
+    model = load_cross_encoder(CROSS_ENCODER_MODEL_NAME, quantization=quantization, backend=backend, server=False)
+    timings["Chargement_scoring_s"] += time.perf_counter() - t0
+    t0 = time.perf_counter()
+    # Query = job criteria, document = candidate profile (original protocol)
+    logits = model.predict([[jobs[i], cvs[i]] for i in selected], batch_size=batch_size)
+    scores[selected] = sigmoid(np.asarray(logits, dtype=np.float32))
+    timings["Scoring_s"] += time.perf_counter() - t0
+    model = None
+    free_memory()
+    return scores, timings
+
+
+def quality_metrics(ats_scores, match_scores, ats_threshold=ATS_THRESHOLD, pred_threshold=PRED_THRESHOLD):
+    """Precision / recall / F1 at the thresholds, MAP, Pearson and Spearman against the ATS score."""
+    from sklearn.metrics import precision_score, recall_score, f1_score, average_precision_score
+
+    truth = (np.asarray(ats_scores) >= ats_threshold).astype(int)
+    pred = (np.asarray(match_scores) >= pred_threshold).astype(int)
+    ats, match = pd.Series(ats_scores, dtype=float), pd.Series(match_scores, dtype=float)
+    return {
+        "Precision": precision_score(truth, pred, zero_division=0),
+        "Rappel": recall_score(truth, pred, zero_division=0),
+        "F1": f1_score(truth, pred, zero_division=0),
+        "MAP": average_precision_score(truth, match) if truth.any() else None,
+        "Pearson": ats.corr(match) if match.std() > 0 else None,
+        "Spearman": ats.rank().corr(match.rank()) if match.std() > 0 else None,
+    }
+
+
+def run_evaluation(configs=("full", "int8"), dataset_path=DATASET_PATH, n_samples=20, seed=None,
+                   max_new_tokens=256, progress_callback=None):
+    """
+    Runs the denoise -> score pipeline on the labelled pairs for each configuration (name of
+    CONFIGS or dict), and writes quality and latency side by side to data/eval/evaluation_report.csv,
+    with deltas against the first configuration, plus the per-pair scores to
+    data/eval/evaluation_scores.csv. Denoising outputs are shared by configurations using the
+    same generation precision (their timings are reported for each of them).
+    """
+    if not os.path.exists(dataset_path):
+        if progress_callback:
+            progress_callback(f"❌ Erreur : jeu d'évaluation introuvable ({dataset_path}). "
+                              f"Exportez-le avec 'python -m services.evaluation --download'.")
+        return None
+
+    df = load_dataset_file(dataset_path, n_samples=n_samples, seed=seed)
+    fingerprint = dataset_fingerprint(df)
+    if progress_callback:
+        progress_callback(f"Évaluation sur {len(df)} paires ({os.path.basename(dataset_path)}, empreinte {fingerprint}).")
+
+    denoised = {}
+    rows = []
+    df_scores = df[['ats_score']].copy()
+    for config in configs:
+        name, config = (config, CONFIGS[config]) if isinstance(config, str) else (config.get("name", "custom"), config)
+        if progress_callback:
+            progress_callback(f"⏱️ Configuration '{name}' : {config}")
+        try:
+            if config.get("denoise", True):
+                quantization = config.get("quantization", "none")
+                if quantization not in denoised:
+                    denoised[quantization] = denoise(df, quantization, max_new_tokens, progress_callback)
+                jobs, cvs, denoise_timings = denoised[quantization]
+            else:
+                jobs = [text[:MAX_INPUT_CHARS] for text in df['job_description']]
+                cvs = [text[:MAX_INPUT_CHARS] for text in df['resume_text']]
+                denoise_timings = {"Debruitage_s": 0.0}
+            scores, score_timings = score_pairs(jobs, cvs, config)
+        except Exception as e:
+            if progress_callback:
+                progress_callback(f"⚠️ Configuration '{name}' ignorée : {e}")
+            continue
+
+        df_scores[name] = scores
+        pipeline_s = denoise_timings["Debruitage_s"] + score_timings["Scoring_s"]
+        rows.append({
+            "Configuration": name,
+            **{k: config.get(k) for k in ("quantization", "backend", "denoise", "scorer", "rerank_top_k")},
+            "Paires": len(df),
+            "Jeu": fingerprint,
+            **quality_metrics(df['ats_score'], scores),
+            **denoise_timings,
+            **score_timings,
+            "Scoring_ms_par_paire": score_timings["Scoring_s"] * 1000 / len(df),
+            "Pipeline_s": pipeline_s,
+            "Paires_par_s": len(df) / pipeline_s if pipeline_s > 0 else None,
+        })
+
+    if not rows:
+        if progress_callback:
+            progress_callback("❌ Aucune configuration n'a pu être évaluée.")
+        return None
+
+    report = pd.DataFrame(rows)
+    # Deltas against the reference (first configuration): a speedup is accepted on these columns
+    reference = report.iloc[0]
+    for metric in ("F1", "MAP", "Spearman"):
+        report[f"Delta_{metric}"] = pd.to_numeric(report[metric]) - pd.to_numeric(reference[metric])
+    report["Acceleration"] = reference["Pipeline_s"] / report["Pipeline_s"]
+
+    os.makedirs(EVAL_DIR, exist_ok=True)
+    output_path = os.path.join(EVAL_DIR, "evaluation_report.csv")
+    inputs = (dataset_path, configs, n_samples, seed, max_new_tokens)
+    write_csv(report, output_path, inputs=inputs, index=False)
+    write_csv(df_scores, os.path.join(EVAL_DIR, "evaluation_scores.csv"), inputs=inputs, index=False)
+
+    if progress_callback:
+        def fmt(value):
+            return f"{value:.3f}" if value is not None and value == value else "n/a"
+        for row in report.to_dict(orient='records'):
+            progress_callback(
+                f"{row['Configuration']:<12} | P {fmt(row['Precision'])} R {fmt(row['Rappel'])} F1 {fmt(row['F1'])} "
+                f"MAP {fmt(row['MAP'])} Spearman {fmt(row['Spearman'])} (Δ {fmt(row['Delta_Spearman'])}) | "
+                f"{row['Pipeline_s']:.1f}s, {row['Scoring_ms_par_paire']:.1f} ms/paire scoring, x{row['Acceleration']:.2f}"
+            )
+        progress_callback(f"✅ Rapport d'évaluation : {output_path}")
+    return output_path
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Évaluation qualité + latence des configurations de modèles.")
+    parser.add_argument("--configs", default="full,int8",
+                        help=f"Configurations à comparer, la première sert de référence ({', '.join(CONFIGS)})")
+    parser.add_argument("--dataset", default=DATASET_PATH, help="CSV local : resume_text, job_description, ats_score")
+    parser.add_argument("--n-samples", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=None, help="Échantillon aléatoire reproductible (défaut : premières lignes)")
+    parser.add_argument("--max-new-tokens", type=int, default=256)
+    parser.add_argument("--download", action="store_true", help=f"Exporte d'abord {HF_DATASET} (validation) en local")
+    args = parser.parse_args()
+
+    if args.download:
+        download_dataset(output_path=args.dataset, progress_callback=print)
+    run_evaluation(configs=args.configs.split(","), dataset_path=args.dataset, n_samples=args.n_samples,
+                   seed=args.seed, max_new_tokens=args.max_new_tokens, progress_callback=print)
@@ -1,33 +1,433 @@
 import torch
-from transformers import AutoModelForCausalLM, AutoTokenizer
+from services.model_loader import load_generation_model, GENERATION_MODEL_NAME, get_quantization_mode
+from services.generation import Generator
+from services.prompt_builder import PromptBuilder
+from services.skill_index import load_index_for, parse_cv_synthesis, skill_terms, SENIORITY_LEVELS
+from utils.checkpoint import Checkpoint, fingerprint
+from utils.artifacts import write_csv
+from utils.jobs import job_keys
 import os
 import gc
+import json
+import time
+import hashlib
+import threading
+import functools
+import numpy as np
 import pandas as pd
 
 DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data')
+CACHE_PATH = os.path.join(DATA_DIR, 'explanations_cache.json')
 
-def explain_matches(cv_txt_path=None, matches_csv_path=None, progress_callback=None):
+# Background pre-generation only covers the head of the ranking by default
+DEFAULT_TOP_N = 10
+
+# Seconds the on-demand explainer stays loaded after its last explanation
+# (JOBAPP_EXPLAINER_IDLE, 0 = kept until the process exits)
+DEFAULT_EXPLAINER_IDLE = 300
+
+# llm       : Qwen explains the head of the ranking, the other rows on demand (default)
+# heuristic : rationale and verdict of every row from skill overlap, seniority and match_score,
+#             in milliseconds; Qwen is only used for the rows the user deepens (explain_match)
+EXPLAIN_MODES = ("llm", "heuristic")
+
+# Heuristic verdict: weighted mean of skill coverage, score percentile in the ranking and
+# seniority fit (missing components are left out of the mean)
+HEURISTIC_WEIGHTS = {"coverage": 0.5, "score": 0.3, "seniority": 0.2}
+STRONG_MATCH = 0.65
+PARTIAL_MATCH = 0.4
+SHOWN_SKILLS = 4
+
+_SENIORITY_RANKS = {level: i for i, (level, _) in enumerate(SENIORITY_LEVELS)}
+_SENIORITY_LABELS = {'stage': 'stage', 'junior': 'junior', 'confirme': 'confirmé', 'senior': 'senior', 'lead': 'lead'}
+
+SYSTEM_PROMPT = """Tu es un expert en recrutement et matching de talents.
+    Ta mission est d'expliquer pourquoi un candidat correspond ou non à une offre d'emploi.
+    Analyse les compétences techniques, l'expérience et le secteur.
+    Sois concis, objectif et direct."""
+
+EXPLAIN_PROMPT = """
+    ANALYSE DE COMPATIBILITÉ
+
+    CANDIDAT (Synthèse) :
+    {cv}
+
+    OFFRE D'EMPLOI ({job_title} chez {company}) :
+    {job_desc}
+
+    CONSIGNE :
+    Explique en 3 points maximum pourquoi ce profil correspond ou non à cette offre.
+    Donne un verdict final : "Match Fort", "Match Partiel", ou "Pas de Match".
+    """
+
+# Steps 5, 6 and the unified matching all write the same ranked artifact
+MATCHES_FILE = "matches.csv"
+MATCH_FILES = {
+    'matching': MATCHES_FILE,
+    'step5': MATCHES_FILE,
+    'step6': MATCHES_FILE,
+    'step7': "explained_matches.csv",
+}
+
+# The model stays loaded between on-demand requests; both locks are shared with step 7
+_model_lock = threading.RLock()
+_cache_lock = threading.Lock()
+_explainer = None
+_release_timer = None
+
+
+def get_explain_mode(mode=None):
+    """
+    Resolves the explanation mode: explicit argument first, then the JOBAPP_EXPLAIN_MODE env var.
+    """
+    mode = (mode or os.environ.get("JOBAPP_EXPLAIN_MODE") or "llm").strip().lower()
+    if mode not in EXPLAIN_MODES:
+        raise ValueError(f"Mode d'explication inconnu '{mode}' (attendu : {', '.join(EXPLAIN_MODES)})")
+    return mode
+
+
+def resolve_matches_path(source=None, progress_callback=None):
+    """
+    Returns the matches file to explain: the file of `source` ('matching', 'step5', 'step6',
+    'step7') or, by default, data/matches.csv (written by step 5, step 6 or the unified matching).
+    """
+    path = os.path.join(DATA_DIR, MATCH_FILES[source] if source else MATCHES_FILE)
+    if not os.path.exists(path):
+        return None
+    if progress_callback and not source:
+        progress_callback(f"Utilisation des résultats du dernier matching ({MATCHES_FILE}).")
+    return path
+
+
+def explanation_key(cv_content, row):
+    """Cache key: same CV synthesis and same offer content => same explanation."""
+    parts = [cv_content] + [str(row.get(col, '')) for col in ('Poste', 'Entreprise', 'Resume_IA')]
+    return hashlib.sha1("\x1f".join(parts).encode('utf-8')).hexdigest()
+
+
+def load_cache():
+    if not os.path.exists(CACHE_PATH):
+        return {}
+    try:
+        with open(CACHE_PATH, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception:
+        return {}
+
+
+def _store_in_cache(key, explanation):
+    with _cache_lock:
+        cache = load_cache()
+        cache[key] = explanation
+        tmp_path = CACHE_PATH + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(cache, f, ensure_ascii=False)
+        os.replace(tmp_path, CACHE_PATH)
+
+
+def get_explainer_idle():
+    return float(os.environ.get("JOBAPP_EXPLAINER_IDLE", DEFAULT_EXPLAINER_IDLE))
+
+
+def _cancel_release():
+    global _release_timer
+    if _release_timer is not None:
+        _release_timer.cancel()
+        _release_timer = None
+
+
+def _schedule_release():
+    """(Re)arms the idle timer that frees the explainer, so that Qwen does not stay resident next to the other steps."""
+    global _release_timer
+    idle = get_explainer_idle()
+    with _model_lock:
+        _cancel_release()
+        if idle > 0 and _explainer is not None:
+            _release_timer = threading.Timer(idle, release_explainer)
+            _release_timer.daemon = True
+            _release_timer.start()
+
+
+def _get_explainer(progress_callback=None):
+    """Loads Qwen once and keeps it for the following explanations (until released or idle)."""
+    global _explainer
+    with _model_lock:
+        _cancel_release()
+        if _explainer is None:
+            model_name = GENERATION_MODEL_NAME
+            if progress_callback:
+                progress_callback(f"Chargement du modèle {model_name} (précision : {get_quantization_mode()})...")
+            tokenizer, model = load_generation_model(model_name)
+            generator = Generator(model, tokenizer, stage="step7", progress_callback=progress_callback)
+            prompts = PromptBuilder(tokenizer, "step7", progress_callback=progress_callback)
+            _explainer = (tokenizer, model, generator, prompts)
+        else:
+            _explainer[2].progress_callback = progress_callback
+            _explainer[3].progress_callback = progress_callback
+        return _explainer
+
+
+def release_explainer():
+    """Frees the resident explanation model."""
+    global _explainer
+    with _model_lock:
+        _cancel_release()
+        if _explainer is None:
+            return
+        tokenizer, model, generator, prompts = _explainer
+        _explainer = None
+        generator.close()
+        prompts.report()
+        del generator
+        del model
+        del tokenizer
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+        gc.collect()
+
+
+def _generate_explanation(cv_content, row, progress_callback=None):
+    try:
+        return _run_explainer(cv_content, row, progress_callback)
+    finally:
+        _schedule_release()
+
+
+def _run_explainer(cv_content, row, progress_callback=None):
+    with _model_lock:
+        tokenizer, model, generator, prompts = _get_explainer(progress_callback)
+
+        # The CV synthesis and the offer summary share the step 7 prompt budget
+        text = prompts.build(EXPLAIN_PROMPT, {
+            "cv": cv_content,
+            "job_title": row.get('Poste', 'Poste inconnu'),
+            "company": row.get('Entreprise', 'Entreprise inconnue'),
+            "job_desc": row.get('Resume_IA', ''),
+        }, system=SYSTEM_PROMPT, weights={"cv": 2})
+        model_inputs = tokenizer([text], return_tensors="pt").to(model.device)
+
+        generated_ids = generator.generate(
+            **model_inputs,
+            max_new_tokens=1500,
+            temperature=0.3,
+            top_p=0.9,
+        )
+
+    generated_ids = [
+        output_ids[len(input_ids):] for input_ids, output_ids in zip(model_inputs.input_ids, generated_ids)
+    ]
+    response = tokenizer.batch_decode(generated_ids, skip_special_tokens=True)[0]
+
+    # Remplacement des sauts de ligne par des espaces pour tout garder sur une seule ligne
+    response_single_line = response.replace('\n', ' ').replace('\r', ' ').strip()
+
+    # Retirer les doubles espaces créés par la suppression des retours à la ligne
+    while '  ' in response_single_line:
+        response_single_line = response_single_line.replace('  ', ' ')
+
+    return response_single_line
+
+
+def cluster_explanation(cv_content, df_jobs, row, cache):
+    """
+    Explanation already available for another offer of the same near-duplicate cluster
+    (Cluster_ID from step 2), or None.
+    """
+    if 'Cluster_ID' not in df_jobs.columns or row.get('Cluster_ID', '') == '':
+        return None
+    members = df_jobs[df_jobs['Cluster_ID'] == row['Cluster_ID']]
+    for _, member in members.iterrows():
+        explanation = cache.get(explanation_key(cv_content, member.fillna('')))
+        if explanation is not None:
+            return explanation
+    return None
+
+
+def _read_inputs(cv_txt_path, matches_csv_path):
+    with open(cv_txt_path, 'r', encoding='utf-8') as f:
+        cv_content = f.read()
+    df_jobs = pd.read_csv(matches_csv_path)
+    return cv_content, df_jobs
+
+
+def explain_match(rank, source=None, cv_txt_path=None, matches_csv_path=None, generate=True, progress_callback=None):
+    """
+    Explains a single match on demand (row `rank` of the matches file, 0 = best score).
+    The explanation is generated once and served from the cache afterwards. With
+    `generate` False, only a cached explanation is returned (None on a miss).
+    """
+    if cv_txt_path is None:
+        cv_txt_path = os.path.join(DATA_DIR, "cv_synthesized.txt")
+    if matches_csv_path is None:
+        matches_csv_path = resolve_matches_path(source)
+    if matches_csv_path is None:
+        raise FileNotFoundError("Aucun fichier de matching trouvé. Veuillez lancer l'étape 5 ou 6.")
+    if not os.path.exists(cv_txt_path):
+        raise FileNotFoundError("Synthèse CV manquante. Veuillez lancer l'étape 4.")
+
+    cv_content, df_jobs = _read_inputs(cv_txt_path, matches_csv_path)
+    if rank < 0 or rank >= len(df_jobs):
+        raise IndexError(f"Rang {rank} hors limites ({len(df_jobs)} offres)")
+
+    row = df_jobs.iloc[rank].fillna('')
+    key = explanation_key(cv_content, row)
+    cache = load_cache()
+    explanation = cache.get(key)
+    cached = explanation is not None
+    if not cached:
+        explanation = cluster_explanation(cv_content, df_jobs, row, cache)
+        cached = explanation is not None
+        if not cached:
+            if not generate:
+                return None
+            explanation = _generate_explanation(cv_content, row, progress_callback)
+        _store_in_cache(key, explanation)
+
+    return {
+        "rank": int(rank),
+        "Poste": row.get('Poste', ''),
+        "Entreprise": row.get('Entreprise', ''),
+        "match_score": float(row['match_score']) if 'match_score' in row and row['match_score'] != '' else None,
+        "Explanation": explanation,
+        "cached": cached,
+    }
+
+
+def _skills_phrase(matched, missing):
+    if not matched and not missing:
+        return "Compétences : l'offre ne liste pas de compétences clés exploitables."
+    phrase = f"Compétences : {len(matched)}/{len(matched) + len(missing)} compétences clés couvertes"
+    if matched:
+        phrase += f" ({', '.join(matched[:SHOWN_SKILLS])}{', ...' if len(matched) > SHOWN_SKILLS else ''})"
+    if missing:
+        phrase += f" ; manquantes : {', '.join(missing[:SHOWN_SKILLS])}{', ...' if len(missing) > SHOWN_SKILLS else ''}"
+    return phrase + "."
+
+
+def _seniority_phrase(job_level, cv_level):
+    if not job_level:
+        return "Séniorité : non précisée dans l'offre."
+    expected = _SENIORITY_LABELS[job_level]
+    if not cv_level:
+        return f"Séniorité : niveau {expected} attendu, niveau du profil inconnu."
+    gap = _SENIORITY_RANKS[job_level] - _SENIORITY_RANKS[cv_level]
+    if gap == 0:
+        fit = "aligné"
+    elif gap > 0:
+        fit = "l'offre demande plus d'expérience" if gap > 1 else "un niveau au-dessus du profil"
+    else:
+        fit = "profil plus expérimenté que demandé"
+    return f"Séniorité : niveau {expected} attendu, profil {_SENIORITY_LABELS[cv_level]} ({fit})."
+
+
+def heuristic_explanations(cv_content, df_jobs, progress_callback=None):
+    """
+    Three-point rationale (skills covered / missing, seniority, match score) and verdict
+    ("Match Fort", "Match Partiel", "Pas de Match") of every row, without the LLM.
+    Skills come from the skill index of step 2, so the cost is a few set lookups per row.
+    Returns a DataFrame (Explanation, Verdict) aligned on `df_jobs`.
+    """
+    df_jobs = df_jobs.fillna('')
+    index = load_index_for(df_jobs, progress_callback=progress_callback)
+    cv_terms = index.cv_terms(cv_content)
+    cv_level = parse_cv_synthesis(cv_content)['Seniority']
+    terms_of = functools.lru_cache(maxsize=None)(skill_terms)
+
+    matched, missing, job_levels = [], [], []
+    for key in job_keys(df_jobs):
+        doc = index.docs.get(key, {"skills": [], "seniority": ''})
+        matched.append([skill for skill in doc['skills'] if terms_of(skill) & cv_terms])
+        missing.append([skill for skill in doc['skills'] if not terms_of(skill) & cv_terms])
+        job_levels.append(doc['seniority'])
+
+    # Components of the verdict, one vector each
+    n_matched = np.array([len(m) for m in matched], dtype=float)
+    n_skills = n_matched + np.array([len(m) for m in missing], dtype=float)
+    coverage = np.divide(n_matched, n_skills, out=np.full(len(df_jobs), np.nan), where=n_skills > 0)
+
+    scores = pd.to_numeric(df_jobs['match_score'], errors='coerce') if 'match_score' in df_jobs.columns \
+        else pd.Series(np.nan, index=df_jobs.index)
+    score_pct = scores.rank(pct=True).to_numpy()
+    ranks = scores.rank(ascending=False, method='min').to_numpy()
+
+    job_ranks = pd.Series(job_levels).map(_SENIORITY_RANKS).to_numpy(dtype=float)
+    gap = np.abs(job_ranks - _SENIORITY_RANKS.get(cv_level, np.nan))
+    seniority_fit = np.select([gap == 0, gap == 1, gap > 1], [1.0, 0.5, 0.0], default=np.nan)
+
+    components = np.vstack([coverage, score_pct, seniority_fit])
+    weights = np.array([[HEURISTIC_WEIGHTS["coverage"]], [HEURISTIC_WEIGHTS["score"]], [HEURISTIC_WEIGHTS["seniority"]]])
+    weights = np.where(np.isnan(components), 0.0, weights)
+    composite = np.divide(np.nansum(components * weights, axis=0), weights.sum(axis=0),
+                          out=np.zeros(len(df_jobs)), where=weights.sum(axis=0) > 0)
+    verdicts = np.select([composite >= STRONG_MATCH, composite >= PARTIAL_MATCH], ["Match Fort", "Match Partiel"],
+                         default="Pas de Match")
+
+    explanations = []
+    for i in range(len(df_jobs)):
+        score_phrase = (f"Score de matching : {scores.iat[i]:.1f}/100 (rang {int(ranks[i])}/{len(df_jobs)})."
+                        if not np.isnan(scores.iat[i]) else "Score de matching : indisponible.")
+        explanations.append(
+            f"1. {_skills_phrase(matched[i], missing[i])} 2. {_seniority_phrase(job_levels[i], cv_level)} "
+            f"3. {score_phrase} Verdict : {verdicts[i]}."
+        )
+    return pd.DataFrame({"Explanation": explanations, "Verdict": verdicts}, index=df_jobs.index)
+
+
+def _explain_heuristic(cv_content, df_jobs, output_path, inputs=(), progress_callback=None):
+    """Heuristic mode of explain_matches: every row at once, rows already explained by Qwen keep their text."""
+    t0 = time.perf_counter()
+    heuristic = heuristic_explanations(cv_content, df_jobs, progress_callback)
+
+    cache = load_cache()
+    llm = [cache.get(explanation_key(cv_content, row)) for row in df_jobs.fillna('').to_dict(orient='records')]
+    df_jobs['Explanation'] = [text if text is not None else h for text, h in zip(llm, heuristic['Explanation'])]
+    df_jobs['Verdict'] = heuristic['Verdict']
+    df_jobs['Explanation_Mode'] = ["llm" if text is not None else "heuristic" for text in llm]
+    write_csv(df_jobs, output_path, inputs=inputs, index=False, encoding='utf-8')
+
+    if progress_callback:
+        counts = df_jobs['Verdict'].value_counts()
+        summary = ", ".join(f"{verdict} {counts.get(verdict, 0)}" for verdict in ("Match Fort", "Match Partiel", "Pas de Match"))
+        progress_callback(f"✅ {len(df_jobs)} explications heuristiques en {(time.perf_counter() - t0) * 1000:.0f} ms "
+                          f"({summary}). Approfondissez une offre pour l'analyse Qwen.")
+    return output_path
+
+
+def select_rows_to_explain(df_jobs, top_n=DEFAULT_TOP_N, min_score=None):
+    """
+    Indices of the rows worth pre-generating, in ranking order: rows scoring at least
+    `min_score`, limited to the first `top_n` (None = no limit).
+    """
+    if 'match_score' in df_jobs.columns:
+        ranked = df_jobs.sort_values(by='match_score', ascending=False, kind='stable')
+        if min_score is not None:
+            ranked = ranked[ranked['match_score'] >= float(min_score)]
+    else:
+        ranked = df_jobs
+    indices = list(ranked.index)
+    if top_n is not None:
+        indices = indices[:max(0, int(top_n))]
+    return indices
+
+
+def explain_matches(cv_txt_path=None, matches_csv_path=None, top_n=DEFAULT_TOP_N, min_score=None,
+                    mode=None, progress_callback=None):
     """
     Explains matches between CV and Jobs using Qwen model.
+    Only the top `top_n` rows (and/or rows with match_score >= `min_score`) are pre-generated,
+    best scores first; the others stay empty and can be explained on demand (explain_match).
+    With `mode` 'heuristic' (or JOBAPP_EXPLAIN_MODE), every row gets a rule-based rationale
+    and a Verdict column instead, and Qwen is left to explain_match.
     Results are cleaned to ensure single-line output per row in the CSV.
     """
+    mode = get_explain_mode(mode)
     if cv_txt_path is None:
         cv_txt_path = os.path.join(DATA_DIR, "cv_synthesized.txt")
-        
+
     # Determine which matches file to use
     if matches_csv_path is None:
-        cross_path = os.path.join(DATA_DIR, "final_matches_cross.csv")
-        simple_path = os.path.join(DATA_DIR, "final_matches.csv")
-        
-        if os.path.exists(cross_path):
-            matches_csv_path = cross_path
-            if progress_callback:
-                progress_callback("Utilisation des résultats du Cross Matching (Etape 6).")
-        elif os.path.exists(simple_path):
-            matches_csv_path = simple_path
-            if progress_callback:
-                progress_callback("Utilisation des résultats du Matching Standard (Etape 5).")
-        else:
+        matches_csv_path = resolve_matches_path(progress_callback=progress_callback)
+        if matches_csv_path is None:
             if progress_callback:
                 progress_callback("❌ Erreur : Aucun fichier de matching trouvé. Veuillez lancer l'étape 5 ou 6.")
             return None
@@ -39,113 +439,87 @@ def explain_matches(cv_txt_path=None, matches_csv_path=None, progress_callback=N
 
     # 1. Read Data
     try:
-        with open(cv_txt_path, 'r', encoding='utf-8') as f:
-            cv_content = f.read()
-        
-        df_jobs = pd.read_csv(matches_csv_path)
-        
+        cv_content, df_jobs = _read_inputs(cv_txt_path, matches_csv_path)
     except Exception as e:
         if progress_callback:
             progress_callback(f"❌ Erreur lecture fichiers : {e}")
         return None
 
-    # 2. Load Model
-    model_name = "Qwen/Qwen2.5-1.5B-Instruct"
-    if progress_callback:
-        progress_callback(f"Chargement du modèle {model_name}...")
-    
-    try:
-        tokenizer = AutoTokenizer.from_pretrained(model_name)
-        model = AutoModelForCausalLM.from_pretrained(
-            model_name,
-            torch_dtype="auto",
-            device_map="auto",
-            low_cpu_mem_usage=True
-        )
-    except Exception as e:
-        if progress_callback:
-            progress_callback(f"❌ Erreur chargement modèle : {e}")
-        return None
+    output_path = os.path.join(DATA_DIR, 'explained_matches.csv')
+    if mode == "heuristic":
+        return _explain_heuristic(cv_content, df_jobs, output_path, (cv_txt_path, matches_csv_path, mode),
+                                  progress_callback)
 
-    explanations = []
+    selected = select_rows_to_explain(df_jobs, top_n=top_n, min_score=min_score)
     total_jobs = len(df_jobs)
 
-    system_prompt = """Tu es un expert en recrutement et matching de talents.
-    Ta mission est d'expliquer pourquoi un candidat correspond ou non à une offre d'emploi.
-    Analyse les compétences techniques, l'expérience et le secteur.
-    Sois concis, objectif et direct."""
-
     if progress_callback:
-        progress_callback(f"Démarrage de l'analyse pour {total_jobs} offres...")
+        progress_callback(f"Démarrage de l'analyse pour {len(selected)}/{total_jobs} offres (meilleurs scores d'abord)...")
 
-    for index, row in df_jobs.iterrows():
+    # 2. Explain, reusing the cache (on-demand explanations, previous runs).
+    # Rows are committed to data/checkpoints/step7.jsonl as they complete (resume + live preview)
+    checkpoint = Checkpoint("step7", fingerprint(cv_txt_path, matches_csv_path, top_n, min_score))
+    explanations = {int(key): value['Explanation'] for key, value in checkpoint.open().items()}
+    if explanations and progress_callback:
+        progress_callback(f"Reprise : {len(explanations)}/{len(selected)} explications déjà produites.")
+
+    cache = load_cache()
+    for i, index in enumerate(selected):
+        if index in explanations:
+            continue
+        row = df_jobs.loc[index].fillna('')
         job_title = row.get('Poste', 'Poste inconnu')
-        company = row.get('Entreprise', 'Entreprise inconnue')
-        job_desc = row.get('Resume_IA', '')
-        
-        user_prompt = f"""
-        ANALYSE DE COMPATIBILITÉ
-        
-        CANDIDAT (Synthèse) :
-        {cv_content}
-        
-        OFFRE D'EMPLOI ({job_title} chez {company}) :
-        {job_desc}
-        
-        CONSIGNE :
-        Explique en 3 points maximum pourquoi ce profil correspond ou non à cette offre. 
-        Donne un verdict final : "Match Fort", "Match Partiel", ou "Pas de Match".
-        """
-        
-        messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_prompt}
-        ]
-        
-        text = tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
-        model_inputs = tokenizer([text], return_tensors="pt").to(model.device)
-        
-        generated_ids = model.generate(
-            **model_inputs,
-            max_new_tokens=1500, 
-            temperature=0.3,
-            top_p=0.9,
-        )
-        
-        generated_ids = [
-            output_ids[len(input_ids):] for input_ids, output_ids in zip(model_inputs.input_ids, generated_ids)
-        ]
-        response = tokenizer.batch_decode(generated_ids, skip_special_tokens=True)[0]
-        
-        # --- MODIFICATION ICI ---
-        # Remplacement des sauts de ligne par des espaces pour tout garder sur une seule ligne
-        response_single_line = response.replace('\n', ' ').replace('\r', ' ').strip()
-        
-        # Optionnel : retirer les doubles espaces créés par la suppression des retours à la ligne
-        while '  ' in response_single_line:
-            response_single_line = response_single_line.replace('  ', ' ')
-            
-        explanations.append(response_single_line)
-        
+        key = explanation_key(cv_content, row)
+
+        if key in cache:
+            explanations[index] = cache[key]
+            msg = f"[{i+1}/{len(selected)}] Explication déjà disponible pour {job_title}"
+        else:
+            # Near-duplicate of an offer already explained: reuse its explanation
+            shared = cluster_explanation(cv_content, df_jobs, row, cache)
+            if shared is not None:
+                explanations[index] = shared
+                msg = f"[{i+1}/{len(selected)}] Doublon d'une offre déjà expliquée : {job_title}"
+            else:
+                try:
+                    explanations[index] = _generate_explanation(cv_content, row, progress_callback)
+                except Exception as e:
+                    checkpoint.fail(e)
+                    if progress_callback:
+                        progress_callback(f"❌ Erreur génération : {e}")
+                    return None
+                msg = f"[{i+1}/{len(selected)}] Analyse terminée pour {job_title}"
+            _store_in_cache(key, explanations[index])
+            cache[key] = explanations[index]
+
+        checkpoint.commit(str(index), {
+            "rank": int(index), "Poste": row.get('Poste', ''), "Entreprise": row.get('Entreprise', ''),
+            "match_score": float(row['match_score']) if row.get('match_score', '') != '' else '',
+            "Explanation": explanations[index],
+        })
         if progress_callback:
-            progress_callback(f"[{index+1}/{total_jobs}] Analyse terminée pour {job_title}")
+            progress_callback(msg)
 
-    df_jobs['Explanation'] = explanations
-    
-    output_path = os.path.join(DATA_DIR, 'explained_matches.csv')
-    
-    # escapechar permet de gérer proprement les caractères spéciaux si nécessaire, 
+    # Rows outside the selection keep an empty explanation (generated on demand),
+    # unless a near-duplicate of theirs was explained
+    if 'Cluster_ID' in df_jobs.columns:
+        by_cluster = {df_jobs.at[index, 'Cluster_ID']: text for index, text in explanations.items()}
+        for index in df_jobs.index:
+            if index not in explanations and df_jobs.at[index, 'Cluster_ID'] in by_cluster:
+                explanations[index] = by_cluster[df_jobs.at[index, 'Cluster_ID']]
+    df_jobs['Explanation'] = [explanations.get(index, "") for index in df_jobs.index]
+
+    # escapechar permet de gérer proprement les caractères spéciaux si nécessaire,
     # mais le nettoyage ci-dessus fait le gros du travail.
-    df_jobs.to_csv(output_path, index=False, encoding='utf-8')
-    
+    write_csv(df_jobs, output_path, inputs=(cv_txt_path, matches_csv_path, top_n, min_score), index=False,
+              encoding='utf-8')
+    checkpoint.complete()
+
     if progress_callback:
-        progress_callback("✅ Explications générées avec succès (Format ligne unique).")
+        progress_callback(f"✅ {len(explanations)} explications prêtes, les autres offres sont expliquées à la demande.")
 
-    # Cleanup
-    del model
-    del tokenizer
-    if torch.cuda.is_available():
-        torch.cuda.empty_cache()
-    gc.collect()
+    # The batch is done: Qwen is freed (reports flushed) rather than kept next to the other steps,
+    # on-demand explanations reload it
+    release_explainer()
 
-    return output_path
\ No newline at end of file
+    return output_path
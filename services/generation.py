@@ -0,0 +1,200 @@
+import os
+import time
+import pandas as pd
+
+from services.model_loader import load_draft_model
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data')
+REPORT_PATH = os.path.join(DATA_DIR, 'assisted_decoding_report.csv')
+
+# none          : plain decoding, one token per forward pass of the main model (default)
+# draft         : a small model of the same tokenizer family proposes tokens, Qwen verifies them
+# prompt_lookup : candidate tokens are copied from n-gram matches in the prompt (CV / offer text)
+ASSISTED_MODES = ("none", "draft", "prompt_lookup")
+
+
+def get_assisted_mode(mode=None):
+    """
+    Resolves the assisted decoding mode: explicit argument first, then JOBAPP_ASSISTED_DECODING.
+    """
+    mode = (mode or os.environ.get("JOBAPP_ASSISTED_DECODING") or "none").strip().lower()
+    if mode not in ASSISTED_MODES:
+        raise ValueError(f"Mode de décodage assisté inconnu '{mode}' (attendu : {', '.join(ASSISTED_MODES)})")
+    return mode
+
+
+class _ForwardCounter:
+    """Counts forward passes of a module through a forward hook."""
+
+    def __init__(self, module):
+        self.count = 0
+        self._handle = module.register_forward_hook(self._hook) if module is not None else None
+
+    def _hook(self, module, inputs, outputs):
+        self.count += 1
+
+    def remove(self):
+        if self._handle is not None:
+            self._handle.remove()
+
+
+class Generator:
+    """
+    Drop-in replacement for `model.generate` that optionally enables assisted decoding and
+    collects per-stage statistics (accepted draft tokens, tokens per main forward, speedup).
+    """
+
+    def __init__(self, model, tokenizer, stage, mode=None, prompt_lookup_num_tokens=10, calibrate=None,
+                 progress_callback=None):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.stage = stage
+        # A remote model (model server) decodes server-side: no assistance, no forward hooks
+        self.mode = "none" if getattr(model, "remote", False) else get_assisted_mode(mode)
+        self.prompt_lookup_num_tokens = prompt_lookup_num_tokens
+        # Opt-in: the reference decode costs a full extra generation on the stage's first prompt
+        if calibrate is None:
+            calibrate = os.environ.get("JOBAPP_ASSISTED_CALIBRATE", "0") == "1"
+        self.calibrate = calibrate and self.mode != "none"
+        self.progress_callback = progress_callback
+        self.draft_model = None
+        self.reset_stats()
+
+        if self.mode == "draft":
+            if progress_callback:
+                progress_callback("Chargement du modèle brouillon pour le décodage assisté...")
+            self.draft_model = load_draft_model(model)
+
+    def reset_stats(self):
+        self.calls = 0
+        self.new_tokens = 0
+        self.main_forwards = 0
+        self.draft_forwards = 0
+        self.seconds = 0.0
+        self.baseline_ms_per_token = None
+
+    def _assistance_kwargs(self):
+        if self.mode == "draft":
+            return {"assistant_model": self.draft_model}
+        if self.mode == "prompt_lookup":
+            return {"prompt_lookup_num_tokens": self.prompt_lookup_num_tokens}
+        return {}
+
+    def _run_single(self, input_ids, attention_mask, gen_kwargs):
+        """Assisted generation only supports batch size 1."""
+        main_counter = _ForwardCounter(self.model)
+        draft_counter = _ForwardCounter(self.draft_model)
+        try:
+            t0 = time.perf_counter()
+            output = self.model.generate(input_ids=input_ids, attention_mask=attention_mask,
+                                         **gen_kwargs, **self._assistance_kwargs())
+            elapsed = time.perf_counter() - t0
+        finally:
+            main_counter.remove()
+            draft_counter.remove()
+
+        self.calls += 1
+        self.new_tokens += output.shape[1] - input_ids.shape[1]
+        self.main_forwards += main_counter.count
+        self.draft_forwards += draft_counter.count
+        self.seconds += elapsed
+        return output
+
+    def _calibrate(self, input_ids, attention_mask, gen_kwargs):
+        """Measures plain decoding speed once per stage, as the reference for the speedup."""
+        t0 = time.perf_counter()
+        output = self.model.generate(input_ids=input_ids, attention_mask=attention_mask, **gen_kwargs)
+        elapsed = time.perf_counter() - t0
+        n_tokens = max(1, output.shape[1] - input_ids.shape[1])
+        self.baseline_ms_per_token = elapsed * 1000 / n_tokens
+
+    def generate(self, input_ids=None, attention_mask=None, **gen_kwargs):
+        if self.mode == "none":
+            return self.model.generate(input_ids=input_ids, attention_mask=attention_mask, **gen_kwargs)
+
+        import torch
+
+        if attention_mask is None:
+            attention_mask = torch.ones_like(input_ids)
+
+        if self.calibrate and self.baseline_ms_per_token is None:
+            self._calibrate(input_ids[:1], attention_mask[:1], gen_kwargs)
+
+        if input_ids.shape[0] == 1:
+            return self._run_single(input_ids, attention_mask, gen_kwargs)
+
+        # Batched (left-padded) inputs: run rows one by one, then re-pad so that callers can keep
+        # slicing outputs with the padded prompt length
+        pad_id = self.tokenizer.pad_token_id if self.tokenizer.pad_token_id is not None else self.tokenizer.eos_token_id
+        prompt_len = input_ids.shape[1]
+        rows = []
+        for row_ids, row_mask in zip(input_ids, attention_mask):
+            keep = row_mask.bool()
+            output = self._run_single(row_ids[keep].unsqueeze(0), row_mask[keep].unsqueeze(0), gen_kwargs)
+            rows.append(torch.cat([row_ids, output[0, int(keep.sum()):]]))
+        max_len = max(len(r) for r in rows)
+        padded = torch.full((len(rows), max(max_len, prompt_len)), pad_id, dtype=input_ids.dtype, device=input_ids.device)
+        for i, r in enumerate(rows):
+            padded[i, :len(r)] = r
+        return padded
+
+    def proposed_tokens(self):
+        """
+        Candidate tokens submitted to the main model. A draft forward proposes exactly one token;
+        prompt lookup proposes up to `prompt_lookup_num_tokens` per verification pass (an upper
+        bound: fewer when the prompt has no matching n-gram).
+        """
+        if self.mode == "draft":
+            return self.draft_forwards
+        if self.mode == "prompt_lookup":
+            return self.main_forwards * self.prompt_lookup_num_tokens
+        return None
+
+    def stats(self):
+        accepted = max(0, self.new_tokens - self.main_forwards)
+        proposed = self.proposed_tokens()
+        ms_per_token = self.seconds * 1000 / self.new_tokens if self.new_tokens else None
+        return {
+            "Etape": self.stage,
+            "Mode": self.mode,
+            "Date": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "Generations": self.calls,
+            "Tokens_generes": self.new_tokens,
+            "Passes_modele_principal": self.main_forwards,
+            "Tokens_proposes": proposed,
+            "Tokens_acceptes": accepted,
+            "Taux_acceptation": accepted / proposed if proposed else None,
+            "Tokens_par_passe": self.new_tokens / self.main_forwards if self.main_forwards else None,
+            "ms_par_token": ms_per_token,
+            "ms_par_token_reference": self.baseline_ms_per_token,
+            "Acceleration": self.baseline_ms_per_token / ms_per_token if ms_per_token and self.baseline_ms_per_token else None,
+        }
+
+    def report(self, reset=False):
+        """
+        Logs the stage statistics and appends them to data/assisted_decoding_report.csv.
+        `reset` starts a new measurement window (long-lived generators).
+        """
+        if self.mode == "none" or not self.calls:
+            return None
+
+        stats = self.stats()
+        if self.progress_callback:
+            acceptance = f"{stats['Taux_acceptation']:.0%}" if stats["Taux_acceptation"] is not None else "n/a"
+            speedup = f"x{stats['Acceleration']:.2f}" if stats["Acceleration"] is not None else "n/a"
+            self.progress_callback(
+                f"⚡ Décodage assisté ({self.mode}) [{self.stage}] : acceptation {acceptance}, "
+                f"{stats['Tokens_par_passe']:.2f} tokens/passe, accélération mesurée {speedup}"
+            )
+
+        df = pd.DataFrame([stats])
+        df.to_csv(REPORT_PATH, mode='a', index=False, header=not os.path.exists(REPORT_PATH))
+        if reset:
+            self.reset_stats()
+        return stats
+
+    def close(self):
+        self.report()
+        if self.draft_model is not None:
+            del self.draft_model
+            self.draft_model = None
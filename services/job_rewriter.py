@@ -1,11 +1,38 @@
 import pandas as pd
 import torch
-from transformers import AutoModelForCausalLM, AutoTokenizer
+from services.model_loader import load_generation_model, GENERATION_MODEL_NAME, get_quantization_mode
+from services.generation import Generator
+from services.prompt_builder import PromptBuilder, get_context_tokens
+from services.bm25_index import update_index
+from services.skill_index import structured_columns, update_index as update_skill_index
+from services.dedup import find_duplicates, dedup_enabled, get_threshold
+from utils.checkpoint import Checkpoint, fingerprint
+from utils.artifacts import write_csv
 import os
 import gc
 
 DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data')
 
+# Missions and Profil_Recherche are cut to their share of the step 2 prompt budget
+# (services/prompt_builder.py), so that a long offer no longer inflates the prefill
+REWRITE_PROMPT = """Tu es un expert en recrutement. Analyse l'offre d'emploi ci-dessous et génère un résumé structuré.
+
+    Données de l'offre :
+    - Poste : {poste}
+    - Entreprise : {entreprise}
+    - Lieu : {lieu}
+    - Missions : {missions}
+    - Profil Recherché : {profil}
+
+    Génère la réponse uniquement sous ce format strict :
+    RESUME_MATCHING:
+    - Type de profil recherché
+    - compétences clés: [Liste]
+    - Soft_Skills: [Liste]
+    - Seniority: [Niveau]
+    - Core_Mission: [Phrase résumée]
+    """
+
 def rewrite_jobs(input_csv_path=None, progress_callback=None):
     """
     Rewrites job descriptions using Qwen model.
@@ -19,18 +46,14 @@ def rewrite_jobs(input_csv_path=None, progress_callback=None):
         return None
 
     # 1. Load Model
-    model_name = "Qwen/Qwen2.5-1.5B-Instruct"
+    model_name = GENERATION_MODEL_NAME
     if progress_callback:
-        progress_callback(f"Chargement du modèle {model_name}...")
+        progress_callback(f"Chargement du modèle {model_name} (précision : {get_quantization_mode()})...")
     
     try:
-        tokenizer = AutoTokenizer.from_pretrained(model_name)
-        model = AutoModelForCausalLM.from_pretrained(
-            model_name,
-            torch_dtype="auto",
-            device_map="auto",
-            low_cpu_mem_usage=True
-        )
+        tokenizer, model = load_generation_model(model_name)
+        generator = Generator(model, tokenizer, stage="step2", progress_callback=progress_callback)
+        prompts = PromptBuilder(tokenizer, "step2", progress_callback=progress_callback)
     except Exception as e:
         if progress_callback:
             progress_callback(f"❌ Erreur chargement modèle : {e}")
@@ -44,72 +67,97 @@ def rewrite_jobs(input_csv_path=None, progress_callback=None):
             progress_callback(f"❌ Erreur lecture CSV : {e}")
          return None
          
-    resumes_stockes = []
+    # Near-duplicates (reposts, agencies) are rewritten once, through their representative
+    if dedup_enabled():
+        cluster_ids = find_duplicates(df, progress_callback=progress_callback)
+    else:
+        cluster_ids = list(range(len(df)))
+    representatives = [i for i, cluster_id in enumerate(cluster_ids) if cluster_id == i]
+
+    # Each rewritten offer is committed to data/checkpoints/step2.jsonl: a restart on the
+    # same input resumes after the last completed offer
+    checkpoint = Checkpoint("step2", fingerprint(input_csv_path, dedup_enabled(), get_threshold(),
+                                               get_context_tokens("step2")))
+    resumes_stockes = {int(key): value['Resume_IA'] for key, value in checkpoint.open().items()}
     
     if progress_callback:
-        progress_callback(f"Début de la réécriture pour {len(df)} offres.")
-
-    for index, row in df.iterrows():
-        msg = f"Traitement de l'offre {index + 1}/{len(df)} : {row['Poste']}"
-        if progress_callback:
-            progress_callback(msg)
-        else:
-            print(msg)
-
-        prompt = f"""Tu es un expert en recrutement. Analyse l'offre d'emploi ci-dessous et génère un résumé structuré.
-        
-        Données de l'offre :
-        - Poste : {row['Poste']}
-        - Entreprise : {row['Entreprise']}
-        - Lieu : {row['Lieu']}
-        - Missions : {row['Missions']}
-        - Profil Recherché : {row['Profil_Recherche']}
-
-
-
+        if resumes_stockes:
+            progress_callback(f"Reprise : {len(resumes_stockes)}/{len(representatives)} offres déjà réécrites.")
+        progress_callback(f"Début de la réécriture pour {len(representatives)} offres.")
 
-        Génère la réponse uniquement sous ce format strict :
-        RESUME_MATCHING:
-        - Type de profil recherché
-        - compétences clés: [Liste]
-        - Soft_Skills: [Liste]
-        - Seniority: [Niveau]
-        - Core_Mission: [Phrase résumée]
-        """
-
-        messages = [
-            {"role": "system", "content": "Tu es un assistant utile."},
-            {"role": "user", "content": prompt}
-        ]
+    try:
+        for n, index in enumerate(representatives):
+            if index in resumes_stockes:
+                continue
+            row = df.iloc[index]
+            msg = f"Traitement de l'offre {n + 1}/{len(representatives)} : {row['Poste']}"
+            if progress_callback:
+                progress_callback(msg)
+            else:
+                print(msg)
 
-        text = tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
-        model_inputs = tokenizer([text], return_tensors="pt").to(model.device)
+            text = prompts.build(REWRITE_PROMPT, {
+                "poste": row['Poste'],
+                "entreprise": row['Entreprise'],
+                "lieu": row['Lieu'],
+                "missions": row['Missions'],
+                "profil": row['Profil_Recherche'],
+            }, system="Tu es un assistant utile.")
+            model_inputs = tokenizer([text], return_tensors="pt").to(model.device)
 
-        generated_ids = model.generate(
-            **model_inputs,
-            max_new_tokens=500,
-            temperature=0.1,
-            do_sample=True
-        )
+            generated_ids = generator.generate(
+                **model_inputs,
+                max_new_tokens=500,
+                temperature=0.1,
+                do_sample=True
+            )
         
-        generated_ids = [
-            output_ids[len(input_ids):] for input_ids, output_ids in zip(model_inputs.input_ids, generated_ids)
-        ]
-        response_text = tokenizer.batch_decode(generated_ids, skip_special_tokens=True)[0]
+            generated_ids = [
+                output_ids[len(input_ids):] for input_ids, output_ids in zip(model_inputs.input_ids, generated_ids)
+            ]
+            response_text = tokenizer.batch_decode(generated_ids, skip_special_tokens=True)[0]
         
-        clean_response = response_text.replace('RESUME_MATCHING:', '').strip()
-        clean_response_oneline = clean_response.replace('\n', ' | ').replace('\r', '')
+            clean_response = response_text.replace('RESUME_MATCHING:', '').strip()
+            clean_response_oneline = clean_response.replace('\n', ' | ').replace('\r', '')
 
-        resumes_stockes.append(clean_response_oneline)
+            resumes_stockes[index] = clean_response_oneline
+            info = row.fillna('')
+            checkpoint.commit(str(index), {
+                "Poste": info['Poste'], "Entreprise": info['Entreprise'], "Resume_IA": clean_response_oneline
+            })
+    except Exception as e:
+        # Kept for the next run on the same input, but no longer shown as partial results
+        checkpoint.fail(e)
+        raise
 
-    df['Resume_IA'] = resumes_stockes
+    df['Resume_IA'] = [resumes_stockes[cluster_id] for cluster_id in cluster_ids]
+    df['Cluster_ID'] = cluster_ids
+    # Skills, soft skills, seniority... as separate columns, queryable without rescanning Resume_IA
+    structured_columns(df)
     output_path = os.path.join(DATA_DIR, 'jobs_rewritten.csv')
-    df.to_csv(output_path, index=False)
+    write_csv(df, output_path, inputs=(input_csv_path,), index=False)
+    checkpoint.complete()
+
+    # Incremental lexical index, used by the optional BM25 stage of step 5
+    try:
+        update_index(df, progress_callback=progress_callback)
+    except Exception as e:
+        if progress_callback:
+            progress_callback(f"⚠️ Index BM25 non mis à jour : {e}")
+    try:
+        update_skill_index(df, progress_callback=progress_callback)
+    except Exception as e:
+        if progress_callback:
+            progress_callback(f"⚠️ Index des compétences non mis à jour : {e}")
     
     if progress_callback:
         progress_callback("✅ Réécriture terminée. Libération de la mémoire...")
     
+    generator.close()
+    prompts.report()
+
     # Cleanup memory
+    del generator
     del model
     del tokenizer
     if torch.cuda.is_available():
@@ -1,78 +1,78 @@
-import pandas as pd
-from sentence_transformers import SentenceTransformer
+from services.model_loader import BI_ENCODER_MODEL_NAME, get_quantization_mode, get_encoder_backend
 from sklearn.metrics.pairwise import cosine_similarity
+from services.vector_store import VectorStore, get_vector_mode
+from services.sharded_scoring import model_sharding_enabled, sharded_encode
+from utils.jobs import job_keys
 import os
-import gc
-import torch
 
 DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data')
 
-def calculate_matches(cv_txt_path=None, jobs_csv_path=None, progress_callback=None):
-    """
-    Calculates matching score between CV and Jobs.
-    """
-    if cv_txt_path is None:
-        cv_txt_path = os.path.join(DATA_DIR, "cv_synthesized.txt")
-    if jobs_csv_path is None:
-        jobs_csv_path = os.path.join(DATA_DIR, "jobs_rewritten.csv")
-
-    if not os.path.exists(cv_txt_path):
-        if progress_callback:
-            progress_callback("❌ Erreur : Synthèse CV manquante. Veuillez lancer l'étape 4.")
-        return None
-    
-    if not os.path.exists(jobs_csv_path):
-        if progress_callback:
-            progress_callback("❌ Erreur : Offres réécrites manquantes. Veuillez lancer l'étape 2.")
-        return None
-
-    # 1. Load Model
-    if progress_callback:
-        progress_callback("Chargement du modèle 'BAAI/bge-m3'...")
-    
-    model = SentenceTransformer('BAAI/bge-m3')
-
-    # 2. Read Data
-    try:
-        with open(cv_txt_path, 'r', encoding='utf-8') as f:
-            cv_text = f.read()
-        
-        df_jobs = pd.read_csv(jobs_csv_path)
-        df_jobs = df_jobs.fillna('') 
-    except Exception as e:
-        if progress_callback:
-            progress_callback(f"❌ Erreur lecture fichiers : {e}")
-        return None
-
-    # 3. Vectorization
-    if progress_callback:
-        progress_callback(f"Vectorisation du CV et des {len(df_jobs)} offres...")
-
-    df_jobs['text_complet'] = (
+def build_job_texts(df_jobs):
+    """Enriched offer text used for matching: title, company and AI summary."""
+    return (
         df_jobs['Poste'].astype(str) + " " + 
         df_jobs['Entreprise'].astype(str) + " " + 
         df_jobs['Resume_IA'].astype(str)
     )
 
+def bm25_stage(df_jobs, cv_text, prefilter_top_n=0, progress_callback=None):
+    """
+    Adds the BM25 score of each offer against the CV skills ('bm25_score') and, when
+    `prefilter_top_n` is set, keeps only the N best offers for the dense stage.
+    """
+    from services.bm25_index import load_index_for, extract_cv_skills
+
+    index = load_index_for(df_jobs, progress_callback=progress_callback)
+    scores = index.score(extract_cv_skills(cv_text))
+    df_jobs['bm25_score'] = scores[index.positions(job_keys(df_jobs))]
+
+    if prefilter_top_n:
+        candidates = df_jobs[df_jobs['bm25_score'] > 0].nlargest(prefilter_top_n, 'bm25_score')
+        if candidates.empty:
+            if progress_callback:
+                progress_callback("⚠️ Pré-filtre BM25 : aucun terme commun, toutes les offres sont conservées.")
+        else:
+            if progress_callback:
+                progress_callback(f"Pré-filtre BM25 : {len(candidates)}/{len(df_jobs)} offres retenues pour le scoring dense.")
+            df_jobs = candidates.copy()
+    return df_jobs
+
+def dense_scores(model, cv_text, job_texts, progress_callback=None):
+    """
+    Cosine similarity between the CV and each offer text with the bi-encoder. With a vector
+    store mode (JOBAPP_VECTOR_STORE), offer vectors are cached and scanned in compressed form.
+    Large archives are encoded over worker processes (JOBAPP_SCORING_WORKERS); the scan of a
+    single CV stays a single matrix-vector product in this process.
+    """
     cv_vector = model.encode([cv_text])
-    job_vectors = model.encode(df_jobs['text_complet'].tolist())
+    vector_mode = get_vector_mode()
+
+    if vector_mode == "none":
+        if model_sharding_enabled(len(job_texts)):
+            job_vectors = sharded_encode(job_texts, BI_ENCODER_MODEL_NAME, model=model,
+                                         progress_callback=progress_callback)
+        else:
+            job_vectors = model.encode(job_texts)
+        return cosine_similarity(cv_vector, job_vectors)[0]
 
-    # 4. Similarity
-    scores = cosine_similarity(cv_vector, job_vectors)[0]
-    df_jobs['match_score'] = scores * 100
-    
-    df_result = df_jobs.sort_values(by='match_score', ascending=False)
-    
-    output_path = os.path.join(DATA_DIR, 'final_matches.csv')
-    df_result.to_csv(output_path, index=False)
-    
+    # Compressed first pass over the cached offer vectors, exact rescoring of the best ones
+    store = VectorStore.open(BI_ENCODER_MODEL_NAME, get_quantization_mode(), get_encoder_backend())
+    keys = store.ensure(job_texts, model, progress_callback=progress_callback)
+    rescore_k = int(os.environ.get("JOBAPP_VECTOR_RESCORE", "200"))
+    scores = store.scores(cv_vector[0], keys, mode=vector_mode, rescore_k=rescore_k)
     if progress_callback:
-        progress_callback(f"✅ Matching terminé. Top score : {df_result.iloc[0]['match_score']:.2f}%")
+        progress_callback(f"Scan {vector_mode} de {len(keys)} offres, {min(rescore_k, len(keys))} re-scorées en float32.")
+    return scores
 
-    # Cleanup
-    del model
-    if torch.cuda.is_available():
-        torch.cuda.empty_cache()
-    gc.collect()
+def calculate_matches(cv_txt_path=None, jobs_csv_path=None, prefilter_top_n=None, fusion_weight=None,
+                      progress_callback=None):
+    """
+    Step 5: bi-encoder matching, i.e. the matching engine with the bi-encoder as only scorer.
+    Optional lexical stage (JOBAPP_BM25_PREFILTER / JOBAPP_BM25_FUSION), see run_matching.
+    Writes data/matches.csv.
+    """
+    # Imported here: the engine builds on the helpers of this module
+    from services.matching_engine import run_matching
 
-    return output_path
+    return run_matching(cv_txt_path, jobs_csv_path, scorers=("bi",), prefilter_top_n=prefilter_top_n,
+                        fusion_weight=fusion_weight, progress_callback=progress_callback)
@@ -0,0 +1,192 @@
+import pandas as pd
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from services.model_loader import (
+    load_bi_encoder, load_cross_encoder, BI_ENCODER_MODEL_NAME, CROSS_ENCODER_MODEL_NAME,
+    get_quantization_mode, get_encoder_backend
+)
+from services.matcher import build_job_texts, dense_scores, bm25_stage
+from services.cross_encoder_matcher import sigmoid
+from services.skill_index import prefilter
+from services.sharded_scoring import model_sharding_enabled, sharded_predict
+from utils.artifacts import write_csv
+import os
+import gc
+import time
+import torch
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data')
+OUTPUT_FILE = "matches.csv"
+
+# Scorer name -> score column of the consolidated artifact (all scores on a 0-100 scale,
+# except BM25 which is unbounded)
+SCORE_COLUMNS = {
+    "bi": "bi_score",
+    "cross": "cross_score",
+    "bm25": "bm25_score",
+}
+DEFAULT_SCORERS = ("bi", "cross")
+
+# Pairs sent to the reranker per call: small enough to report progress and to interleave
+# with the bi-encoder running in the other thread
+RERANK_CHUNK = 64
+
+
+def _bi_scores(cv_text, job_texts, progress_callback=None):
+    model = load_bi_encoder(BI_ENCODER_MODEL_NAME, progress_callback=progress_callback)
+    try:
+        t0 = time.perf_counter()
+        scores = dense_scores(model, cv_text, job_texts, progress_callback) * 100
+        if progress_callback:
+            progress_callback(f"Bi-encodeur : {len(job_texts)} offres en {time.perf_counter() - t0:.1f}s")
+        return scores
+    finally:
+        del model
+
+
+def _cross_scores(cv_text, job_texts, batch_size=32, progress_callback=None):
+    if model_sharding_enabled(len(job_texts)):
+        # Pairs spread over reranker processes (JOBAPP_SCORING_WORKERS), each with its own model
+        t0 = time.perf_counter()
+        logits = sharded_predict([[cv_text, text] for text in job_texts], CROSS_ENCODER_MODEL_NAME,
+                                 batch_size=batch_size, progress_callback=progress_callback)
+        if progress_callback:
+            progress_callback(f"Reranker : {len(job_texts)} paires en {time.perf_counter() - t0:.1f}s")
+        return sigmoid(logits) * 100
+
+    model = load_cross_encoder(CROSS_ENCODER_MODEL_NAME, progress_callback=progress_callback)
+    try:
+        t0 = time.perf_counter()
+        logits = np.empty(len(job_texts), dtype=np.float32)
+        for start in range(0, len(job_texts), RERANK_CHUNK):
+            chunk = job_texts[start:start + RERANK_CHUNK]
+            logits[start:start + len(chunk)] = model.predict([[cv_text, text] for text in chunk], batch_size=batch_size)
+            if progress_callback:
+                progress_callback(f"Reranking : {start + len(chunk)}/{len(job_texts)} offres")
+        if progress_callback:
+            progress_callback(f"Reranker : {len(job_texts)} paires en {time.perf_counter() - t0:.1f}s")
+        return sigmoid(logits) * 100
+    finally:
+        del model
+
+
+def run_matching(cv_txt_path=None, jobs_csv_path=None, scorers=DEFAULT_SCORERS, rank_by=None, batch_size=32,
+                 prefilter_top_n=None, fusion_weight=None, progress_callback=None):
+    """
+    Single matching pass: the CV and the offers are read once, every scorer of `scorers`
+    ('bi', 'cross', 'bm25') adds its column, and the offers are ranked by `rank_by`
+    (default: the cross-encoder when computed, else the first scorer), copied to 'match_score'.
+    The bi-encoder runs in a background thread while the reranker processes its batches
+    (torch releases the GIL during inference).
+    Optional lexical stage (JOBAPP_BM25_PREFILTER / JOBAPP_BM25_FUSION): BM25 top-N prefilter
+    before the model scorers, and/or fusion of the normalized BM25 score with the ranking score.
+    Writes data/matches.csv (steps 5, 6 and the unified matching) and returns its path.
+    """
+    if prefilter_top_n is None:
+        prefilter_top_n = int(os.environ.get("JOBAPP_BM25_PREFILTER", "0"))
+    if fusion_weight is None:
+        fusion_weight = float(os.environ.get("JOBAPP_BM25_FUSION", "0"))
+
+    scorers = tuple(scorers)
+    unknown = [name for name in scorers if name not in SCORE_COLUMNS]
+    if unknown or not scorers:
+        raise ValueError(f"Scoreurs inconnus : {', '.join(unknown) or '(aucun)'} (attendu : {', '.join(SCORE_COLUMNS)})")
+    if rank_by is None:
+        rank_by = "cross" if "cross" in scorers else scorers[0]
+    if rank_by not in scorers:
+        raise ValueError(f"Le classement par '{rank_by}' exige ce scoreur (scoreurs : {', '.join(scorers)})")
+
+    if cv_txt_path is None:
+        cv_txt_path = os.path.join(DATA_DIR, "cv_synthesized.txt")
+    if jobs_csv_path is None:
+        jobs_csv_path = os.path.join(DATA_DIR, "jobs_rewritten.csv")
+
+    if not os.path.exists(cv_txt_path):
+        if progress_callback:
+            progress_callback("❌ Erreur : Synthèse CV manquante. Veuillez lancer l'étape 4.")
+        return None
+
+    if not os.path.exists(jobs_csv_path):
+        if progress_callback:
+            progress_callback("❌ Erreur : Offres réécrites manquantes. Veuillez lancer l'étape 2.")
+        return None
+
+    # 1. Read Data (once for every scorer)
+    try:
+        with open(cv_txt_path, 'r', encoding='utf-8') as f:
+            cv_text = f.read()
+
+        df_jobs = pd.read_csv(jobs_csv_path)
+        df_jobs = df_jobs.fillna('')
+    except Exception as e:
+        if progress_callback:
+            progress_callback(f"❌ Erreur lecture fichiers : {e}")
+        return None
+
+    if df_jobs.empty:
+        if progress_callback:
+            progress_callback("❌ Erreur : aucune offre à scorer.")
+        return None
+
+    # Optional skill / seniority filter (JOBAPP_SKILL_FILTER, JOBAPP_SENIORITY_FILTER, JOBAPP_SKILL_MIN_OVERLAP)
+    df_jobs = prefilter(df_jobs, cv_text, progress_callback=progress_callback)
+
+    # 2. Scores (BM25 first: its prefilter narrows the offers sent to the models)
+    t0 = time.perf_counter()
+    if "bm25" in scorers or prefilter_top_n or fusion_weight:
+        df_jobs = bm25_stage(df_jobs, cv_text, prefilter_top_n, progress_callback)
+
+    df_jobs['text_complet'] = build_job_texts(df_jobs)
+    job_texts = df_jobs['text_complet'].tolist()
+
+    if progress_callback:
+        progress_callback(
+            f"Matching de {len(df_jobs)} offres ({', '.join(scorers)} ; précision : "
+            f"{get_quantization_mode()}, backend : {get_encoder_backend()})..."
+        )
+
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        bi_future = pool.submit(_bi_scores, cv_text, job_texts, progress_callback) if "bi" in scorers else None
+        if "cross" in scorers:
+            df_jobs[SCORE_COLUMNS["cross"]] = _cross_scores(cv_text, job_texts, batch_size, progress_callback)
+        if bi_future is not None:
+            df_jobs[SCORE_COLUMNS["bi"]] = bi_future.result()
+
+    # 3. Rank
+    df_jobs['match_score'] = df_jobs[SCORE_COLUMNS[rank_by]]
+    if fusion_weight:
+        # BM25 is unbounded: rescale to 0-100 on the scored set before the weighted sum
+        max_bm25 = df_jobs['bm25_score'].max()
+        bm25_norm = df_jobs['bm25_score'] / max_bm25 * 100 if max_bm25 > 0 else 0.0
+        df_jobs['match_score'] = (1 - fusion_weight) * df_jobs['match_score'] + fusion_weight * bm25_norm
+    df_result = df_jobs.sort_values(by='match_score', ascending=False)
+
+    output_path = os.path.join(DATA_DIR, OUTPUT_FILE)
+    write_csv(df_result, output_path, inputs=(cv_txt_path, jobs_csv_path, scorers, rank_by, prefilter_top_n, fusion_weight), index=False)
+
+    if progress_callback:
+        top = df_result.iloc[0]
+        details = ", ".join(f"{name} {top[SCORE_COLUMNS[name]]:.2f}" for name in scorers)
+        progress_callback(f"✅ Matching terminé en {time.perf_counter() - t0:.1f}s. Meilleure offre : {details}")
+
+    # Cleanup
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
+    gc.collect()
+
+    return output_path
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Matching unifié : bi-encodeur et reranker en une passe, un seul CSV classé.")
+    parser.add_argument("--cv", default=None, help="Synthèse du CV (défaut : data/cv_synthesized.txt)")
+    parser.add_argument("--jobs", default=None, help="Offres réécrites (défaut : data/jobs_rewritten.csv)")
+    parser.add_argument("--scorers", default=",".join(DEFAULT_SCORERS), help=f"Parmi : {', '.join(SCORE_COLUMNS)}")
+    parser.add_argument("--rank-by", default=None, help="Scoreur utilisé pour le classement")
+    parser.add_argument("--batch-size", type=int, default=32)
+    args = parser.parse_args()
+
+    run_matching(args.cv, args.jobs, scorers=[s.strip() for s in args.scorers.split(",") if s.strip()],
+                 rank_by=args.rank_by, batch_size=args.batch_size, progress_callback=print)
@@ -0,0 +1,243 @@
+import os
+
+# Models used across the pipeline
+GENERATION_MODEL_NAME = "Qwen/Qwen2.5-1.5B-Instruct"
+BI_ENCODER_MODEL_NAME = "BAAI/bge-m3"
+CROSS_ENCODER_MODEL_NAME = "BAAI/bge-reranker-v2-m3"
+# Same tokenizer family as the generation model, used for assisted decoding
+DRAFT_MODEL_NAME = "Qwen/Qwen2.5-0.5B-Instruct"
+
+# none : full precision (default)
+# int8 : dynamic int8 quantization of every nn.Linear (CPU only, no extra dependency)
+# int4 : int4 weight-only quantization (CPU/GPU, requires the optional `optimum-quanto` package)
+QUANTIZATION_MODES = ("none", "int8", "int4")
+
+# torch : sentence-transformers / PyTorch (default)
+# onnx  : ONNX Runtime, exported once to data/cache/onnx (bi-encoder and reranker only)
+ENCODER_BACKENDS = ("torch", "onnx")
+
+
+def get_quantization_mode(mode=None):
+    """
+    Resolves the quantization mode: explicit argument first, then the JOBAPP_QUANTIZATION env var.
+    """
+    mode = (mode or os.environ.get("JOBAPP_QUANTIZATION") or "none").strip().lower()
+    if mode not in QUANTIZATION_MODES:
+        raise ValueError(f"Mode de quantification inconnu '{mode}' (attendu : {', '.join(QUANTIZATION_MODES)})")
+    return mode
+
+
+def get_encoder_backend(backend=None):
+    """
+    Resolves the encoder backend: explicit argument first, then the JOBAPP_ENCODER_BACKEND env var.
+    """
+    backend = (backend or os.environ.get("JOBAPP_ENCODER_BACKEND") or "torch").strip().lower()
+    if backend not in ENCODER_BACKENDS:
+        raise ValueError(f"Backend inconnu '{backend}' (attendu : {', '.join(ENCODER_BACKENDS)})")
+    return backend
+
+
+def get_model_server(server=None):
+    """
+    Address ("host:port") of the model server to use instead of loading models in-process:
+    explicit argument first (False forces local loading), then JOBAPP_MODEL_SERVER.
+    """
+    if server is False:
+        return None
+    return server or os.environ.get("JOBAPP_MODEL_SERVER") or None
+
+
+def _server_client(address):
+    from services.model_server import ModelServerClient
+    return ModelServerClient(address)
+
+
+def quantize_model(module, mode):
+    """
+    Quantizes a torch module in place and returns it.
+    """
+    import torch
+
+    if mode == "int8":
+        # Dynamic quantization: weights stored in int8, activations quantized on the fly
+        torch.ao.quantization.quantize_dynamic(module, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+    elif mode == "int4":
+        try:
+            from optimum.quanto import quantize, freeze, qint4
+        except ImportError:
+            raise ImportError("Le mode int4 nécessite le paquet 'optimum-quanto' (pip install optimum-quanto)")
+        quantize(module, weights=qint4)
+        freeze(module)
+    return module
+
+
+def load_generation_model(model_name=GENERATION_MODEL_NAME, quantization=None, server=None):
+    """
+    Loads the Qwen tokenizer and model in the selected precision.
+    With a model server, only the tokenizer is loaded and `model.generate` runs remotely.
+    Returns (tokenizer, model).
+    """
+    import torch
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+    from services.model_manifest import model_path, snapshot_dtype, timed_load
+
+    mode = get_quantization_mode(quantization)
+    # Pinned local snapshot (services/model_manifest.py) in the dtype of the mode when there
+    # is one (bfloat16, float32 for int8 / int4), else the hub cache
+    path = model_path(model_name, "generation", snapshot_dtype("generation", mode))
+    tokenizer = AutoTokenizer.from_pretrained(path)
+    address = get_model_server(server)
+    if address:
+        from services.model_server import RemoteGenerationModel
+        return tokenizer, RemoteGenerationModel(_server_client(address), model_name)
+
+    with timed_load(model_name, "generation", path):
+        if mode == "none":
+            model = AutoModelForCausalLM.from_pretrained(
+                path,
+                torch_dtype="auto",
+                device_map="auto",
+                low_cpu_mem_usage=True
+            )
+        else:
+            # Quantized kernels run on CPU and expect float32 activations
+            model = AutoModelForCausalLM.from_pretrained(
+                path,
+                torch_dtype=torch.float32,
+                low_cpu_mem_usage=True
+            )
+            quantize_model(model, mode)
+
+    model.eval()
+    return tokenizer, model
+
+
+def load_draft_model(main_model, model_name=None, quantization=None):
+    """
+    Loads the small draft model for assisted decoding, on the same device and in the same
+    precision as the main model. The tokenizer of the main model is reused.
+    """
+    import torch
+    from transformers import AutoModelForCausalLM
+    from services.model_manifest import model_path, snapshot_dtype, timed_load
+
+    mode = get_quantization_mode(quantization)
+    model_name = model_name or os.environ.get("JOBAPP_DRAFT_MODEL") or DRAFT_MODEL_NAME
+    path = model_path(model_name, "generation", snapshot_dtype("generation", mode))
+    with timed_load(model_name, "generation", path):
+        if mode == "none":
+            model = AutoModelForCausalLM.from_pretrained(
+                path,
+                torch_dtype=main_model.dtype,
+                low_cpu_mem_usage=True
+            ).to(main_model.device)
+        else:
+            model = AutoModelForCausalLM.from_pretrained(
+                path,
+                torch_dtype=torch.float32,
+                low_cpu_mem_usage=True
+            )
+            quantize_model(model, mode)
+
+    model.eval()
+    return model
+
+
+def load_bi_encoder(model_name=BI_ENCODER_MODEL_NAME, quantization=None, backend=None, intra_op_threads=None,
+                    progress_callback=None, server=None):
+    """
+    Loads the bi-encoder in the selected precision and backend.
+    All backends (including the model server) expose the SentenceTransformer `encode` API.
+    """
+    address = get_model_server(server)
+    if address:
+        from services.model_server import RemoteBiEncoder
+        if progress_callback:
+            progress_callback(f"Bi-encoder servi par le serveur de modèles ({address}).")
+        return RemoteBiEncoder(_server_client(address), model_name)
+
+    mode = get_quantization_mode(quantization)
+    if get_encoder_backend(backend) == "onnx":
+        from services.onnx_backend import load_onnx_bi_encoder
+        return load_onnx_bi_encoder(model_name, intra_op_threads=intra_op_threads, quantization=mode,
+                                    progress_callback=progress_callback)
+
+    from sentence_transformers import SentenceTransformer
+    from services.model_manifest import model_path, timed_load
+
+    path = model_path(model_name, "bi")
+    with timed_load(model_name, "bi", path, progress_callback):
+        if mode == "none":
+            return SentenceTransformer(path)
+
+        model = SentenceTransformer(path, device="cpu")
+        quantize_model(model, mode)
+    return model
+
+
+def load_cross_encoder(model_name=CROSS_ENCODER_MODEL_NAME, quantization=None, backend=None, intra_op_threads=None,
+                       progress_callback=None, server=None):
+    """
+    Loads the reranker in the selected precision and backend.
+    All backends (including the model server) expose the CrossEncoder `predict` API.
+    """
+    address = get_model_server(server)
+    if address:
+        from services.model_server import RemoteCrossEncoder
+        if progress_callback:
+            progress_callback(f"Reranker servi par le serveur de modèles ({address}).")
+        return RemoteCrossEncoder(_server_client(address), model_name)
+
+    mode = get_quantization_mode(quantization)
+    if get_encoder_backend(backend) == "onnx":
+        from services.onnx_backend import load_onnx_cross_encoder
+        return load_onnx_cross_encoder(model_name, intra_op_threads=intra_op_threads, quantization=mode,
+                                       progress_callback=progress_callback)
+
+    from sentence_transformers import CrossEncoder
+    from services.model_manifest import model_path, timed_load
+
+    path = model_path(model_name, "cross")
+    with timed_load(model_name, "cross", path, progress_callback):
+        if mode == "none":
+            return CrossEncoder(path)
+
+        model = CrossEncoder(path, device="cpu")
+        # CrossEncoder wraps a transformers sequence-classification model in `.model`
+        quantize_model(model.model, mode)
+    return model
+
+
+def process_memory_mb():
+    """
+    Memory held by the process: resident set size (RSS) plus the CUDA memory allocated by torch.
+    Deltas around a load and an inference give what a model really occupies, including the int8
+    packed weights that are neither parameters nor buffers. None when the RSS cannot be read.
+    """
+    import torch
+
+    try:
+        import psutil
+        rss = psutil.Process().memory_info().rss
+    except ImportError:
+        try:
+            with open("/proc/self/statm") as f:
+                rss = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except (OSError, ValueError, AttributeError):
+            return None
+    if torch.cuda.is_available():
+        rss += torch.cuda.memory_allocated()
+    return rss / (1024 * 1024)
+
+
+def free_memory():
+    """
+    Hands the memory of released models back (garbage collection, CUDA cache). The caller drops
+    its own references first (model = None): this helper cannot release what a frame still holds.
+    """
+    import gc
+    import torch
+
+    gc.collect()
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
@@ -0,0 +1,297 @@
+import os
+import json
+import time
+import shutil
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data')
+SNAPSHOT_DIR = os.path.join(DATA_DIR, 'cache', 'snapshots')
+MANIFEST_PATH = os.path.join(SNAPSHOT_DIR, 'manifest.json')
+
+# Local snapshots: each model saved once as safetensors in its target dtype, so that the
+# loaders read it memory-mapped from disk (shared page cache between processes), without
+# hub resolution and without a dtype cast. Entries of the manifest are keyed
+# "<kind>:<model>@<dtype>": one snapshot per precision the loaders ask for.
+SNAPSHOT_KINDS = ("generation", "bi", "cross")
+SNAPSHOT_DTYPES = ("float32", "float16", "bfloat16")
+# Same dtypes as the hub loaders: Qwen ships in bfloat16 (torch_dtype="auto"), the
+# sentence-transformers encoders load in float32
+DEFAULT_DTYPES = {"generation": "bfloat16", "bi": "float32", "cross": "float32"}
+
+_manifest_lock = threading.Lock()
+_manifest_cache = {"mtime": None, "data": None}
+_load_times = {}
+
+
+def snapshots_enabled():
+    """JOBAPP_MODEL_SNAPSHOTS=0 ignores the manifest (every model is resolved through the hub cache)."""
+    return os.environ.get("JOBAPP_MODEL_SNAPSHOTS", "1") != "0"
+
+
+def snapshot_dtype(kind, quantization=None):
+    """
+    dtype of the snapshot a loader reads in a precision mode: the int8 / int4 kernels run on
+    float32 weights, so Qwen is then read from a float32 snapshot instead of casting bfloat16.
+    """
+    from services.model_loader import get_quantization_mode
+
+    if kind == "generation" and get_quantization_mode(quantization) != "none":
+        return "float32"
+    return DEFAULT_DTYPES[kind]
+
+
+def _entry_key(model_name, kind, dtype):
+    return f"{kind}:{model_name}@{dtype}"
+
+
+def _snapshot_dir(model_name, kind, dtype):
+    safe_name = model_name.strip("/").replace("/", "__").replace("\\", "__").replace(":", "")
+    return os.path.join(SNAPSHOT_DIR, f"{kind}__{safe_name}__{dtype}")
+
+
+def load_manifest():
+    """Manifest content ({"models": {key: entry}}), re-read only when the file changes."""
+    with _manifest_lock:
+        if not os.path.exists(MANIFEST_PATH):
+            return {"models": {}}
+        mtime = os.path.getmtime(MANIFEST_PATH)
+        if _manifest_cache["mtime"] != mtime:
+            with open(MANIFEST_PATH, 'r', encoding='utf-8') as f:
+                _manifest_cache["data"] = json.load(f)
+            _manifest_cache["mtime"] = mtime
+        return _manifest_cache["data"]
+
+
+def _save_manifest(manifest):
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    tmp_path = MANIFEST_PATH + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, MANIFEST_PATH)
+
+
+def _pinned_path(model_name, kind, dtype):
+    entry = load_manifest()["models"].get(_entry_key(model_name, kind, dtype))
+    if entry is None:
+        return None
+    path = os.path.join(SNAPSHOT_DIR, entry["path"])
+    # A snapshot with missing weight files is ignored rather than half-loaded
+    if not all(os.path.exists(os.path.join(path, name)) for name in entry["files"]):
+        return None
+    return path
+
+
+def resolve_snapshot(model_name, kind, dtype=None):
+    """Path of the pinned local snapshot of `model_name` in `dtype`, or None (not built, removed or disabled)."""
+    if not snapshots_enabled() or os.path.isdir(model_name):
+        return None
+    return _pinned_path(model_name, kind, dtype or DEFAULT_DTYPES[kind])
+
+
+def model_path(model_name, kind, dtype=None):
+    """
+    What the loaders pass to from_pretrained: the local snapshot pinned in `dtype` (default
+    dtype of `kind`), else the hub name.
+    """
+    return resolve_snapshot(model_name, kind, dtype) or model_name
+
+
+@contextmanager
+def timed_load(model_name, kind, path, progress_callback=None):
+    """Records (and reports) the load time of a model and where it was loaded from."""
+    source = "snapshot" if path != model_name else "hub"
+    t0 = time.perf_counter()
+    yield
+    seconds = time.perf_counter() - t0
+    _load_times[f"{kind}:{model_name}"] = {"seconds": round(seconds, 3), "source": source}
+    if progress_callback:
+        progress_callback(f"Modèle {model_name} chargé en {seconds:.1f}s ({'snapshot local' if source == 'snapshot' else 'cache hub'}).")
+
+
+def load_times():
+    """Load time and source of every model loaded by this process, for /api/startup."""
+    return dict(_load_times)
+
+
+def _weight_files(path):
+    files = {}
+    for root, _, names in os.walk(path):
+        for name in names:
+            full = os.path.join(root, name)
+            files[os.path.relpath(full, path)] = os.path.getsize(full)
+    return files
+
+
+def build_snapshot(model_name, kind, dtype=None, force=False, progress_callback=None):
+    """
+    Loads `model_name` from the hub once, casts it to `dtype` (default: the dtype its loader
+    reads in the current JOBAPP_QUANTIZATION mode) and saves it as safetensors under
+    data/cache/snapshots, then pins it in the manifest. Returns the snapshot path.
+    """
+    import torch
+
+    if kind not in SNAPSHOT_KINDS:
+        raise ValueError(f"Type de modèle inconnu '{kind}' (attendu : {', '.join(SNAPSHOT_KINDS)})")
+    dtype = dtype or snapshot_dtype(kind)
+    if dtype not in SNAPSHOT_DTYPES:
+        raise ValueError(f"dtype inconnu '{dtype}' (attendu : {', '.join(SNAPSHOT_DTYPES)})")
+
+    existing = _pinned_path(model_name, kind, dtype)
+    if existing and not force:
+        if progress_callback:
+            progress_callback(f"Snapshot déjà présent : {model_name} ({kind}, {dtype}).")
+        return existing
+
+    if progress_callback:
+        progress_callback(f"📦 Snapshot de '{model_name}' ({kind}, {dtype})...")
+    t0 = time.perf_counter()
+    path = _snapshot_dir(model_name, kind, dtype)
+    tmp_path = path + ".tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    torch_dtype = getattr(torch, dtype)
+
+    if kind == "generation":
+        from transformers import AutoModelForCausalLM, AutoTokenizer
+        model = AutoModelForCausalLM.from_pretrained(model_name, torch_dtype=torch_dtype, low_cpu_mem_usage=True)
+        model.save_pretrained(tmp_path)
+        AutoTokenizer.from_pretrained(model_name).save_pretrained(tmp_path)
+    elif kind == "bi":
+        from sentence_transformers import SentenceTransformer
+        model = SentenceTransformer(model_name, device="cpu")
+        model.to(torch_dtype)
+        model.save(tmp_path)
+    else:
+        from sentence_transformers import CrossEncoder
+        model = CrossEncoder(model_name, device="cpu")
+        model.model.to(torch_dtype)
+        model.save(tmp_path)
+    del model
+
+    # The previous snapshot is replaced only once the new one is complete
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp_path, path)
+
+    files = _weight_files(path)
+    with _manifest_lock:
+        manifest = {"models": {}}
+        if os.path.exists(MANIFEST_PATH):
+            with open(MANIFEST_PATH, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+        manifest["models"][_entry_key(model_name, kind, dtype)] = {
+            "model": model_name,
+            "kind": kind,
+            "dtype": dtype,
+            "path": os.path.basename(path),
+            "files": files,
+            "size_mb": round(sum(files.values()) / (1024 * 1024), 1),
+            "created": datetime.now().isoformat(timespec='seconds'),
+        }
+        _save_manifest(manifest)
+
+    if progress_callback:
+        progress_callback(f"✅ Snapshot {model_name} : {sum(files.values()) / (1024 * 1024):.0f} Mo "
+                          f"en {time.perf_counter() - t0:.1f}s ({path})")
+    return path
+
+
+def default_models():
+    """(model, kind) of every model used by the pipeline."""
+    from services.model_loader import (
+        GENERATION_MODEL_NAME, DRAFT_MODEL_NAME, BI_ENCODER_MODEL_NAME, CROSS_ENCODER_MODEL_NAME
+    )
+    return [
+        (GENERATION_MODEL_NAME, "generation"),
+        (os.environ.get("JOBAPP_DRAFT_MODEL") or DRAFT_MODEL_NAME, "generation"),
+        (BI_ENCODER_MODEL_NAME, "bi"),
+        (CROSS_ENCODER_MODEL_NAME, "cross"),
+    ]
+
+
+def _cold_load(model_name, kind, use_snapshot):
+    """Load time of one model in a fresh interpreter (no module or weight already in memory)."""
+    import subprocess
+    import sys
+
+    loader = {"generation": "load_generation_model", "bi": "load_bi_encoder", "cross": "load_cross_encoder"}[kind]
+    code = (
+        "import time; t0 = time.perf_counter(); "
+        f"from services.model_loader import {loader}; "
+        f"{loader}({model_name!r}, quantization='none', server=False); "
+        "print(time.perf_counter() - t0)"
+    )
+    env = dict(os.environ, JOBAPP_MODEL_SNAPSHOTS="1" if use_snapshot else "0", JOBAPP_ENCODER_BACKEND="torch")
+    result = subprocess.run([sys.executable, "-c", code], cwd=os.path.dirname(DATA_DIR), env=env,
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "échec du chargement")
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def load_report(models=None, progress_callback=None):
+    """
+    Cold load time of every pinned model from its snapshot and through the hub cache, each
+    in a fresh process, in full precision (default dtype snapshots). Writes
+    data/model_load_report.csv and returns its path.
+    """
+    import pandas as pd
+    from utils.artifacts import write_csv
+
+    rows = []
+    for model_name, kind in models or default_models():
+        dtype = DEFAULT_DTYPES[kind]
+        if _pinned_path(model_name, kind, dtype) is None:
+            if progress_callback:
+                progress_callback(f"⚠️ {model_name} ({kind}, {dtype}) : aucun snapshot, ignoré.")
+            continue
+        entry = load_manifest()["models"][_entry_key(model_name, kind, dtype)]
+        try:
+            hub_s = _cold_load(model_name, kind, use_snapshot=False)
+            snapshot_s = _cold_load(model_name, kind, use_snapshot=True)
+        except RuntimeError as e:
+            if progress_callback:
+                progress_callback(f"⚠️ {model_name} ({kind}) : {e}")
+            continue
+        rows.append({
+            "Modele": model_name,
+            "Type": kind,
+            "dtype": entry["dtype"],
+            "Taille_Mo": entry["size_mb"],
+            "Chargement_hub_s": hub_s,
+            "Chargement_snapshot_s": snapshot_s,
+            "Ratio": snapshot_s / hub_s if hub_s > 0 else None,
+        })
+        if progress_callback:
+            progress_callback(f"{model_name:<40} {kind:<10} hub {hub_s:6.1f}s | snapshot {snapshot_s:6.1f}s "
+                              f"({snapshot_s / hub_s:.0%})")
+
+    output_path = os.path.join(DATA_DIR, "model_load_report.csv")
+    write_csv(pd.DataFrame(rows), output_path, inputs=(models or default_models(),), index=False)
+    if progress_callback:
+        progress_callback(f"✅ Rapport : {output_path}")
+    return output_path
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Snapshots locaux des modèles (safetensors, dtype cible) et temps de chargement.")
+    parser.add_argument("--build", action="store_true", help="Crée les snapshots des modèles du pipeline")
+    parser.add_argument("--model", action="append", default=None,
+                        help="Modèle au format <type>:<nom> (ex. bi:BAAI/bge-m3), répétable (défaut : tous)")
+    parser.add_argument("--dtype", default=None, help=f"dtype cible ({', '.join(SNAPSHOT_DTYPES)}, défaut : celui lu par le chargeur "
+                             "dans le mode JOBAPP_QUANTIZATION courant)")
+    parser.add_argument("--force", action="store_true", help="Reconstruit les snapshots existants")
+    parser.add_argument("--report", action="store_true", help="Compare les chargements à froid hub / snapshot")
+    args = parser.parse_args()
+
+    models = [tuple(reversed(spec.split(":", 1))) for spec in args.model] if args.model else default_models()
+    if args.build:
+        for model_name, kind in models:
+            build_snapshot(model_name, kind, dtype=args.dtype, force=args.force, progress_callback=print)
+    if args.report:
+        load_report(models, progress_callback=print)
+    if not (args.build or args.report):
+        for key, entry in load_manifest()["models"].items():
+            print(f"{key:<50} {entry['dtype']:<9} {entry['size_mb']:8.1f} Mo  {entry['created']}")
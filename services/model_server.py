@@ -0,0 +1,457 @@
+import json
+import time
+import queue
+import base64
+import socket
+import struct
+import hashlib
+import threading
+import socketserver
+from concurrent.futures import Future
+
+import numpy as np
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 5055
+
+# Generation arguments forwarded to the server (anything else stays client-side)
+GENERATION_PARAMS = ("max_new_tokens", "temperature", "top_p", "top_k", "do_sample", "repetition_penalty")
+
+
+# --- Wire protocol: 4-byte big-endian length + UTF-8 JSON ---
+
+def send_message(sock, payload):
+    data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+    sock.sendall(struct.pack(">I", len(data)) + data)
+
+
+def _recv_exact(sock, n):
+    chunks = []
+    while n:
+        chunk = sock.recv(min(n, 1 << 20))
+        if not chunk:
+            raise ConnectionError("Connexion fermée par le serveur de modèles")
+        chunks.append(chunk)
+        n -= len(chunk)
+    return b"".join(chunks)
+
+
+def recv_message(sock):
+    (length,) = struct.unpack(">I", _recv_exact(sock, 4))
+    return json.loads(_recv_exact(sock, length).decode('utf-8'))
+
+
+def encode_array(array):
+    array = np.ascontiguousarray(array, dtype=np.float32)
+    return {"shape": list(array.shape), "data": base64.b64encode(array.tobytes()).decode('ascii')}
+
+
+def decode_array(payload):
+    return np.frombuffer(base64.b64decode(payload["data"]), dtype=np.float32).reshape(payload["shape"])
+
+
+def parse_address(address):
+    host, _, port = address.rpartition(":")
+    return (host or DEFAULT_HOST, int(port))
+
+
+# --- Dynamic batching ---
+
+class Batcher(threading.Thread):
+    """
+    Collects concurrent requests of one kind and runs them as a single model call.
+    As soon as a batch finishes, everything queued meanwhile forms the next batch
+    (up to `max_batch` rows, waiting at most `max_wait_ms` for the batch to fill).
+    Requests whose `group` differs (e.g. other sampling parameters) are never mixed.
+    """
+
+    def __init__(self, name, run_batch, max_batch=16, max_wait_ms=5):
+        super().__init__(name=f"batcher-{name}", daemon=True)
+        self.run_batch = run_batch
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.queue = queue.Queue()
+        self.batches = 0
+        self.requests = 0
+        self.rows = 0
+
+    def submit(self, group, payload, size):
+        future = Future()
+        self.queue.put((group, payload, size, future))
+        return future
+
+    def _collect(self):
+        pending = [self.queue.get()]
+        size = pending[0][2]
+        deadline = time.perf_counter() + self.max_wait
+        while size < self.max_batch:
+            timeout = deadline - time.perf_counter()
+            try:
+                item = self.queue.get(timeout=max(timeout, 0)) if timeout > 0 else self.queue.get_nowait()
+            except queue.Empty:
+                break
+            pending.append(item)
+            size += item[2]
+        return pending
+
+    def run(self):
+        while True:
+            pending = self._collect()
+            groups = {}
+            for item in pending:
+                groups.setdefault(item[0], []).append(item)
+            for group, items in groups.items():
+                try:
+                    results = self.run_batch(group, [item[1] for item in items])
+                except Exception as e:
+                    for item in items:
+                        item[3].set_exception(e)
+                    continue
+                self.batches += 1
+                self.requests += len(items)
+                self.rows += sum(item[2] for item in items)
+                for item, result in zip(items, results):
+                    item[3].set_result(result)
+
+    def stats(self):
+        return {
+            "batches": self.batches, "requests": self.requests, "rows": self.rows,
+            "rows_per_batch": self.rows / self.batches if self.batches else None,
+            "queued": self.queue.qsize(),
+        }
+
+
+# --- Backends ---
+
+class ModelBackend:
+    """Real models, loaded on first use through services.model_loader (local loading forced)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._models = {}
+
+    def _get(self, kind, model_name):
+        from services import model_loader
+
+        with self._lock:
+            if (kind, model_name) not in self._models:
+                print(f"Chargement de {model_name} ({kind})...")
+                if kind == "generation":
+                    model = model_loader.load_generation_model(model_name, server=False)
+                elif kind == "bi_encoder":
+                    model = model_loader.load_bi_encoder(model_name, server=False)
+                else:
+                    model = model_loader.load_cross_encoder(model_name, server=False)
+                self._models[(kind, model_name)] = model
+            return self._models[(kind, model_name)]
+
+    def pad_token_id(self, model_name):
+        tokenizer, _ = self._get("generation", model_name)
+        return tokenizer.pad_token_id if tokenizer.pad_token_id is not None else tokenizer.eos_token_id
+
+    def generate(self, model_name, rows, params):
+        """Left-pads the unpadded prompts of every request and returns the new tokens of each row."""
+        import torch
+
+        tokenizer, model = self._get("generation", model_name)
+        pad_id = self.pad_token_id(model_name)
+        max_len = max(len(row) for row in rows)
+        input_ids = torch.full((len(rows), max_len), pad_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(rows), max_len), dtype=torch.long)
+        for i, row in enumerate(rows):
+            input_ids[i, max_len - len(row):] = torch.tensor(row, dtype=torch.long)
+            attention_mask[i, max_len - len(row):] = 1
+
+        with torch.no_grad():
+            output = model.generate(input_ids=input_ids.to(model.device), attention_mask=attention_mask.to(model.device),
+                                    pad_token_id=pad_id, **params)
+        new_tokens = []
+        for row in output[:, max_len:].tolist():
+            while row and row[-1] == pad_id:
+                row.pop()
+            new_tokens.append(row)
+        return new_tokens
+
+    def encode(self, model_name, texts, normalize):
+        model = self._get("bi_encoder", model_name)
+        return np.asarray(model.encode(texts, batch_size=32, normalize_embeddings=normalize), dtype=np.float32)
+
+    def rerank(self, model_name, pairs):
+        model = self._get("cross_encoder", model_name)
+        return np.asarray(model.predict(pairs, batch_size=32), dtype=np.float32)
+
+
+class StubBackend:
+    """
+    Deterministic stand-in without any model, for tests and load tests: generation echoes
+    prompt tokens, embeddings are hashed unit vectors, reranking is their dot product.
+    """
+
+    DIM = 64
+
+    def __init__(self, latency_ms=0):
+        self.latency = latency_ms / 1000
+
+    def pad_token_id(self, model_name):
+        return 0
+
+    def generate(self, model_name, rows, params):
+        time.sleep(self.latency)
+        n = min(int(params.get("max_new_tokens", 16)), 16)
+        return [row[:n] for row in rows]
+
+    def _vector(self, text):
+        seed = int.from_bytes(hashlib.sha1(text.encode('utf-8')).digest()[:4], 'big')
+        vector = np.random.default_rng(seed).standard_normal(self.DIM).astype(np.float32)
+        return vector / np.linalg.norm(vector)
+
+    def encode(self, model_name, texts, normalize):
+        time.sleep(self.latency)
+        return np.stack([self._vector(text) for text in texts]) if texts else np.zeros((0, self.DIM), np.float32)
+
+    def rerank(self, model_name, pairs):
+        time.sleep(self.latency)
+        return np.asarray([float(self._vector(a) @ self._vector(b)) * 5 for a, b in pairs], dtype=np.float32)
+
+
+# --- Server ---
+
+class ModelServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, backend, max_batch=16, max_wait_ms=5):
+        self.backend = backend
+        self.started = time.time()
+        self.batchers = {
+            "generate": Batcher("generate", self._run_generate, max_batch=max_batch, max_wait_ms=max_wait_ms),
+            "encode": Batcher("encode", self._run_encode, max_batch=max_batch * 8, max_wait_ms=max_wait_ms),
+            "rerank": Batcher("rerank", self._run_rerank, max_batch=max_batch * 8, max_wait_ms=max_wait_ms),
+        }
+        for batcher in self.batchers.values():
+            batcher.start()
+        super().__init__(address, _Handler)
+
+    def _run_generate(self, group, payloads):
+        model_name, params = group[0], json.loads(group[1])
+        rows = [row for payload in payloads for row in payload]
+        new_tokens = self.backend.generate(model_name, rows, params)
+        results, start = [], 0
+        for payload in payloads:
+            results.append(new_tokens[start:start + len(payload)])
+            start += len(payload)
+        return results
+
+    def _run_encode(self, group, payloads):
+        model_name, normalize = group
+        texts = [text for payload in payloads for text in payload]
+        vectors = self.backend.encode(model_name, texts, normalize)
+        results, start = [], 0
+        for payload in payloads:
+            results.append(vectors[start:start + len(payload)])
+            start += len(payload)
+        return results
+
+    def _run_rerank(self, group, payloads):
+        pairs = [pair for payload in payloads for pair in payload]
+        scores = self.backend.rerank(group, pairs)
+        results, start = [], 0
+        for payload in payloads:
+            results.append(scores[start:start + len(payload)])
+            start += len(payload)
+        return results
+
+    def handle_request_payload(self, request):
+        op = request.get("op")
+        if op == "ping":
+            return {"ok": True, "uptime_s": time.time() - self.started,
+                    "backend": type(self.backend).__name__,
+                    "stats": {name: b.stats() for name, b in self.batchers.items()}}
+        model_name = request["model"]
+        if op == "generate":
+            params = {k: v for k, v in request.get("params", {}).items() if k in GENERATION_PARAMS}
+            group = (model_name, json.dumps(params, sort_keys=True))
+            rows = request["rows"]
+            new_tokens = self.batchers["generate"].submit(group, rows, len(rows)).result()
+            return {"new_tokens": new_tokens, "pad_token_id": self.backend.pad_token_id(model_name)}
+        if op == "encode":
+            texts = request["texts"]
+            group = (model_name, bool(request.get("normalize", False)))
+            return {"vectors": encode_array(self.batchers["encode"].submit(group, texts, len(texts)).result())}
+        if op == "rerank":
+            pairs = request["pairs"]
+            return {"scores": self.batchers["rerank"].submit(model_name, pairs, len(pairs)).result().tolist()}
+        raise ValueError(f"Opération inconnue : {op}")
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    def handle(self):
+        while True:
+            try:
+                request = recv_message(self.request)
+            except (ConnectionError, struct.error):
+                return
+            try:
+                response = self.server.handle_request_payload(request)
+            except Exception as e:
+                response = {"error": f"{type(e).__name__}: {e}"}
+            send_message(self.request, response)
+
+
+def serve(host=DEFAULT_HOST, port=DEFAULT_PORT, stub=False, stub_latency_ms=0, max_batch=16, max_wait_ms=5,
+          preload=False):
+    backend = StubBackend(stub_latency_ms) if stub else ModelBackend()
+    if preload and not stub:
+        from services.model_loader import GENERATION_MODEL_NAME, BI_ENCODER_MODEL_NAME, CROSS_ENCODER_MODEL_NAME
+        backend._get("generation", GENERATION_MODEL_NAME)
+        backend._get("bi_encoder", BI_ENCODER_MODEL_NAME)
+        backend._get("cross_encoder", CROSS_ENCODER_MODEL_NAME)
+    server = ModelServer((host, port), backend, max_batch=max_batch, max_wait_ms=max_wait_ms)
+    print(f"✅ Serveur de modèles ({'stub' if stub else 'modèles réels'}) à l'écoute sur {host}:{port}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+# --- Client side: drop-in replacements used by services.model_loader ---
+
+class ModelServerClient:
+    """One connection per calling thread, reopened if the server restarted."""
+
+    def __init__(self, address, timeout=600, label="Serveur de modèles"):
+        self.address = parse_address(address) if isinstance(address, str) else address
+        self.timeout = timeout
+        self.label = label
+        self._local = threading.local()
+        # Every open connection, so that close() also reaches those of other threads
+        self._sockets = set()
+        self._sockets_lock = threading.Lock()
+
+    def _socket(self):
+        sock = getattr(self._local, "sock", None)
+        if sock is None:
+            sock = socket.create_connection(self.address, timeout=self.timeout)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self._local.sock = sock
+            with self._sockets_lock:
+                self._sockets.add(sock)
+        return sock
+
+    def _drop(self, sock):
+        with self._sockets_lock:
+            self._sockets.discard(sock)
+        sock.close()
+
+    def request(self, payload):
+        for attempt in range(2):
+            try:
+                sock = self._socket()
+                send_message(sock, payload)
+                response = recv_message(sock)
+                break
+            except (ConnectionError, OSError):
+                sock = getattr(self._local, "sock", None)
+                if sock is not None:
+                    self._drop(sock)
+                self._local.sock = None
+                if attempt:
+                    raise ConnectionError(f"{self.label} injoignable sur {self.address[0]}:{self.address[1]}")
+        if "error" in response:
+            raise RuntimeError(f"{self.label} : {response['error']}")
+        return response
+
+    def ping(self):
+        return self.request({"op": "ping"})
+
+    def close(self):
+        """Closes the connections of every thread (reopened by the next request)."""
+        with self._sockets_lock:
+            sockets, self._sockets = self._sockets, set()
+        for sock in sockets:
+            sock.close()
+        self._local = threading.local()
+
+
+class RemoteGenerationModel:
+    """Stands for a causal LM: `generate` sends token ids, the server batches and decodes."""
+
+    remote = True
+
+    def __init__(self, client, model_name):
+        import torch
+
+        self.client = client
+        self.model_name = model_name
+        self.device = torch.device("cpu")
+
+    def eval(self):
+        return self
+
+    def generate(self, input_ids=None, attention_mask=None, **gen_kwargs):
+        import torch
+
+        if attention_mask is None:
+            attention_mask = torch.ones_like(input_ids)
+        rows = [ids[mask.bool()].tolist() for ids, mask in zip(input_ids, attention_mask)]
+        params = {k: v for k, v in gen_kwargs.items() if k in GENERATION_PARAMS}
+        response = self.client.request({"op": "generate", "model": self.model_name, "rows": rows, "params": params})
+
+        # Same layout as a local generate: caller's (padded) prompt followed by the new tokens
+        pad_id = response["pad_token_id"]
+        outputs = [torch.cat([ids.cpu(), torch.tensor(new, dtype=ids.dtype)]) for ids, new in zip(input_ids, response["new_tokens"])]
+        max_len = max(len(o) for o in outputs)
+        padded = torch.full((len(outputs), max_len), pad_id, dtype=input_ids.dtype)
+        for i, o in enumerate(outputs):
+            padded[i, :len(o)] = o
+        return padded
+
+
+class RemoteBiEncoder:
+    """Stands for a SentenceTransformer (`encode`)."""
+
+    remote = True
+
+    def __init__(self, client, model_name):
+        self.client = client
+        self.model_name = model_name
+
+    def encode(self, sentences, batch_size=32, normalize_embeddings=False, show_progress_bar=None, **kwargs):
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        response = self.client.request({"op": "encode", "model": self.model_name, "texts": texts,
+                                        "normalize": normalize_embeddings})
+        vectors = decode_array(response["vectors"])
+        return vectors[0] if single else vectors
+
+
+class RemoteCrossEncoder:
+    """Stands for a CrossEncoder (`predict`)."""
+
+    remote = True
+
+    def __init__(self, client, model_name):
+        self.client = client
+        self.model_name = model_name
+
+    def predict(self, sentences, batch_size=32, show_progress_bar=None, **kwargs):
+        pairs = [list(pair) for pair in sentences]
+        response = self.client.request({"op": "rerank", "model": self.model_name, "pairs": pairs})
+        return np.asarray(response["scores"], dtype=np.float32)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Serveur local de modèles (Qwen, bge-m3, reranker) avec batching dynamique.")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--stub", action="store_true", help="Réponses factices déterministes, sans modèle (tests)")
+    parser.add_argument("--stub-latency-ms", type=float, default=0, help="Latence simulée par lot en mode stub")
+    parser.add_argument("--max-batch", type=int, default=16, help="Nombre max de prompts par lot de génération")
+    parser.add_argument("--max-wait-ms", type=float, default=5, help="Attente max pour remplir un lot")
+    parser.add_argument("--preload", action="store_true", help="Charge les trois modèles au démarrage")
+    args = parser.parse_args()
+
+    serve(args.host, args.port, stub=args.stub, stub_latency_ms=args.stub_latency_ms,
+          max_batch=args.max_batch, max_wait_ms=args.max_wait_ms, preload=args.preload)
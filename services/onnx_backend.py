@@ -0,0 +1,354 @@
+import numpy as np
+import os
+import json
+import time
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data')
+ONNX_CACHE_DIR = os.path.join(DATA_DIR, 'cache', 'onnx')
+
+# Opset 17 covers the XLM-RoBERTa ops used by bge-m3 and bge-reranker-v2-m3
+ONNX_OPSET = 17
+
+
+def get_intra_op_threads(threads=None):
+    """Explicit argument first, then JOBAPP_ONNX_THREADS (0 = let ONNX Runtime decide)."""
+    if threads is None:
+        threads = int(os.environ.get("JOBAPP_ONNX_THREADS", "0") or 0)
+    return max(0, int(threads))
+
+
+def _model_dir(model_name, kind, cache_dir=None):
+    safe_name = model_name.strip("/").replace("/", "__").replace("\\", "__").replace(":", "")
+    return os.path.join(cache_dir or ONNX_CACHE_DIR, f"{kind}__{safe_name}")
+
+
+def _export(hf_model, tokenizer, output_names, export_dir, metadata):
+    """Exports a transformers encoder to ONNX with dynamic batch / sequence axes."""
+    import torch
+
+    os.makedirs(export_dir, exist_ok=True)
+    hf_model.eval()
+    sample = tokenizer(["export onnx"], ["export"] if metadata["kind"] == "cross" else None,
+                       return_tensors="pt", padding=True)
+    input_names = ["input_ids", "attention_mask"]
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    dynamic_axes.update({name: {0: "batch"} for name in output_names})
+
+    class _Wrapper(torch.nn.Module):
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+
+        def forward(self, input_ids, attention_mask):
+            outputs = self.model(input_ids=input_ids, attention_mask=attention_mask, return_dict=True)
+            return outputs[0]
+
+    model_path = os.path.join(export_dir, "model.onnx")
+    with torch.no_grad():
+        torch.onnx.export(
+            _Wrapper(hf_model),
+            (sample["input_ids"], sample["attention_mask"]),
+            model_path,
+            input_names=input_names,
+            output_names=output_names,
+            dynamic_axes=dynamic_axes,
+            opset_version=ONNX_OPSET,
+            dynamo=False,
+        )
+    tokenizer.save_pretrained(export_dir)
+    with open(os.path.join(export_dir, "metadata.json"), "w", encoding="utf-8") as f:
+        json.dump(metadata, f, indent=2)
+    return model_path
+
+
+def export_bi_encoder(model_name, cache_dir=None, progress_callback=None):
+    """
+    Exports a SentenceTransformer (transformer + pooling [+ normalize]) once to the local cache.
+    Pooling and normalization are replayed in NumPy at inference time.
+    """
+    from sentence_transformers import SentenceTransformer
+    from services.model_manifest import model_path
+
+    export_dir = _model_dir(model_name, "bi", cache_dir)
+    if os.path.exists(os.path.join(export_dir, "metadata.json")):
+        return export_dir
+
+    if progress_callback:
+        progress_callback(f"📦 Export ONNX du bi-encoder '{model_name}' (une seule fois)...")
+
+    # Exported from the pinned float32 snapshot when there is one, like the torch loader
+    st_model = SentenceTransformer(model_path(model_name, "bi"), device="cpu")
+    pooling = st_model[1].get_config_dict()
+    pooling_mode = pooling.get("pooling_mode")
+    if not pooling_mode:
+        # Older sentence-transformers: one boolean flag per mode
+        pooling_mode = "cls" if pooling.get("pooling_mode_cls_token") else "mean"
+    if pooling_mode not in ("cls", "mean"):
+        raise ValueError(f"Pooling '{pooling_mode}' non supporté par le backend ONNX")
+
+    metadata = {
+        "kind": "bi",
+        "model_name": model_name,
+        "pooling": pooling_mode,
+        "normalize": any(type(m).__name__ == "Normalize" for m in st_model),
+        "max_seq_length": int(st_model.max_seq_length),
+    }
+    _export(st_model[0].auto_model, st_model.tokenizer, ["last_hidden_state"], export_dir, metadata)
+    return export_dir
+
+
+def export_cross_encoder(model_name, cache_dir=None, progress_callback=None):
+    """
+    Exports a CrossEncoder once to the local cache, keeping its default activation
+    so that scores match CrossEncoder.predict.
+    """
+    import torch
+    from sentence_transformers import CrossEncoder
+    from services.model_manifest import model_path
+
+    export_dir = _model_dir(model_name, "cross", cache_dir)
+    if os.path.exists(os.path.join(export_dir, "metadata.json")):
+        return export_dir
+
+    if progress_callback:
+        progress_callback(f"📦 Export ONNX du cross-encoder '{model_name}' (une seule fois)...")
+
+    ce_model = CrossEncoder(model_path(model_name, "cross"), device="cpu")
+    activation = getattr(ce_model, "activation_fn", None) or getattr(ce_model, "activation_fct", None)
+    max_length = getattr(ce_model, "max_seq_length", None) or getattr(ce_model, "max_length", None) or 512
+
+    metadata = {
+        "kind": "cross",
+        "model_name": model_name,
+        "activation": "sigmoid" if isinstance(activation, torch.nn.Sigmoid) else "identity",
+        "max_seq_length": int(max_length),
+    }
+    _export(ce_model.model, ce_model.tokenizer, ["logits"], export_dir, metadata)
+    return export_dir
+
+
+def _quantized_model_path(export_dir):
+    """Int8 weights via ONNX Runtime dynamic quantization, computed once next to the fp32 graph."""
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+
+    src = os.path.join(export_dir, "model.onnx")
+    dst = os.path.join(export_dir, "model.int8.onnx")
+    if not os.path.exists(dst):
+        quantize_dynamic(src, dst, weight_type=QuantType.QInt8, use_external_data_format=True)
+    return dst
+
+
+def _save_optimized_graph(model_path, optimized_path):
+    """
+    Runs the hardware-independent graph optimizations (fusions, constant folding) once and
+    saves the result, so later loads skip them.
+    """
+    import onnxruntime as ort
+
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED
+    options.optimized_model_filepath = optimized_path
+    # bge-m3 weighs more than the 2 GB protobuf limit: keep weights in a side file
+    options.add_session_config_entry(
+        "session.optimized_model_external_initializers_file_name",
+        os.path.basename(optimized_path) + ".data"
+    )
+    options.add_session_config_entry(
+        "session.optimized_model_external_initializers_min_size_in_bytes", "1024"
+    )
+    ort.InferenceSession(model_path, sess_options=options, providers=["CPUExecutionProvider"])
+
+
+def create_session(export_dir, intra_op_threads=None, quantization="none"):
+    """
+    Builds an ONNX Runtime CPU session with all graph optimizations enabled.
+    The pre-optimized graph is cached next to the export; only the layout (hardware specific)
+    optimizations run at each load.
+    """
+    import onnxruntime as ort
+
+    if quantization == "int8":
+        model_path = _quantized_model_path(export_dir)
+    elif quantization in (None, "none"):
+        model_path = os.path.join(export_dir, "model.onnx")
+    else:
+        raise ValueError(f"Quantification '{quantization}' non supportée par le backend ONNX (none ou int8)")
+
+    optimized_path = model_path.replace(".onnx", ".opt.onnx")
+    if not os.path.exists(optimized_path):
+        _save_optimized_graph(model_path, optimized_path)
+
+    options = ort.SessionOptions()
+    options.intra_op_num_threads = get_intra_op_threads(intra_op_threads)
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    return ort.InferenceSession(optimized_path, sess_options=options, providers=["CPUExecutionProvider"])
+
+
+class _OnnxEncoderBase:
+    def __init__(self, export_dir, intra_op_threads=None, quantization="none"):
+        from transformers import AutoTokenizer
+
+        with open(os.path.join(export_dir, "metadata.json"), "r", encoding="utf-8") as f:
+            self.metadata = json.load(f)
+        self.tokenizer = AutoTokenizer.from_pretrained(export_dir)
+        self.max_seq_length = self.metadata["max_seq_length"]
+        self.session = create_session(export_dir, intra_op_threads, quantization)
+        self._input_names = {i.name for i in self.session.get_inputs()}
+
+    def _run(self, features):
+        feeds = {name: features[name].astype(np.int64) for name in ("input_ids", "attention_mask")
+                 if name in self._input_names}
+        return self.session.run(None, feeds)[0]
+
+
+class OnnxBiEncoder(_OnnxEncoderBase):
+    """
+    Drop-in replacement for SentenceTransformer.encode backed by ONNX Runtime.
+    """
+
+    def encode(self, sentences, batch_size=32, normalize_embeddings=False, show_progress_bar=None,
+               convert_to_numpy=True, **kwargs):
+        single = isinstance(sentences, str)
+        if single:
+            sentences = [sentences]
+
+        # Sort by length so that each batch pads as little as possible
+        order = np.argsort([-len(s) for s in sentences])
+        embeddings = [None] * len(sentences)
+        for start in range(0, len(sentences), batch_size):
+            idx = order[start:start + batch_size]
+            features = self.tokenizer([sentences[i] for i in idx], padding=True, truncation=True,
+                                      max_length=self.max_seq_length, return_tensors="np")
+            hidden = self._run(features)
+            if self.metadata["pooling"] == "cls":
+                pooled = hidden[:, 0]
+            else:
+                mask = features["attention_mask"][..., None].astype(hidden.dtype)
+                pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            if self.metadata["normalize"] or normalize_embeddings:
+                pooled = pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+            for i, vector in zip(idx, pooled):
+                embeddings[i] = vector
+
+        embeddings = np.vstack(embeddings).astype(np.float32) if embeddings else np.zeros((0, 0), np.float32)
+        return embeddings[0] if single else embeddings
+
+
+class OnnxCrossEncoder(_OnnxEncoderBase):
+    """
+    Drop-in replacement for CrossEncoder.predict backed by ONNX Runtime.
+    """
+
+    def predict(self, sentences, batch_size=32, show_progress_bar=None, convert_to_numpy=True, **kwargs):
+        pairs = [list(p) for p in sentences]
+        order = np.argsort([-(len(p[0]) + len(p[1])) for p in pairs])
+        scores = np.zeros(len(pairs), dtype=np.float32)
+        for start in range(0, len(pairs), batch_size):
+            idx = order[start:start + batch_size]
+            features = self.tokenizer([pairs[i][0] for i in idx], [pairs[i][1] for i in idx],
+                                      padding=True, truncation=True, max_length=self.max_seq_length,
+                                      return_tensors="np")
+            logits = self._run(features)[:, 0]
+            if self.metadata["activation"] == "sigmoid":
+                logits = 1 / (1 + np.exp(-logits))
+            scores[idx] = logits
+        return scores
+
+
+def load_onnx_bi_encoder(model_name, intra_op_threads=None, quantization="none", progress_callback=None):
+    return OnnxBiEncoder(export_bi_encoder(model_name, progress_callback=progress_callback),
+                         intra_op_threads=intra_op_threads, quantization=quantization)
+
+
+def load_onnx_cross_encoder(model_name, intra_op_threads=None, quantization="none", progress_callback=None):
+    return OnnxCrossEncoder(export_cross_encoder(model_name, progress_callback=progress_callback),
+                            intra_op_threads=intra_op_threads, quantization=quantization)
+
+
+def _rank_agreement(reference, candidate, tolerance):
+    """Rankings are identical up to swaps between items whose reference scores differ by < tolerance."""
+    ref_sorted = reference[np.argsort(-candidate, kind="stable")]
+    return bool(np.all(np.diff(ref_sorted) <= tolerance))
+
+
+def verify_onnx_backend(cv_txt_path=None, jobs_csv_path=None, tolerance=1e-3, sample_size=None,
+                        intra_op_threads=None, progress_callback=None):
+    """
+    Compares PyTorch and ONNX Runtime scores for both encoders on the current data.
+    Returns a dict per encoder with max score difference, ranking agreement and timings.
+    """
+    import pandas as pd
+    from services.model_loader import (
+        load_bi_encoder, load_cross_encoder, BI_ENCODER_MODEL_NAME, CROSS_ENCODER_MODEL_NAME,
+    )
+
+    if cv_txt_path is None:
+        cv_txt_path = os.path.join(DATA_DIR, "cv_synthesized.txt")
+    if jobs_csv_path is None:
+        jobs_csv_path = os.path.join(DATA_DIR, "jobs_rewritten.csv")
+
+    with open(cv_txt_path, 'r', encoding='utf-8') as f:
+        cv_text = f.read()
+    df_jobs = pd.read_csv(jobs_csv_path).fillna('')
+    if sample_size:
+        df_jobs = df_jobs.head(sample_size)
+    job_texts = (
+        df_jobs['Poste'].astype(str) + " " +
+        df_jobs['Entreprise'].astype(str) + " " +
+        df_jobs['Resume_IA'].astype(str)
+    ).tolist()
+
+    results = {}
+    for kind in ("bi_encoder", "cross_encoder"):
+        scores = {}
+        timings = {}
+        for backend in ("torch", "onnx"):
+            if kind == "bi_encoder":
+                model = load_bi_encoder(BI_ENCODER_MODEL_NAME, backend=backend, intra_op_threads=intra_op_threads, server=False)
+                t0 = time.perf_counter()
+                vectors = model.encode([cv_text] + job_texts, normalize_embeddings=True)
+                timings[backend] = time.perf_counter() - t0
+                scores[backend] = np.asarray(vectors[1:] @ vectors[0], dtype=np.float32)
+            else:
+                model = load_cross_encoder(CROSS_ENCODER_MODEL_NAME, backend=backend, intra_op_threads=intra_op_threads, server=False)
+                t0 = time.perf_counter()
+                scores[backend] = np.asarray(model.predict([[cv_text, t] for t in job_texts]), dtype=np.float32)
+                timings[backend] = time.perf_counter() - t0
+            del model
+
+        max_diff = float(np.max(np.abs(scores["torch"] - scores["onnx"]))) if job_texts else 0.0
+        results[kind] = {
+            "max_abs_diff": max_diff,
+            "within_tolerance": max_diff <= tolerance,
+            "same_ranking": _rank_agreement(scores["torch"], scores["onnx"], tolerance),
+            "torch_s": timings["torch"],
+            "onnx_s": timings["onnx"],
+        }
+        if progress_callback:
+            r = results[kind]
+            status = "✅" if r["within_tolerance"] and r["same_ranking"] else "⚠️"
+            progress_callback(
+                f"{status} {kind} : écart max {max_diff:.2e} (tolérance {tolerance:.0e}), "
+                f"classement identique : {'oui' if r['same_ranking'] else 'non'}, "
+                f"torch {r['torch_s']:.2f}s / onnx {r['onnx_s']:.2f}s"
+            )
+    return results
+
+
+if __name__ == '__main__':
+    import argparse
+    from services.model_loader import BI_ENCODER_MODEL_NAME, CROSS_ENCODER_MODEL_NAME
+
+    parser = argparse.ArgumentParser(description="Backend ONNX Runtime pour bge-m3 et bge-reranker.")
+    parser.add_argument("action", choices=["export", "verify"])
+    parser.add_argument("--tolerance", type=float, default=1e-3)
+    parser.add_argument("--threads", type=int, default=None, help="intra_op_num_threads (0 = auto)")
+    parser.add_argument("--sample-size", type=int, default=None)
+    args = parser.parse_args()
+
+    if args.action == "export":
+        print(export_bi_encoder(BI_ENCODER_MODEL_NAME, progress_callback=print))
+        print(export_cross_encoder(CROSS_ENCODER_MODEL_NAME, progress_callback=print))
+    else:
+        verify_onnx_backend(tolerance=args.tolerance, sample_size=args.sample_size,
+                            intra_op_threads=args.threads, progress_callback=print)
@@ -0,0 +1,206 @@
+import os
+import re
+import time
+import numpy as np
+import pandas as pd
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data')
+REPORT_PATH = os.path.join(DATA_DIR, 'prompt_tokens_report.csv')
+
+# Target prompt size (system + template + fields, chat markup included) of each LLM stage.
+# The fields of a prompt share what the fixed part leaves; JOBAPP_PROMPT_TOKENS overrides
+# every stage ("2048") or some of them ("step1=2048,step7=1024").
+DEFAULT_CONTEXT_TOKENS = {
+    "step1": 1536,  # raw ad (previously cut at 3000 characters)
+    "step2": 1024,  # Missions + Profil_Recherche
+    "step4": 3072,  # CV, or its notes when the CV is chunked (MERGE_INPUT_TOKENS)
+    "step7": 1536,  # CV synthesis + Resume_IA
+}
+FALLBACK_CONTEXT_TOKENS = 2048
+TRUNCATION_MARK = " [...]"
+
+# Lines that carry no information for the model: job board / browser chrome pasted with an
+# ad (buttons, cookie banners, share links). Matched against whole lines only.
+BOILERPLATE_LINES = re.compile(
+    r"^(?:postuler(?: maintenant| à cette offre)?|candidater|partager(?: cette offre| l'offre)?|"
+    r"sauvegarder|enregistrer(?: l'offre)?|signaler(?: cette offre| l'offre)?|voir (?:plus|moins|l'offre)|"
+    r"lire la suite|retour aux (?:offres|résultats)|"
+    r"(?:accepter|refuser|paramétrer|gérer)(?: les| mes)? cookies|tout accepter|tout refuser|"
+    r"nous utilisons des cookies.*|ce site utilise des cookies.*|"
+    r"publiée? il y a .{0,20}|offre publiée le .{0,20}|[•·\-–—*|>]+)$",
+    re.IGNORECASE,
+)
+
+
+def compact_text(text, clean=True):
+    """
+    Collapses runs of spaces and blank lines and strips line indentation (f-string templates).
+    With `clean`, also drops boilerplate and repeated lines (field values, not templates).
+    Paragraph breaks are kept.
+    """
+    if text is None or (isinstance(text, float) and np.isnan(text)):
+        return ""
+    lines = []
+    seen = set()
+    for line in str(text).replace("\r", "\n").split("\n"):
+        line = re.sub(r"[ \t ]+", " ", line).strip()
+        if not line:
+            if lines and lines[-1]:
+                lines.append("")
+            continue
+        if not clean:
+            lines.append(line)
+            continue
+        if BOILERPLATE_LINES.match(line):
+            continue
+        # Scraped pages repeat menus and headers; a long line seen twice is kept once
+        if len(line) > 20:
+            if line in seen:
+                continue
+            seen.add(line)
+        lines.append(line)
+    return "\n".join(lines).strip()
+
+
+def get_context_tokens(stage, context_tokens=None):
+    """Prompt token target of `stage`: explicit argument, then JOBAPP_PROMPT_TOKENS, then the default."""
+    if context_tokens:
+        return int(context_tokens)
+    setting = os.environ.get("JOBAPP_PROMPT_TOKENS", "").strip()
+    if setting:
+        if "=" not in setting:
+            return int(setting)
+        for item in setting.split(","):
+            name, _, value = item.partition("=")
+            if name.strip() == stage and value.strip():
+                return int(value)
+    return DEFAULT_CONTEXT_TOKENS.get(stage, FALLBACK_CONTEXT_TOKENS)
+
+
+def allocate_budget(sizes, budget, weights=None):
+    """
+    Splits `budget` tokens between fields of `sizes` tokens (max-min fairness): a field
+    smaller than its share keeps all its tokens and leaves the rest to the larger fields,
+    which are cut to an equal share (proportional to `weights`). Returns {field: tokens}.
+    """
+    weights = weights or {}
+    remaining = dict(sizes)
+    allocation = {}
+    budget = max(0, budget)
+    while remaining:
+        total_weight = sum(weights.get(name, 1) for name in remaining)
+        fits = {name: size for name, size in remaining.items()
+                if size <= budget * weights.get(name, 1) / total_weight}
+        if not fits:
+            for name in remaining:
+                allocation[name] = int(budget * weights.get(name, 1) / total_weight)
+            break
+        for name, size in fits.items():
+            allocation[name] = size
+            budget -= size
+            del remaining[name]
+    return allocation
+
+
+class PromptBuilder:
+    """
+    Builds the chat prompts of one LLM stage within a token budget: fields are compacted,
+    measured with the model tokenizer and cut on token boundaries to their share of what the
+    template leaves, so that the prefill cost of a row is bounded. The token count of every
+    prompt is recorded (see report).
+    """
+
+    def __init__(self, tokenizer, stage, context_tokens=None, progress_callback=None):
+        self.tokenizer = tokenizer
+        self.stage = stage
+        self.context_tokens = get_context_tokens(stage, context_tokens)
+        self.progress_callback = progress_callback
+        self._fixed_cache = {}
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.prompt_tokens = []
+        self.truncated = 0
+        self.saved_tokens = 0
+
+    def _encode(self, text):
+        return self.tokenizer(text, add_special_tokens=False).input_ids
+
+    def count(self, text):
+        return len(self._encode(text))
+
+    def fit(self, text, max_tokens):
+        """`text` cut to at most `max_tokens` tokens (mark included). Returns (text, tokens, cut)."""
+        ids = self._encode(text)
+        if len(ids) <= max_tokens:
+            return text, len(ids), False
+        mark_tokens = self.count(TRUNCATION_MARK)
+        keep = max(0, max_tokens - mark_tokens)
+        # A cut inside a multi-byte character decodes to U+FFFD
+        text = self.tokenizer.decode(ids[:keep], skip_special_tokens=True).rstrip("\ufffd").rstrip()
+        return text + TRUNCATION_MARK, max_tokens, True
+
+    def _render(self, template, fields, system):
+        messages = [{"role": "user", "content": compact_text(template, clean=False).format(**fields)}]
+        if system:
+            messages.insert(0, {"role": "system", "content": compact_text(system, clean=False)})
+        return self.tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+
+    def build(self, template, fields, system=None, weights=None):
+        """
+        Chat prompt of `template` (str.format placeholders) filled with `fields`, within the
+        stage budget. `weights` gives some fields a larger share when several must be cut.
+        """
+        fields = {name: compact_text(value) for name, value in fields.items()}
+        # Tokens of the fixed part (system, template, chat markup), once per template
+        cache_key = (template, system)
+        if cache_key not in self._fixed_cache:
+            self._fixed_cache[cache_key] = self.count(self._render(template, {name: "" for name in fields}, system))
+        budget = self.context_tokens - self._fixed_cache[cache_key]
+
+        sizes = {name: self.count(value) for name, value in fields.items()}
+        allocation = allocate_budget(sizes, budget, weights)
+        for name, value in fields.items():
+            if sizes[name] > allocation[name]:
+                fields[name] = self.fit(value, allocation[name])[0]
+                self.truncated += 1
+                self.saved_tokens += sizes[name] - allocation[name]
+
+        text = self._render(template, fields, system)
+        self.prompt_tokens.append(self.count(text))
+        return text
+
+    def stats(self):
+        tokens = np.array(self.prompt_tokens)
+        return {
+            "Etape": self.stage,
+            "Date": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "Budget_tokens": self.context_tokens,
+            "Prompts": len(tokens),
+            "Tokens_moyen": float(tokens.mean()) if len(tokens) else None,
+            "Tokens_p95": float(np.percentile(tokens, 95)) if len(tokens) else None,
+            "Tokens_max": int(tokens.max()) if len(tokens) else None,
+            "Champs_tronques": self.truncated,
+            "Tokens_retires": self.saved_tokens,
+        }
+
+    def report(self, reset=False):
+        """
+        Logs the prompt sizes of the stage and appends them to data/prompt_tokens_report.csv.
+        `reset` starts a new measurement window (long-lived builders).
+        """
+        if not self.prompt_tokens:
+            return None
+
+        stats = self.stats()
+        if self.progress_callback:
+            self.progress_callback(
+                f"📏 Prompts [{self.stage}] : {stats['Prompts']} prompt(s), {stats['Tokens_moyen']:.0f} tokens en moyenne, "
+                f"max {stats['Tokens_max']}/{self.context_tokens} ({stats['Champs_tronques']} champ(s) tronqué(s))"
+            )
+
+        os.makedirs(DATA_DIR, exist_ok=True)
+        pd.DataFrame([stats]).to_csv(REPORT_PATH, mode='a', index=False, header=not os.path.exists(REPORT_PATH))
+        if reset:
+            self.reset_stats()
+        return stats
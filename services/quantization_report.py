@@ -0,0 +1,268 @@
+import pandas as pd
+import numpy as np
+import os
+import time
+import ctypes
+import difflib
+
+from services.model_loader import (
+    load_generation_model, load_bi_encoder, load_cross_encoder, process_memory_mb, free_memory,
+    GENERATION_MODEL_NAME, BI_ENCODER_MODEL_NAME, CROSS_ENCODER_MODEL_NAME,
+)
+from utils.artifacts import write_csv
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data')
+
+# Drift of a component whose full precision run failed: there is nothing to compare against
+NO_REFERENCE = "n/a (pleine précision indisponible)"
+
+
+def _load_sample(cv_txt_path, jobs_csv_path, sample_size):
+    """Fixed sample: the synthesized CV and the first `sample_size` rewritten offers."""
+    with open(cv_txt_path, 'r', encoding='utf-8') as f:
+        cv_text = f.read()
+    df_jobs = pd.read_csv(jobs_csv_path).fillna('').head(sample_size)
+    job_texts = (
+        df_jobs['Poste'].astype(str) + " " +
+        df_jobs['Entreprise'].astype(str) + " " +
+        df_jobs['Resume_IA'].astype(str)
+    ).tolist()
+    return cv_text, job_texts
+
+
+def _spearman(a, b):
+    if len(a) < 2:
+        return 1.0
+    return float(pd.Series(a).rank().corr(pd.Series(b).rank()))
+
+
+def _memory_baseline():
+    """Process memory once the previous model is collected, origin of the deltas of the next bench."""
+    free_memory()
+    # glibc keeps freed pages for reuse: without trimming, the next model would fill them
+    # without growing the RSS and its delta would read close to zero
+    try:
+        ctypes.CDLL("libc.so.6").malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+    return process_memory_mb()
+
+
+def _format_mb(value):
+    return f"{value:+.1f} MB" if value is not None else "n/a"
+
+
+def _memory_delta(baseline):
+    current = process_memory_mb()
+    if current is None or baseline is None:
+        return None
+    return current - baseline
+
+
+def _bench_generation(mode, prompts, max_new_tokens):
+    baseline = _memory_baseline()
+    t0 = time.perf_counter()
+    tokenizer, model = load_generation_model(GENERATION_MODEL_NAME, quantization=mode, server=False)
+    load_s = time.perf_counter() - t0
+    load_mb = _memory_delta(baseline)
+
+    outputs = []
+    n_tokens = 0
+    t0 = time.perf_counter()
+    for prompt in prompts:
+        messages = [
+            {"role": "system", "content": "Tu es un assistant utile."},
+            {"role": "user", "content": prompt}
+        ]
+        text = tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+        model_inputs = tokenizer([text], return_tensors="pt").to(model.device)
+        # Greedy decoding so that drift comes from the weights only
+        generated_ids = model.generate(**model_inputs, max_new_tokens=max_new_tokens, do_sample=False)
+        new_ids = generated_ids[0][model_inputs.input_ids.shape[1]:]
+        n_tokens += len(new_ids)
+        outputs.append(tokenizer.decode(new_ids, skip_special_tokens=True))
+    infer_s = time.perf_counter() - t0
+    infer_mb = _memory_delta(baseline)
+
+    tokenizer = model = None
+    free_memory()
+    return {
+        "load_s": load_s, "load_mb": load_mb, "infer_s": infer_s, "infer_mb": infer_mb,
+        "throughput": n_tokens / infer_s if infer_s > 0 else 0.0, "unit": "tokens/s",
+    }, outputs
+
+
+def _bench_bi_encoder(mode, cv_text, job_texts):
+    baseline = _memory_baseline()
+    t0 = time.perf_counter()
+    model = load_bi_encoder(BI_ENCODER_MODEL_NAME, quantization=mode, backend="torch", server=False)
+    load_s = time.perf_counter() - t0
+    load_mb = _memory_delta(baseline)
+
+    t0 = time.perf_counter()
+    vectors = model.encode([cv_text] + job_texts, normalize_embeddings=True)
+    infer_s = time.perf_counter() - t0
+    infer_mb = _memory_delta(baseline)
+
+    model = None
+    free_memory()
+    return {
+        "load_s": load_s, "load_mb": load_mb, "infer_s": infer_s, "infer_mb": infer_mb,
+        "throughput": (len(job_texts) + 1) / infer_s if infer_s > 0 else 0.0, "unit": "textes/s",
+    }, vectors
+
+
+def _bench_cross_encoder(mode, cv_text, job_texts):
+    baseline = _memory_baseline()
+    t0 = time.perf_counter()
+    model = load_cross_encoder(CROSS_ENCODER_MODEL_NAME, quantization=mode, backend="torch", server=False)
+    load_s = time.perf_counter() - t0
+    load_mb = _memory_delta(baseline)
+
+    t0 = time.perf_counter()
+    scores = np.asarray(model.predict([[cv_text, job_text] for job_text in job_texts]), dtype=np.float32)
+    infer_s = time.perf_counter() - t0
+    infer_mb = _memory_delta(baseline)
+
+    model = None
+    free_memory()
+    return {
+        "load_s": load_s, "load_mb": load_mb, "infer_s": infer_s, "infer_mb": infer_mb,
+        "throughput": len(job_texts) / infer_s if infer_s > 0 else 0.0, "unit": "paires/s",
+    }, scores
+
+
+def run_quantization_report(modes=("none", "int8"), sample_size=5, max_new_tokens=64,
+                            components=("generation", "bi_encoder", "cross_encoder"),
+                            cv_txt_path=None, jobs_csv_path=None, progress_callback=None):
+    """
+    Benchmarks each quantization mode against full precision on a fixed sample and writes
+    a side-by-side report (load time, process memory after load and after inference, latency,
+    throughput, drift) to data/quantization_report.csv. Drift is only computed against a
+    successful full precision run: when `none` fails, it reads n/a for every mode.
+    """
+    if cv_txt_path is None:
+        cv_txt_path = os.path.join(DATA_DIR, "cv_synthesized.txt")
+    if jobs_csv_path is None:
+        jobs_csv_path = os.path.join(DATA_DIR, "jobs_rewritten.csv")
+
+    if not os.path.exists(cv_txt_path) or not os.path.exists(jobs_csv_path):
+        if progress_callback:
+            progress_callback("❌ Erreur : cv_synthesized.txt et jobs_rewritten.csv sont nécessaires (étapes 2 et 4).")
+        return None
+
+    # Full precision is always the reference
+    modes = ["none"] + [m for m in modes if m != "none"]
+    cv_text, job_texts = _load_sample(cv_txt_path, jobs_csv_path, sample_size)
+    prompts = [f"Résume en une phrase l'offre suivante :\n{job_text}" for job_text in job_texts]
+
+    # Imported up front, so that their one-off cost does not land in the memory of the first mode
+    import transformers
+    import sentence_transformers
+
+    rows = []
+
+    if "generation" in components:
+        reference = None
+        for mode in modes:
+            if progress_callback:
+                progress_callback(f"⏱️ Génération ({GENERATION_MODEL_NAME}) en mode {mode}...")
+            try:
+                metrics, outputs = _bench_generation(mode, prompts, max_new_tokens)
+            except Exception as e:
+                if progress_callback:
+                    progress_callback(f"⚠️ Mode {mode} ignoré pour la génération : {e}")
+                continue
+            if mode == "none":
+                reference = outputs
+            if reference is None:
+                drift = NO_REFERENCE
+            else:
+                similarity = np.mean([
+                    difflib.SequenceMatcher(None, ref, out).ratio() for ref, out in zip(reference, outputs)
+                ])
+                identical = np.mean([ref == out for ref, out in zip(reference, outputs)])
+                drift = f"similarité texte {similarity:.3f}, sorties identiques {identical:.0%}"
+            rows.append({"Composant": "generation", "Mode": mode, **metrics, "drift": drift})
+
+    if "bi_encoder" in components:
+        reference = None
+        for mode in modes:
+            if progress_callback:
+                progress_callback(f"⏱️ Bi-encoder ({BI_ENCODER_MODEL_NAME}) en mode {mode}...")
+            try:
+                metrics, vectors = _bench_bi_encoder(mode, cv_text, job_texts)
+            except Exception as e:
+                if progress_callback:
+                    progress_callback(f"⚠️ Mode {mode} ignoré pour le bi-encoder : {e}")
+                continue
+            scores = vectors[1:] @ vectors[0] * 100
+            if mode == "none":
+                reference = (vectors, scores)
+            if reference is None:
+                drift = NO_REFERENCE
+            else:
+                cosine = float(np.mean(np.sum(reference[0] * vectors, axis=1)))
+                max_diff = float(np.max(np.abs(reference[1] - scores)))
+                drift = (f"cosinus moyen {cosine:.4f}, écart score max {max_diff:.2f} pts, "
+                         f"spearman {_spearman(reference[1], scores):.3f}")
+            rows.append({"Composant": "bi_encoder", "Mode": mode, **metrics, "drift": drift})
+
+    if "cross_encoder" in components:
+        reference = None
+        for mode in modes:
+            if progress_callback:
+                progress_callback(f"⏱️ Cross-encoder ({CROSS_ENCODER_MODEL_NAME}) en mode {mode}...")
+            try:
+                metrics, scores = _bench_cross_encoder(mode, cv_text, job_texts)
+            except Exception as e:
+                if progress_callback:
+                    progress_callback(f"⚠️ Mode {mode} ignoré pour le cross-encoder : {e}")
+                continue
+            if mode == "none":
+                reference = scores
+            if reference is None:
+                drift = NO_REFERENCE
+            else:
+                max_diff = float(np.max(np.abs(reference - scores)))
+                drift = f"écart score max {max_diff:.4f}, spearman {_spearman(reference, scores):.3f}"
+            rows.append({"Composant": "cross_encoder", "Mode": mode, **metrics, "drift": drift})
+
+    df_report = pd.DataFrame(rows).rename(columns={
+        "load_s": "Chargement_s", "load_mb": "Memoire_chargement_MB", "infer_s": "Inference_s",
+        "infer_mb": "Memoire_inference_MB",
+        "throughput": "Debit", "unit": "Unite", "drift": "Derive_vs_full",
+    })
+    output_path = os.path.join(DATA_DIR, "quantization_report.csv")
+    write_csv(df_report, output_path, inputs=(modes, sample_size, max_new_tokens, components), index=False)
+
+    if progress_callback:
+        for row in rows:
+            progress_callback(
+                f"{row['Composant']:<14} {row['Mode']:<5} | chargement {row['load_s']:.1f}s | "
+                f"mémoire {_format_mb(row['load_mb'])} (après inférence {_format_mb(row['infer_mb'])}) | "
+                f"inférence {row['infer_s']:.2f}s "
+                f"({row['throughput']:.1f} {row['unit']}) | {row['drift']}"
+            )
+        progress_callback(f"✅ Rapport de quantification : {output_path}")
+
+    return output_path
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Compare les modes quantifiés à la pleine précision.")
+    parser.add_argument("--modes", default="none,int8", help="Modes à comparer (ex: none,int8,int4)")
+    parser.add_argument("--sample-size", type=int, default=5, help="Nombre d'offres de l'échantillon fixe")
+    parser.add_argument("--max-new-tokens", type=int, default=64)
+    parser.add_argument("--components", default="generation,bi_encoder,cross_encoder")
+    args = parser.parse_args()
+
+    run_quantization_report(
+        modes=args.modes.split(","),
+        sample_size=args.sample_size,
+        max_new_tokens=args.max_new_tokens,
+        components=args.components.split(","),
+        progress_callback=print,
+    )
@@ -1,47 +1,26 @@
 import pandas as pd
-import torch
-from transformers import AutoModelForCausalLM, AutoTokenizer
+from services.model_loader import load_generation_model, GENERATION_MODEL_NAME, get_quantization_mode, free_memory
+from services.generation import Generator
+from services.prompt_builder import PromptBuilder
+from utils.artifacts import write_csv
 import os
-import gc
 import json
+import re
 
 DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data')
 
-def parse_raw_job_text(raw_text, progress_callback=None):
-    """
-    Parses raw job text into structured data (Poste, Entreprise, Lieu, Missions, Profil) using Qwen.
-    """
-    
-    if not raw_text or len(raw_text.strip()) < 10:
-        if progress_callback:
-            progress_callback("❌ Erreur : Texte fourni trop court.")
-        return None
+# Lines made only of these characters (e.g. "-----", "=====", "*****") separate ads in bulk mode
+DEFAULT_AD_DELIMITER = r'^\s*(?:-{3,}|={3,}|\*{3,}|#{3,})\s*$'
+JOB_COLUMNS = ['Poste', 'Entreprise', 'Lieu', 'Missions', 'Profil_Recherche', 'Lien']
 
-    # 1. Load Model
-    model_name = "Qwen/Qwen2.5-1.5B-Instruct"
-    if progress_callback:
-        progress_callback(f"Chargement du modèle {model_name} pour analyse...")
-    
-    try:
-        tokenizer = AutoTokenizer.from_pretrained(model_name)
-        model = AutoModelForCausalLM.from_pretrained(
-            model_name,
-            torch_dtype="auto",
-            device_map="auto"
-        )
-    except Exception as e:
-        if progress_callback:
-            progress_callback(f"❌ Erreur chargement modèle : {e}")
-        return None
+SYSTEM_PROMPT = "Tu es un assistant spécialisé dans l'extraction de données d'offres d'emploi."
 
-    # 2. Prompting
-    if progress_callback:
-        progress_callback("🧠 Analyse sémantique de l'annonce...")
 
-    system_prompt = "Tu es un assistant spécialisé dans l'extraction de données d'offres d'emploi."
-    user_prompt = f"""
+# The ad is cut to what the template leaves of the step 1 prompt budget (token-based, see
+# services/prompt_builder.py) instead of a fixed number of characters
+USER_PROMPT = """
     Analyse le texte de l'annonce ci-dessous et extrais les informations suivantes au format JSON strict.
-    
+
     Champs requis :
     - Poste (Titre du job)
     - Entreprise (Nom de la boite, ou "Non spécifié")
@@ -51,7 +30,7 @@ def parse_raw_job_text(raw_text, progress_callback=None):
 
     Si tu ne trouves pas une info, mets "Non spécifié".
     Ne rajoute aucun texte avant ou après le JSON.
-    
+
     Format de sortie :
     {{
         "Poste": "...",
@@ -62,64 +41,135 @@ def parse_raw_job_text(raw_text, progress_callback=None):
     }}
 
     ANNONCE :
-    {raw_text[:3000]} 
-    (Texte tronqué à 3000 chars pour performance)
+    {raw_text}
     """
 
-    messages = [
-        {"role": "system", "content": system_prompt},
-        {"role": "user", "content": user_prompt}
-    ]
 
-    text = tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
-    model_inputs = tokenizer([text], return_tensors="pt").to(model.device)
+def build_prompt(prompts, raw_text):
+    """Chat prompt of one ad, within the step 1 token budget."""
+    return prompts.build(USER_PROMPT, {"raw_text": raw_text}, system=SYSTEM_PROMPT)
+
+
+def parse_model_output(response_text):
+    """
+    Extracts the JSON object produced by the model and flattens its values to single lines.
+    Raises ValueError / json.JSONDecodeError if the output is not usable.
+    """
+    # Simple cleanup if model chats too much
+    json_str = response_text.strip()
+    if "```json" in json_str:
+        json_str = json_str.split("```json")[1].split("```")[0]
+    elif "{" in json_str and "}" in json_str:
+        start = json_str.find("{")
+        end = json_str.rfind("}") + 1
+        json_str = json_str[start:end]
+
+    data = json.loads(json_str)
+    if not isinstance(data, dict):
+        raise ValueError("la sortie IA n'est pas un objet JSON")
 
-    generated_ids = model.generate(
+    # CLEANUP: Remove newlines from all fields to match CSV expectations
+    def clean_val(v):
+        if isinstance(v, str):
+            return v.replace('\n', ' ').replace('\r', ' ').strip()
+        return v
+
+    for k, v in data.items():
+        data[k] = clean_val(v)
+
+    data['Lien'] = "Texte Brut (Manuel)"
+    return data
+
+
+def split_raw_ads(raw_text, delimiter=None):
+    """
+    Splits a payload containing several ads into a list of ad texts.
+    `delimiter` is a regex matched against whole lines; defaults to separator lines like '---' or '==='.
+    """
+    if not raw_text:
+        return []
+    pattern = re.compile(delimiter or DEFAULT_AD_DELIMITER, re.MULTILINE)
+    ads = [ad.strip() for ad in pattern.split(raw_text)]
+    return [ad for ad in ads if ad]
+
+
+def _load_model(progress_callback=None):
+    model_name = GENERATION_MODEL_NAME
+    if progress_callback:
+        progress_callback(f"Chargement du modèle {model_name} pour analyse (précision : {get_quantization_mode()})...")
+
+    tokenizer, model = load_generation_model(model_name)
+    generator = Generator(model, tokenizer, stage="step1", progress_callback=progress_callback)
+    prompts = PromptBuilder(tokenizer, "step1", progress_callback=progress_callback)
+    return tokenizer, model, generator, prompts
+
+
+def _generate(tokenizer, model, generator, texts):
+    """Runs one batched generation over several chat prompts and returns the raw model outputs."""
+    model_inputs = tokenizer(texts, return_tensors="pt", padding=True).to(model.device)
+
+    generated_ids = generator.generate(
         **model_inputs,
         max_new_tokens=500,
         temperature=0.1,
-        do_sample=False 
+        do_sample=False
     )
-    
+
     generated_ids = [
         output_ids[len(input_ids):] for input_ids, output_ids in zip(model_inputs.input_ids, generated_ids)
     ]
-    response_text = tokenizer.batch_decode(generated_ids, skip_special_tokens=True)[0]
+    return tokenizer.batch_decode(generated_ids, skip_special_tokens=True)
+
+
+def _close(generator, prompts):
+    """Flushes the decoding and prompt reports of the stage, before the model is freed (free_memory)."""
+    generator.close()
+    prompts.report()
+
+
+def parse_raw_job_text(raw_text, progress_callback=None):
+    """
+    Parses raw job text into structured data (Poste, Entreprise, Lieu, Missions, Profil) using Qwen.
+    """
+
+    if not raw_text or len(raw_text.strip()) < 10:
+        if progress_callback:
+            progress_callback("❌ Erreur : Texte fourni trop court.")
+        return None
+
+    # 1. Load Model
+    try:
+        tokenizer, model, generator, prompts = _load_model(progress_callback)
+    except Exception as e:
+        if progress_callback:
+            progress_callback(f"❌ Erreur chargement modèle : {e}")
+        return None
+
+    # 2. Prompting
+    if progress_callback:
+        progress_callback("🧠 Analyse sémantique de l'annonce...")
+
+    response_text = _generate(tokenizer, model, generator, [build_prompt(prompts, raw_text)])[0]
+
+    # Cleanup: the model is no longer needed, also when the output does not parse
+    _close(generator, prompts)
+    tokenizer = model = generator = prompts = None
+    free_memory()
 
     # 3. Parsing JSON
     try:
-        # Simple cleanup if model chats too much
-        json_str = response_text.strip()
-        if "```json" in json_str:
-            json_str = json_str.split("```json")[1].split("```")[0]
-        elif "{" in json_str and "}" in json_str:
-            start = json_str.find("{")
-            end = json_str.rfind("}") + 1
-            json_str = json_str[start:end]
-            
-        data = json.loads(json_str)
-
-        # CLEANUP: Remove newlines from all fields to match CSV expectations
-        def clean_val(v):
-            if isinstance(v, str):
-                return v.replace('\n', ' ').replace('\r', ' ').strip()
-            return v
-
-        for k, v in data.items():
-            data[k] = clean_val(v)
-
-        data['Lien'] = "Texte Brut (Manuel)"
-        
+        data = parse_model_output(response_text)
+
         # Create DataFrame
         df = pd.DataFrame([data])
-        
+
         # Save to CSV (This REPLACES jobs_raw.csv as per Step 1 behavior)
         if not os.path.exists(DATA_DIR):
             os.makedirs(DATA_DIR)
-            
+
         output_path = os.path.join(DATA_DIR, "jobs_raw.csv")
-        df.to_csv(output_path, index=False, encoding='utf-8-sig')
-        
+        write_csv(df, output_path, inputs=(raw_text,), index=False, encoding='utf-8-sig')
+
         if progress_callback:
             progress_callback(f"✅ Analyse réussie : {data.get('Poste', 'Job')} chez {data.get('Entreprise', 'N/A')}")
 
@@ -128,11 +178,134 @@ def parse_raw_job_text(raw_text, progress_callback=None):
             progress_callback(f"❌ Erreur parsing JSON sortie IA : {e}\nRaw output: {response_text[:100]}...")
         return None
 
+    return output_path
+
+
+def parse_raw_job_texts(raw_texts=None, raw_text=None, delimiter=None, file_path=None,
+                        batch_size=4, append=True, progress_callback=None):
+    """
+    Bulk version of parse_raw_job_text.
+    Ads come either as a list (`raw_texts`), as one delimited payload (`raw_text`) or as an
+    uploaded text file (`file_path`). They are parsed with batched generation on a single model
+    load and appended to jobs_raw.csv (or replace it if `append` is False).
+    A per-ad report is written to bulk_parse_report.csv.
+    """
+    ads = list(raw_texts or [])
+    if raw_text:
+        ads.extend(split_raw_ads(raw_text, delimiter))
+    if file_path:
+        try:
+            with open(file_path, 'r', encoding='utf-8-sig') as f:
+                ads.extend(split_raw_ads(f.read(), delimiter))
+        except Exception as e:
+            if progress_callback:
+                progress_callback(f"❌ Erreur lecture fichier : {e}")
+            return None
+
+    report = []
+    valid_ads = []
+    for i, ad in enumerate(ads):
+        if not ad or len(ad.strip()) < 10:
+            report.append({"Annonce": i + 1, "Statut": "ERREUR", "Poste": "", "Entreprise": "",
+                           "Detail": "Texte fourni trop court", "Extrait": (ad or "")[:80]})
+        else:
+            valid_ads.append((i, ad))
+
+    if not valid_ads:
+        if progress_callback:
+            progress_callback("❌ Erreur : Aucune annonce exploitable dans le texte fourni.")
+        return None
+
+    if progress_callback:
+        progress_callback(f"📋 {len(ads)} annonces détectées ({len(valid_ads)} exploitables).")
+
+    # 1. Load Model (once for all ads)
+    try:
+        tokenizer, model, generator, prompts = _load_model(progress_callback)
+    except Exception as e:
+        if progress_callback:
+            progress_callback(f"❌ Erreur chargement modèle : {e}")
+        return None
+
+    # Decoder-only models must be left-padded for batched generation
+    tokenizer.padding_side = "left"
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+
+    # 2. Batched generation. Ads are batched by prompt length, so that the prompts of a batch
+    # need little left padding; the rows keep the order of the ads.
+    built = []
+    for i, ad in valid_ads:
+        text = build_prompt(prompts, ad)
+        built.append((prompts.prompt_tokens[-1], i, ad, text))
+    built.sort(key=lambda item: item[0])
+    valid_ads = [(i, ad) for _, i, ad, _ in built]
+    texts = [text for _, _, _, text in built]
+
+    parsed_rows = []
+    batch_size = max(1, int(batch_size))
+    for start in range(0, len(valid_ads), batch_size):
+        batch = valid_ads[start:start + batch_size]
+        if progress_callback:
+            progress_callback(f"🧠 Analyse des annonces {start + 1}-{start + len(batch)}/{len(valid_ads)}...")
+
+        try:
+            responses = _generate(tokenizer, model, generator, texts[start:start + batch_size])
+        except Exception as e:
+            for i, ad in batch:
+                report.append({"Annonce": i + 1, "Statut": "ERREUR", "Poste": "", "Entreprise": "",
+                               "Detail": f"Erreur génération : {e}", "Extrait": ad[:80]})
+            if progress_callback:
+                progress_callback(f"❌ Erreur génération sur le lot {start + 1}-{start + len(batch)} : {e}")
+            continue
+
+        for (i, ad), response_text in zip(batch, responses):
+            try:
+                data = parse_model_output(response_text)
+                parsed_rows.append((i, data))
+                report.append({"Annonce": i + 1, "Statut": "OK", "Poste": data.get('Poste', ''),
+                               "Entreprise": data.get('Entreprise', ''), "Detail": "", "Extrait": ad[:80]})
+                if progress_callback:
+                    progress_callback(f"✅ Annonce {i + 1} : {data.get('Poste', 'Job')} chez {data.get('Entreprise', 'N/A')}")
+            except Exception as e:
+                report.append({"Annonce": i + 1, "Statut": "ERREUR", "Poste": "", "Entreprise": "",
+                               "Detail": f"Erreur parsing JSON sortie IA : {e}", "Extrait": ad[:80]})
+                if progress_callback:
+                    progress_callback(f"❌ Annonce {i + 1} : erreur parsing JSON ({e})")
+
     # Cleanup
-    del model
-    del tokenizer
-    if torch.cuda.is_available():
-        torch.cuda.empty_cache()
-    gc.collect()
+    _close(generator, prompts)
+    tokenizer = model = generator = prompts = None
+    free_memory()
+    parsed_rows = [data for _, data in sorted(parsed_rows, key=lambda item: item[0])]
+
+    # 3. Append to the job store
+    if not os.path.exists(DATA_DIR):
+        os.makedirs(DATA_DIR)
 
+    output_path = os.path.join(DATA_DIR, "jobs_raw.csv")
+    report_path = os.path.join(DATA_DIR, "bulk_parse_report.csv")
+
+    df_report = pd.DataFrame(report).sort_values(by="Annonce")
+    write_csv(df_report, report_path, inputs=tuple(ads), index=False, encoding='utf-8-sig')
+
+    if parsed_rows:
+        df_new = pd.DataFrame(parsed_rows)
+        df_new = df_new.reindex(columns=JOB_COLUMNS + [c for c in df_new.columns if c not in JOB_COLUMNS])
+        if append and os.path.exists(output_path):
+            try:
+                df_existing = pd.read_csv(output_path)
+                df_new = pd.concat([df_existing, df_new], ignore_index=True)
+            except Exception as e:
+                if progress_callback:
+                    progress_callback(f"⚠️ jobs_raw.csv illisible, il sera remplacé : {e}")
+        write_csv(df_new, output_path, inputs=tuple(ads), index=False, encoding='utf-8-sig')
+
+    n_ok = len(parsed_rows)
+    n_err = len(report) - n_ok
+    if progress_callback:
+        progress_callback(f"✅ Analyse en masse terminée : {n_ok} réussie(s), {n_err} échec(s). Rapport : bulk_parse_report.csv")
+
+    if not parsed_rows:
+        return None
     return output_path
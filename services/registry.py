@@ -0,0 +1,98 @@
+import importlib
+import os
+import threading
+import time
+
+# Pipeline entry points and the module defining each of them.
+# Modules (and their torch / transformers / sentence_transformers / sklearn / selenium imports)
+# are only imported the first time the entry point is used.
+SERVICES = {
+    "scrape_jobs": "services.scraper",
+    "parse_raw_job_text": "services.raw_job_parser",
+    "parse_raw_job_texts": "services.raw_job_parser",
+    "rewrite_jobs": "services.job_rewriter",
+    "convert_cv_to_txt": "services.cv_converter",
+    "rewrite_cv": "services.cv_rewriter",
+    "calculate_matches": "services.matcher",
+    "calculate_cross_matches": "services.cross_encoder_matcher",
+    "run_matching": "services.matching_engine",
+    "explain_matches": "services.explain",
+    "explain_match": "services.explain",
+}
+
+_lock = threading.Lock()
+_import_seconds = {}
+_warm_up = {"state": "disabled", "seconds": None, "error": None}
+
+
+def stubs_enabled():
+    return os.environ.get("JOBAPP_STUB_SERVICES", "0") != "0"
+
+
+def get_service(name):
+    """Imports the module of `name` on first use and returns the entry point."""
+    if stubs_enabled():
+        from services.stubs import make_stub
+        return make_stub(name)
+    module_name = SERVICES[name]
+    with _lock:
+        if module_name not in _import_seconds:
+            t0 = time.perf_counter()
+            importlib.import_module(module_name)
+            _import_seconds[module_name] = time.perf_counter() - t0
+    return getattr(importlib.import_module(module_name), name)
+
+
+def lazy_service(name):
+    """
+    Callable placeholder for a service: the import happens when it is called (inside the
+    task thread), not when the route is registered.
+    """
+    def call(*args, **kwargs):
+        return get_service(name)(*args, **kwargs)
+    call.__name__ = name
+    return call
+
+
+def warm_up(progress_callback=None):
+    """Imports every service module, in pipeline order."""
+    if stubs_enabled():
+        return
+    t0 = time.perf_counter()
+    for name in SERVICES:
+        get_service(name)
+    if progress_callback:
+        progress_callback(f"Services préchargés en {time.perf_counter() - t0:.1f}s")
+
+
+def start_warm_up(progress_callback=None):
+    """
+    Starts the background warm-up when JOBAPP_WARMUP=1, so that the first step does not pay
+    the import cost. The UI is served meanwhile.
+    """
+    if os.environ.get("JOBAPP_WARMUP", "0") == "0":
+        return None
+
+    def run():
+        _warm_up["state"] = "running"
+        t0 = time.perf_counter()
+        try:
+            warm_up(progress_callback)
+            _warm_up["state"] = "done"
+        except Exception as e:
+            # A missing optional dependency (e.g. selenium) only breaks its own step
+            _warm_up["state"] = "error"
+            _warm_up["error"] = str(e)
+        _warm_up["seconds"] = time.perf_counter() - t0
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
+
+
+def get_status():
+    from services.model_manifest import load_times
+
+    with _lock:
+        loaded = {module: round(seconds, 3) for module, seconds in _import_seconds.items()}
+    return {"loaded_modules": loaded, "warm_up": dict(_warm_up), "model_loads": load_times()}
@@ -6,6 +6,7 @@ import os
 from selenium import webdriver
 from selenium.webdriver.edge.options import Options
 from selenium.webdriver.common.by import By
+from utils.artifacts import write_csv
 
 # Ensure data directory exists
 DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data')
@@ -103,6 +104,128 @@ def expand_profil_section(driver):
     except Exception:
         pass
 
+# --- 4 bis. EXTRACTION GROUPÉE (UN SEUL APPEL WEBDRIVER PAR PAGE) ---
+# Each find_element / .text is one WebDriver round-trip: the scripts below read the whole page
+# in the browser and return structured data, with the same selectors as the per-element path.
+CARDS_SCRIPT = """
+const maxJobs = arguments[0];
+const jobs = [];
+for (const card of document.querySelectorAll('ul > li')) {
+    if (jobs.length >= maxJobs) break;
+    const title = card.querySelector('h3');
+    const link = card.querySelector('a');
+    if (!title || !link) continue;
+    jobs.push({title: title.innerText.split('\\n')[0], lines: card.innerText.split('\\n'), link: link.href});
+}
+return jobs;
+"""
+
+DETAIL_SCRIPT = """
+const done = arguments[arguments.length - 1];
+const xpath = (expr) => {
+    const result = document.evaluate(expr, document, null, XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null);
+    const nodes = [];
+    for (let i = 0; i < result.snapshotLength; i++) nodes.push(result.snapshotItem(i));
+    return nodes;
+};
+let expanded = false;
+for (const target of xpath("//*[contains(text(), 'Profil') or contains(text(), 'profil')]")) {
+    const text = target.innerText.toLowerCase();
+    const tag = target.tagName.toLowerCase();
+    if ((text.includes('recherché') || text.includes('attendu')) && ['h2', 'h3', 'h4', 'span', 'button', 'div'].includes(tag)) {
+        target.click();
+        expanded = true;
+        break;
+    }
+}
+// Same pause as the per-element path, to let the section unfold
+setTimeout(() => {
+    const main = document.querySelector('main') || document.body;
+    const rescue = xpath("//*[contains(text(), 'Profil')]/following-sibling::div")[0];
+    done({text: main.innerText, profil: rescue ? rescue.innerText : '', expanded: expanded});
+}, expanded ? arguments[0] : 0);
+"""
+
+
+def bulk_extraction_enabled():
+    """JOBAPP_SCRAPER_BULK=0 falls back to element-by-element extraction."""
+    return os.environ.get("JOBAPP_SCRAPER_BULK", "1") != "0"
+
+
+def card_fields(title, lines, link):
+    """(Poste, Entreprise, Lieu, Lien) of a result card from its title and text lines."""
+    # Heuristique pour l'entreprise et le lieu
+    raw_company = lines[1] if len(lines) > 1 else "N/A"
+    raw_location = "N/A"
+    if len(lines) > 2 and len(lines[2]) < 50:
+        raw_location = lines[2]
+    return {
+        "Poste": clean_text(title),
+        "Entreprise": clean_text(raw_company),
+        "Lieu": clean_text(raw_location),
+        "Lien": link
+    }
+
+
+def extract_cards(driver, num_jobs):
+    """Every result card of the page in one script execution."""
+    return [card_fields(card['title'], card['lines'], card['link'])
+            for card in driver.execute_script(CARDS_SCRIPT, num_jobs) or []]
+
+
+def extract_cards_by_element(driver, num_jobs):
+    job_links = []
+    potential_jobs = driver.find_elements(By.CSS_SELECTOR, "ul > li")
+
+    for card in potential_jobs:
+        if len(job_links) >= num_jobs: break
+        try:
+            # Check for h3 title
+            if card.find_elements(By.TAG_NAME, "h3"):
+                link_elem = card.find_element(By.TAG_NAME, "a")
+                link = link_elem.get_attribute("href")
+
+                # Raw text extraction
+                raw_title = card.find_element(By.TAG_NAME, "h3").text.split('\n')[0]
+                job_links.append(card_fields(raw_title, card.text.split('\n'), link))
+        except Exception as e:
+            continue
+    return job_links
+
+
+def extract_detail(driver):
+    """(Missions, Profil_Recherche) of an offer page in one script execution (profile unfolded first)."""
+    page = driver.execute_async_script(DETAIL_SCRIPT, 500)
+    missions, profil = extract_mission_profil(page['text'])
+    # Rescue Fallback
+    if len(profil) < 20 and page['profil']:
+        profil = clean_text(page['profil'])
+    return missions, profil
+
+
+def extract_detail_by_element(driver):
+    # Clic pour ouvrir le profil (Improved)
+    expand_profil_section(driver)
+
+    # Récupération du texte (Improved)
+    try:
+        full_desc_elem = driver.find_element(By.TAG_NAME, "main")
+        full_desc = full_desc_elem.text
+    except:
+        full_desc = driver.find_element(By.TAG_NAME, "body").text
+
+    missions, profil = extract_mission_profil(full_desc)
+
+    # Rescue Fallback
+    if len(profil) < 20:
+        try:
+            xpath_rescue = "//*[contains(text(), 'Profil')]/following-sibling::div"
+            profil_elem = driver.find_element(By.XPATH, xpath_rescue)
+            profil = clean_text(profil_elem.text)
+        except:
+            pass
+    return missions, profil
+
 # --- 5. FONCTION PRINCIPALE ---
 def scrape_jobs(keyword, num_jobs=10, progress_callback=None):
     if progress_callback:
@@ -144,6 +267,7 @@ def scrape_jobs(keyword, num_jobs=10, progress_callback=None):
         driver = webdriver.Edge(options=options)
 
     all_jobs_data = []
+    bulk = bulk_extraction_enabled()
     
     try:
         # --- PHASE 1 : LINK & LOCATION SCRAPING ---
@@ -195,38 +319,16 @@ def scrape_jobs(keyword, num_jobs=10, progress_callback=None):
                     progress_callback(f"⚠️ Tentative lecture offre unique échouée: {e}")
         else:
             # --- STANDARD SEARCH RESULTS SCRAPING ---
-            potential_jobs = driver.find_elements(By.CSS_SELECTOR, "ul > li")
-            
-            for card in potential_jobs:
-                if len(job_links) >= num_jobs: break
+            job_links = None
+            if bulk:
                 try:
-                    # Check for h3 title
-                    if card.find_elements(By.TAG_NAME, "h3"):
-                        link_elem = card.find_element(By.TAG_NAME, "a")
-                        link = link_elem.get_attribute("href")
-                        
-                        # Raw text extraction
-                        raw_title = card.find_element(By.TAG_NAME, "h3").text.split('\n')[0]
-                        txt_lines = card.text.split('\n')
-                        
-                        # Heuristique pour l'entreprise et le lieu
-                        raw_company = txt_lines[1] if len(txt_lines) > 1 else "N/A"
-                        
-                        # RÉCUPÉRATION DU LIEU ICI
-                        raw_location = "N/A"
-                        if len(txt_lines) > 2:
-                            potential_loc = txt_lines[2]
-                            if len(potential_loc) < 50:
-                                raw_location = potential_loc
-                        
-                        job_links.append({
-                            "Poste": clean_text(raw_title),
-                            "Entreprise": clean_text(raw_company),
-                            "Lieu": clean_text(raw_location),
-                            "Lien": link
-                        })
+                    job_links = extract_cards(driver, num_jobs)
                 except Exception as e:
-                    continue
+                    if progress_callback:
+                        progress_callback(f"⚠️ Extraction groupée indisponible, lecture élément par élément : {e}")
+                    bulk = False
+            if job_links is None:
+                job_links = extract_cards_by_element(driver, num_jobs)
             
         if progress_callback:
             progress_callback(f"✅ {len(job_links)} offres trouvées. Analyse détaillée...")
@@ -244,26 +346,16 @@ def scrape_jobs(keyword, num_jobs=10, progress_callback=None):
                 time.sleep(2) 
                 handle_cookies(driver)
 
-                # Clic pour ouvrir le profil (Improved)
-                expand_profil_section(driver)
-                
-                # Récupération du texte (Improved)
-                try:
-                    full_desc_elem = driver.find_element(By.TAG_NAME, "main")
-                    full_desc = full_desc_elem.text
-                except:
-                    full_desc = driver.find_element(By.TAG_NAME, "body").text
-
-                missions, profil = extract_mission_profil(full_desc)
-                
-                # Rescue Fallback
-                if len(profil) < 20:
+                missions = None
+                if bulk:
                     try:
-                        xpath_rescue = "//*[contains(text(), 'Profil')]/following-sibling::div"
-                        profil_elem = driver.find_element(By.XPATH, xpath_rescue)
-                        profil = clean_text(profil_elem.text)
-                    except:
-                        pass
+                        missions, profil = extract_detail(driver)
+                    except Exception as e:
+                        if progress_callback:
+                            progress_callback(f"⚠️ Extraction groupée indisponible, lecture élément par élément : {e}")
+                        bulk = False
+                if missions is None:
+                    missions, profil = extract_detail_by_element(driver)
 
                 all_jobs_data.append({
                     "Poste": job['Poste'],
@@ -293,6 +385,6 @@ def scrape_jobs(keyword, num_jobs=10, progress_callback=None):
 
     df = pd.DataFrame(all_jobs_data)
     output_path = os.path.join(DATA_DIR, "jobs_raw.csv")
-    df.to_csv(output_path, index=False, encoding='utf-8-sig', sep=',')
+    write_csv(df, output_path, inputs=(keyword, num_jobs), index=False, encoding='utf-8-sig', sep=',')
     
     return output_path
@@ -0,0 +1,548 @@
+import os
+import time
+import hashlib
+import threading
+import socketserver
+import multiprocessing
+from collections import OrderedDict
+from contextlib import ExitStack, contextmanager
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from services.model_server import ModelServerClient, encode_array, decode_array, _Handler
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data')
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 5056
+
+# Sharded scoring: the normalized job matrix is placed once in shared memory and split in
+# contiguous row ranges over a pool of worker processes (JOBAPP_SCORING_WORKERS), which map it
+# without copy; each returns the top-K of its rows and the coordinator merges them. Worker
+# hosts (JOBAPP_SCORING_HOSTS, started with --serve) each receive one slice of the matrix and
+# shard it again over their own pool.
+# Below these sizes, starting the workers costs more than scoring in the calling process:
+# job rows for the matrix scan, texts or pairs for the encoder / reranker pools
+SHARD_MIN_ROWS = 20000
+SHARD_MIN_TEXTS = 2000
+# Texts / pairs per task of the encoder and reranker pools
+MODEL_CHUNK = 256
+# Matrices kept by a worker host (one per job archive being scored)
+HOST_MATRICES = 2
+
+
+def get_scoring_workers(workers=None):
+    """Worker processes: explicit argument, then JOBAPP_SCORING_WORKERS ("auto" = one per core, 0 = off)."""
+    value = str(workers if workers is not None else os.environ.get("JOBAPP_SCORING_WORKERS", "0")).strip().lower()
+    if value == "auto":
+        return os.cpu_count() or 1
+    return max(0, int(value or 0))
+
+
+def get_scoring_hosts(hosts=None):
+    """Worker hosts ("host:port" list): explicit argument, then JOBAPP_SCORING_HOSTS (comma-separated)."""
+    if hosts is None:
+        hosts = os.environ.get("JOBAPP_SCORING_HOSTS", "")
+    if isinstance(hosts, str):
+        hosts = hosts.split(",")
+    return [host.strip() for host in hosts if host and host.strip()]
+
+
+def sharding_enabled(n_rows, workers=None, hosts=None):
+    """True when a matrix of `n_rows` job rows is worth spreading over workers or hosts (JOBAPP_SCORING_MIN_ROWS)."""
+    if not (get_scoring_workers(workers) > 1 or get_scoring_hosts(hosts)):
+        return False
+    return n_rows >= int(os.environ.get("JOBAPP_SCORING_MIN_ROWS", SHARD_MIN_ROWS))
+
+
+def model_sharding_enabled(n_texts, workers=None):
+    """
+    True when `n_texts` texts or pairs are worth encoding / reranking over local worker
+    processes. Models served by the model server are left to its own batching, and models on
+    a GPU are not copied once per worker.
+    """
+    import torch
+    from services.model_loader import get_model_server
+
+    if get_model_server() or get_scoring_workers(workers) <= 1 or torch.cuda.is_available():
+        return False
+    return n_texts >= SHARD_MIN_TEXTS
+
+
+def _threads_per_worker(workers):
+    # Workers share the cores: no BLAS / torch thread oversubscription
+    return max(1, (os.cpu_count() or 1) // max(1, workers))
+
+
+def _pool(workers, initializer, initargs):
+    # Spawned workers start clean: no copy of the models, locks or threads of the caller
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                               initializer=initializer, initargs=initargs)
+
+
+# --- Shared memory ---
+
+class SharedMatrix:
+    """A float32 matrix in a named shared memory block; other processes map it by name, without copy."""
+
+    def __init__(self, shm, shape, owner):
+        self.shm = shm
+        self.shape = tuple(shape)
+        self.owner = owner
+        self.array = np.ndarray(self.shape, dtype=np.float32, buffer=shm.buf)
+
+    @classmethod
+    def create(cls, array=None, shape=None):
+        shape = np.shape(array) if array is not None else shape
+        size = max(1, int(np.prod(shape)) * 4)
+        matrix = cls(shared_memory.SharedMemory(create=True, size=size), shape, owner=True)
+        if array is not None:
+            matrix.array[...] = array
+        return matrix
+
+    @classmethod
+    def attach(cls, name, shape):
+        return cls(shared_memory.SharedMemory(name=name), shape, owner=False)
+
+    @property
+    def spec(self):
+        return self.shm.name, self.shape
+
+    def close(self):
+        self.array = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+def partial_top_k(scores, k):
+    """Indices and scores of the k best columns of each row (unsorted)."""
+    k = min(k, scores.shape[1])
+    if k <= 0:
+        return np.empty((scores.shape[0], 0), dtype=np.int64), np.empty((scores.shape[0], 0), dtype=np.float32)
+    part = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    return part, np.take_along_axis(scores, part, axis=1)
+
+
+def merge_top_k(parts, k):
+    """Merges partial (indices, scores) results into the global top-k of each row, best first."""
+    indices = np.concatenate([part[0] for part in parts], axis=1)
+    scores = np.concatenate([part[1] for part in parts], axis=1)
+    best, best_scores = partial_top_k(scores, k)
+    order = np.argsort(-best_scores, axis=1, kind='stable')
+    best = np.take_along_axis(best, order, axis=1)
+    return np.take_along_axis(indices, best, axis=1), np.take_along_axis(scores, best, axis=1)
+
+
+# --- Worker processes ---
+
+_worker = {}
+
+
+def _init_matrix_worker(spec, threads):
+    from threadpoolctl import threadpool_limits
+    threadpool_limits(threads)
+    _worker["matrix"] = SharedMatrix.attach(*spec)
+
+
+def _shard_scores(start, end, column, queries, out_spec):
+    # Rows [start, end) of the worker's slice are written at global columns [column, ...)
+    out = SharedMatrix.attach(*out_spec)
+    try:
+        out.array[:, column:column + end - start] = queries @ _worker["matrix"].array[start:end].T
+    finally:
+        out.close()
+
+
+def _shard_top_k(start, end, queries, k):
+    indices, scores = partial_top_k(queries @ _worker["matrix"].array[start:end].T, k)
+    return indices + start, scores
+
+
+def _shard_best_queries(start, end, queries, k):
+    # Every row lives in a single shard: its top-k over the queries is already final
+    return merge_top_k([partial_top_k(_worker["matrix"].array[start:end] @ queries.T, k)], k)
+
+
+def _init_model_worker(kind, model_name, threads):
+    import torch
+    from threadpoolctl import threadpool_limits
+    from services.model_loader import load_bi_encoder, load_cross_encoder
+
+    torch.set_num_threads(threads)
+    threadpool_limits(threads)
+    loader = load_bi_encoder if kind == "bi" else load_cross_encoder
+    # Each worker holds its own copy: a model server would serialize the calls again
+    _worker["model"] = loader(model_name, intra_op_threads=threads, server=False)
+
+
+def _encode_chunk(texts, batch_size, model=None):
+    model = _worker["model"] if model is None else model
+    return np.asarray(model.encode(texts, batch_size=batch_size, normalize_embeddings=True), dtype=np.float32)
+
+
+def _predict_chunk(pairs, batch_size, model=None):
+    model = _worker["model"] if model is None else model
+    return np.asarray(model.predict(pairs, batch_size=batch_size), dtype=np.float32)
+
+
+@contextmanager
+def _limited_threads(threads):
+    # The calling process works as one more worker: same thread share while the pool runs
+    import torch
+    from threadpoolctl import threadpool_limits
+
+    previous = torch.get_num_threads()
+    torch.set_num_threads(threads)
+    try:
+        with threadpool_limits(threads):
+            yield
+    finally:
+        torch.set_num_threads(previous)
+
+
+# --- Coordinator ---
+
+def _ranges(n_rows, n_parts):
+    bounds = np.linspace(0, n_rows, max(1, n_parts) + 1).astype(int)
+    return [(int(a), int(b)) for a, b in zip(bounds[:-1], bounds[1:]) if b > a]
+
+
+class ShardedScorer:
+    """
+    Dot products of query vectors with a job matrix (rows normalized by the caller), sharded
+    over a local process pool and over worker hosts. The matrix is copied once into shared
+    memory; workers read their row range in place.
+
+        with ShardedScorer(job_vectors, workers=4) as scorer:
+            indices, scores = scorer.top_k(cv_vectors, 10)
+    """
+
+    def __init__(self, matrix, workers=None, hosts=None, progress_callback=None):
+        matrix = np.asarray(matrix, dtype=np.float32)
+        self.n_rows, self.dim = matrix.shape
+        self.workers = get_scoring_workers(workers)
+        self.hosts = get_scoring_hosts(hosts)
+        self.progress_callback = progress_callback
+
+        # Rows are split evenly between this machine (when it has workers) and the hosts
+        nodes = (["local"] if self.workers > 0 or not self.hosts else []) + self.hosts
+        node_ranges = _ranges(self.n_rows, len(nodes))
+        self.local_range = node_ranges[0] if nodes[0] == "local" else None
+        # Each host keeps its slice under the hash of its content
+        self.remote = []
+        self._slices = {}
+        for host, (start, end) in zip(nodes, node_ranges):
+            if host != "local":
+                slice_id = hashlib.sha1(matrix[start:end].tobytes()).hexdigest()[:16]
+                self._slices[slice_id] = matrix[start:end]
+                self.remote.append((ModelServerClient(host, label="Hôte de scoring"), start, end, slice_id))
+
+        self.shared = None
+        self.executor = None
+        if self.local_range:
+            start, end = self.local_range
+            self.shared = SharedMatrix.create(matrix[start:end])
+            n_workers = max(1, self.workers)
+            self.executor = _pool(n_workers, _init_matrix_worker, (self.shared.spec, _threads_per_worker(n_workers)))
+            # Row ranges inside the local slice
+            self.shards = _ranges(end - start, n_workers)
+
+        # One thread per host, kept for the life of the scorer: each reuses its connection
+        self._threads = ThreadPoolExecutor(max_workers=len(self.remote)) if self.remote else None
+        try:
+            for client, _, _, slice_id in self.remote:
+                self._load(client, slice_id)
+        except Exception:
+            self.close()
+            raise
+
+        if progress_callback:
+            local = f"{max(1, self.workers)} processus locaux" if self.local_range else "aucun processus local"
+            progress_callback(f"Scoring réparti : {self.n_rows} offres, {local}, {len(self.remote)} hôte(s).")
+
+    def _load(self, client, slice_id):
+        client.request({"op": "load", "matrix": slice_id, "vectors": encode_array(self._slices[slice_id])})
+
+    def _remote_request(self, client, slice_id, payload):
+        payload = dict(payload, matrix=slice_id)
+        try:
+            return client.request(payload)
+        except RuntimeError as e:
+            # Restarted host (or slice evicted): send the slice again and retry once
+            if "matrice inconnue" not in str(e):
+                raise
+            self._load(client, slice_id)
+            return client.request(payload)
+
+    def _remote_map(self, payload):
+        """Sends `payload` to every host in parallel. Returns [(first row, response)]."""
+        if not self.remote:
+            return []
+        futures = [(start, self._threads.submit(self._remote_request, client, slice_id, payload))
+                   for client, start, _, slice_id in self.remote]
+        return [(start, future.result()) for start, future in futures]
+
+    def scores(self, queries):
+        """(n_queries, n_rows) matrix of all scores."""
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        out = SharedMatrix.create(shape=(len(queries), self.n_rows))
+        try:
+            futures = []
+            if self.executor is not None:
+                # Workers write their columns of the output in place
+                base = self.local_range[0]
+                futures = [self.executor.submit(_shard_scores, start, end, base + start, queries, out.spec)
+                           for start, end in self.shards]
+            for start, response in self._remote_map({"op": "scores", "queries": encode_array(queries)}):
+                remote_scores = decode_array(response["scores"])
+                out.array[:, start:start + remote_scores.shape[1]] = remote_scores
+            for future in futures:
+                future.result()
+            return np.array(out.array)
+        finally:
+            out.close()
+
+    def top_k(self, queries, k):
+        """Indices (into the matrix rows) and scores of the k best rows per query, best first."""
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        futures = []
+        if self.executor is not None:
+            futures = [self.executor.submit(_shard_top_k, start, end, queries, k) for start, end in self.shards]
+        parts = [
+            (np.asarray(response["indices"], dtype=np.int64) + start, decode_array(response["scores"]))
+            for start, response in self._remote_map({"op": "top_k", "queries": encode_array(queries), "k": int(k)})
+        ]
+        for future in futures:
+            indices, scores = future.result()
+            parts.append((indices + self.local_range[0], scores))
+        return merge_top_k(parts, k)
+
+    def best_queries(self, queries, k):
+        """
+        Indices (into `queries`) and scores of the k best queries per matrix row, best first:
+        (n_rows, k) arrays, each shard ranking its own rows.
+        """
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        k = min(k, len(queries))
+        indices = np.empty((self.n_rows, k), dtype=np.int64)
+        scores = np.empty((self.n_rows, k), dtype=np.float32)
+        futures = []
+        if self.executor is not None:
+            base = self.local_range[0]
+            futures = [(base + start, self.executor.submit(_shard_best_queries, start, end, queries, k))
+                       for start, end in self.shards]
+        for start, response in self._remote_map({"op": "best_queries", "queries": encode_array(queries), "k": k}):
+            part_scores = decode_array(response["scores"])
+            indices[start:start + len(part_scores)] = np.asarray(response["indices"], dtype=np.int64).reshape(part_scores.shape)
+            scores[start:start + len(part_scores)] = part_scores
+        for start, future in futures:
+            part_indices, part_scores = future.result()
+            indices[start:start + len(part_scores)] = part_indices
+            scores[start:start + len(part_scores)] = part_scores
+        return indices, scores
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+        if self.shared is not None:
+            self.shared.close()
+            self.shared = None
+        if self._threads is not None:
+            self._threads.shutdown()
+            self._threads = None
+        for client, _, _, _ in self.remote:
+            client.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _model_map(kind, model_name, function, items, workers, batch_size, progress_callback, model=None):
+    workers = max(1, get_scoring_workers(workers))
+    threads = _threads_per_worker(workers)
+    chunks = [items[start:start + MODEL_CHUNK] for start in range(0, len(items), MODEL_CHUNK)]
+    # A model already loaded by the caller takes one worker's share (the last chunks): only
+    # workers - 1 more copies are loaded
+    pool_workers = workers - 1 if model is not None else workers
+    n_local = (len(chunks) if pool_workers == 0 else len(chunks) // workers) if model is not None else 0
+    pool_chunks, local_chunks = chunks[:len(chunks) - n_local], chunks[len(chunks) - n_local:]
+
+    done = []
+
+    def collect(result):
+        done.append(result)
+        if progress_callback and len(done) % max(1, len(chunks) // 10) == 0:
+            progress_callback(f"{'Encodage' if kind == 'bi' else 'Reranking'} réparti : "
+                              f"{min(len(done) * MODEL_CHUNK, len(items))}/{len(items)}")
+
+    with ExitStack() as stack:
+        pending = []
+        if pool_chunks:
+            executor = stack.enter_context(_pool(pool_workers, _init_model_worker, (kind, model_name, threads)))
+            pending = [executor.submit(function, chunk, batch_size) for chunk in pool_chunks]
+        local_results = []
+        if local_chunks:
+            with _limited_threads(threads):
+                for chunk in local_chunks:
+                    local_results.append(function(chunk, batch_size, model))
+                    collect(local_results[-1])
+        pool_results = []
+        for future in pending:
+            pool_results.append(future.result())
+            collect(pool_results[-1])
+    return pool_results + local_results
+
+
+def sharded_encode(texts, model_name, workers=None, batch_size=32, model=None, progress_callback=None):
+    """
+    Normalized embeddings of `texts`, encoded by chunks over a pool of bi-encoder processes.
+    `model`, the caller's bi-encoder when already loaded, encodes its share in this process.
+    """
+    results = _model_map("bi", model_name, _encode_chunk, list(texts), workers, batch_size, progress_callback, model)
+    return np.concatenate(results) if results else np.zeros((0, 0), dtype=np.float32)
+
+
+def sharded_predict(pairs, model_name, workers=None, batch_size=32, model=None, progress_callback=None):
+    """Cross-encoder logits of `pairs`, predicted by chunks over a pool of reranker processes (see sharded_encode)."""
+    results = _model_map("cross", model_name, _predict_chunk, [list(pair) for pair in pairs], workers,
+                          batch_size, progress_callback, model)
+    return np.concatenate(results) if results else np.zeros(0, dtype=np.float32)
+
+
+# --- Worker host ---
+
+class ScoringHost(socketserver.ThreadingTCPServer):
+    """Holds matrix slices sent by coordinators and scores them over its own process pool."""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, workers=None):
+        self.workers = get_scoring_workers(workers) or (os.cpu_count() or 1)
+        self.started = time.time()
+        self.matrices = OrderedDict()
+        self.lock = threading.Lock()
+        super().__init__(address, _Handler)
+
+    def _scorer(self, matrix_id):
+        with self.lock:
+            if matrix_id not in self.matrices:
+                raise KeyError(f"matrice inconnue {matrix_id}")
+            self.matrices.move_to_end(matrix_id)
+            return self.matrices[matrix_id]
+
+    def handle_request_payload(self, request):
+        op = request.get("op")
+        if op == "ping":
+            return {"ok": True, "uptime_s": time.time() - self.started, "workers": self.workers,
+                    "matrices": {key: scorer.n_rows for key, scorer in self.matrices.items()}}
+        if op == "load":
+            scorer = ShardedScorer(decode_array(request["vectors"]), workers=self.workers, hosts=[])
+            with self.lock:
+                previous = self.matrices.pop(request["matrix"], None)
+                self.matrices[request["matrix"]] = scorer
+                evicted = [self.matrices.popitem(last=False)[1] for _ in range(max(0, len(self.matrices) - HOST_MATRICES))]
+            for old in ([previous] if previous else []) + evicted:
+                old.close()
+            return {"ok": True, "rows": scorer.n_rows}
+        queries = decode_array(request["queries"])
+        if op == "scores":
+            return {"scores": encode_array(self._scorer(request["matrix"]).scores(queries))}
+        if op == "top_k":
+            indices, scores = self._scorer(request["matrix"]).top_k(queries, int(request["k"]))
+            return {"indices": indices.tolist(), "scores": encode_array(scores)}
+        if op == "best_queries":
+            indices, scores = self._scorer(request["matrix"]).best_queries(queries, int(request["k"]))
+            return {"indices": indices.tolist(), "scores": encode_array(scores)}
+        raise ValueError(f"Opération inconnue : {op}")
+
+    def server_close(self):
+        super().server_close()
+        for scorer in self.matrices.values():
+            scorer.close()
+
+
+def serve(host=DEFAULT_HOST, port=DEFAULT_PORT, workers=None):
+    server = ScoringHost((host, port), workers)
+    print(f"✅ Hôte de scoring ({server.workers} processus) à l'écoute sur {host}:{port}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+def benchmark(n_rows=200000, dim=1024, n_queries=16, k=10, workers=None, hosts=None, progress_callback=None):
+    """
+    Top-k throughput of the single-process scan against the sharded scorer on synthetic
+    vectors, with a check that both return the same rows. Writes data/sharded_scoring_benchmark.csv.
+    """
+    import pandas as pd
+    from utils.artifacts import write_csv
+
+    rng = np.random.default_rng(0)
+    matrix = rng.standard_normal((n_rows, dim), dtype=np.float32)
+    matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+    queries = matrix[rng.choice(n_rows, n_queries, replace=False)] + 0.1 * rng.standard_normal((n_queries, dim), dtype=np.float32)
+
+    t0 = time.perf_counter()
+    reference, _ = merge_top_k([partial_top_k(queries @ matrix.T, k)], k)
+    single_s = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    scorer = ShardedScorer(matrix, workers, hosts)
+    setup_s = time.perf_counter() - t0
+    try:
+        scorer.top_k(queries[:1], k)  # workers started and attached
+        t0 = time.perf_counter()
+        indices, _ = scorer.top_k(queries, k)
+        sharded_s = time.perf_counter() - t0
+    finally:
+        scorer.close()
+
+    row = {
+        "Offres": n_rows,
+        "Dimension": dim,
+        "Requetes": n_queries,
+        "Processus": max(1, scorer.workers) if scorer.local_range else 0,
+        "Hotes": len(scorer.remote),
+        "Mise_en_place_s": setup_s,
+        "Mono_processus_s": single_s,
+        "Reparti_s": sharded_s,
+        "Acceleration": single_s / sharded_s if sharded_s else None,
+        "Top_k_identique": bool(np.array_equal(reference, indices)),
+    }
+    if progress_callback:
+        progress_callback(f"{n_rows} offres x {n_queries} requêtes : mono {single_s * 1000:.0f} ms | "
+                          f"réparti {sharded_s * 1000:.0f} ms (x{row['Acceleration']:.2f}, mise en place {setup_s:.1f}s) | "
+                          f"top-{k} identique : {row['Top_k_identique']}")
+    output_path = os.path.join(DATA_DIR, "sharded_scoring_benchmark.csv")
+    write_csv(pd.DataFrame([row]), output_path, inputs=(n_rows, dim, n_queries, k, workers, hosts), index=False)
+    return row
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Scoring réparti des offres : processus locaux et hôtes de scoring.")
+    parser.add_argument("--serve", action="store_true", help="Lance un hôte de scoring (socket TCP)")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--workers", default=None, help="Processus de scoring (défaut : JOBAPP_SCORING_WORKERS, 'auto' = un par cœur)")
+    parser.add_argument("--hosts", default=None, help="Hôtes host:port séparés par des virgules (benchmark)")
+    parser.add_argument("--n", type=int, default=200000, help="Nombre de vecteurs synthétiques (benchmark)")
+    parser.add_argument("--dim", type=int, default=1024)
+    parser.add_argument("--queries", type=int, default=16)
+    parser.add_argument("--top-k", type=int, default=10)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.host, args.port, args.workers)
+    else:
+        benchmark(args.n, args.dim, args.queries, args.top_k, workers=args.workers or "auto", hosts=args.hosts,
+                  progress_callback=print)
@@ -0,0 +1,417 @@
+import os
+import re
+import json
+import time
+import hashlib
+import unicodedata
+
+from utils.jobs import job_key
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data')
+INDEX_PATH = os.path.join(DATA_DIR, 'index', 'skills.json')
+CV_PROFILE_PATH = os.path.join(DATA_DIR, 'cv_profile.json')
+
+# Structured columns written by step 2 next to Resume_IA (lists are joined with LIST_SEP)
+STRUCTURED_COLUMNS = ('Profil_Type', 'Competences', 'Soft_Skills', 'Seniority', 'Core_Mission')
+LIST_COLUMNS = ('Competences', 'Soft_Skills')
+LIST_SEP = "; "
+
+# Labels of the step 2 summary (accent-free, lowercase) -> structured column
+_FIELD_LABELS = {
+    'type de profil recherche': 'Profil_Type',
+    'type de profil': 'Profil_Type',
+    'competences cles': 'Competences',
+    'competences': 'Competences',
+    'hard skills': 'Competences',
+    'soft skills': 'Soft_Skills',
+    'seniority': 'Seniority',
+    'niveau': 'Seniority',
+    'core mission': 'Core_Mission',
+}
+
+# Canonical seniority levels, first match wins (the summary writes free text: "Niveau débutant").
+# Markers are regexes matched on whole words of the folded text: "Middleware" is not "mid",
+# word families are spelled out as stems ("alternan\w*")
+SENIORITY_LEVELS = (
+    ('stage', ('stages?', 'stagiaires?', r'alternan\w*', r'etudiant\w*', r'apprenti\w*')),
+    ('junior', ('juniors?', r'debutant\w*', 'entry')),
+    ('confirme', (r'confirme\w*', 'intermediaires?', r'experimente\w*', 'mid')),
+    ('senior', ('seniors?', 'experts?')),
+    ('lead', ('leads?', 'leaders?', 'managers?', 'directeurs?', 'directrices?', 'directors?', 'head', 'principal')),
+)
+# Bumped when the parsing of the indexed fields changes: documents indexed before are parsed again
+INDEX_VERSION = 3
+
+_SENIORITY_MARKERS = [(level, re.compile(r"\b(?:" + "|".join(markers) + r")\b")) for level, markers in SENIORITY_LEVELS]
+_LABEL = re.compile(r"^\s*[-*•]*\s*\**([^:*]{2,40}?)\**\s*:\s*(.*)$")
+_BULLET = re.compile(r"^\s*[-*•]+\s*")
+_SECTION = re.compile(r"^\s*###\s*(\d)\.")
+_WORDS = re.compile(r"[a-z0-9][a-z0-9+#.]*")
+
+
+def _fold(text):
+    text = unicodedata.normalize('NFKD', str(text).lower())
+    return "".join(c for c in text if not unicodedata.combining(c))
+
+
+def normalize_skill(skill):
+    """Lowercase, accent-free, single-spaced skill name without surrounding punctuation."""
+    skill = re.sub(r"\s+", " ", _fold(skill).replace("_", " "))
+    return skill.strip(" -*•.,;:[]'\"")
+
+
+def split_items(value):
+    """Splits a comma-separated list, keeping commas inside parentheses: 'API (FastAPI, Flask), Docker'."""
+    items, depth, current = [], 0, []
+    for char in str(value).strip().strip("[]"):
+        if char in "([":
+            depth += 1
+        elif char in ")]":
+            depth = max(depth - 1, 0)
+        if char in ",;" and depth == 0:
+            items.append("".join(current))
+            current = []
+        else:
+            current.append(char)
+    items.append("".join(current))
+    return [item.strip() for item in items if normalize_skill(item)]
+
+
+def skill_terms(skill):
+    """
+    Index terms of one skill: the full name plus its parts, so that 'PyTorch/Hugging Face'
+    is found by 'pytorch' and 'Développement d'API (FastAPI, Flask)' by 'fastapi'.
+    Single-letter skills ('R', 'C/C++', 'Langages (C, R)') are kept; inflection marks glued
+    to a word ('Langage(s)') are not terms.
+    """
+    full = normalize_skill(skill)
+    if not full:
+        return set()
+    terms = {full}
+    outer = normalize_skill(re.sub(r"\(.*?\)", " ", full))
+    if outer:
+        terms.add(outer)
+    for glued, inner in re.findall(r"(\w?)\((.*?)\)", full):
+        if glued and len(inner) <= 2:
+            continue
+        terms.update(normalize_skill(part) for part in re.split(r"[,;]", inner))
+    for part in re.split(r"\s*/\s*|\s+&\s+", outer):
+        terms.add(normalize_skill(part))
+    return {term for term in terms if term}
+
+
+def seniority_level(text):
+    """Canonical seniority ('stage', 'junior', 'confirme', 'senior', 'lead') or '' if unknown."""
+    folded = _fold(text)
+    for level, pattern in _SENIORITY_MARKERS:
+        if pattern.search(folded):
+            return level
+    return ''
+
+
+def parse_resume(resume_text):
+    """
+    Structured fields of a step 2 summary (multi-line or pipe-joined 'Resume_IA'):
+    {'Profil_Type', 'Competences' (list), 'Soft_Skills' (list), 'Seniority', 'Core_Mission'}.
+    Items listed on continuation lines ('  - Python') are attached to the previous label.
+    """
+    fields = {column: [] for column in STRUCTURED_COLUMNS}
+    current = None
+    for segment in re.split(r"\s*\|\s*|\n", str(resume_text or '')):
+        if not segment.strip():
+            continue
+        match = _LABEL.match(segment)
+        label = normalize_skill(match.group(1)) if match else None
+        if label in _FIELD_LABELS:
+            current = _FIELD_LABELS[label]
+            value = match.group(2)
+        elif current is not None:
+            value = _BULLET.sub("", segment)
+        else:
+            continue
+        if current in LIST_COLUMNS:
+            fields[current].extend(split_items(value))
+        elif value.strip():
+            fields[current].append(value.strip())
+
+    parsed = {column: (fields[column] if column in LIST_COLUMNS else " ".join(fields[column]))
+              for column in STRUCTURED_COLUMNS}
+    parsed['Seniority'] = seniority_level(parsed['Seniority']) or parsed['Seniority']
+    return parsed
+
+
+def structured_columns(df_jobs):
+    """Adds the STRUCTURED_COLUMNS parsed from Resume_IA to `df_jobs` (in place, lists joined with LIST_SEP)."""
+    parsed = [parse_resume(text) for text in df_jobs['Resume_IA'].fillna('')]
+    for column in STRUCTURED_COLUMNS:
+        values = [fields[column] for fields in parsed]
+        df_jobs[column] = [LIST_SEP.join(v) for v in values] if column in LIST_COLUMNS else values
+    return df_jobs
+
+
+def _row_digest(row):
+    parts = [str(INDEX_VERSION)] + [str(row.get(column, '')) for column in ('Poste', 'Entreprise', 'Resume_IA', 'Competences', 'Seniority')]
+    return hashlib.sha1("\x1f".join(parts).encode('utf-8')).hexdigest()[:16]
+
+
+def row_fields(row):
+    """(skills, seniority) of an offer: structured columns when present, else parsed from Resume_IA."""
+    if row.get('Competences') or row.get('Seniority'):
+        skills = [s.strip() for s in str(row.get('Competences') or '').split(LIST_SEP.strip()) if s.strip()]
+        seniority = seniority_level(row.get('Seniority') or '')
+    else:
+        parsed = parse_resume(row.get('Resume_IA', ''))
+        skills, seniority = parsed['Competences'], seniority_level(parsed['Seniority'])
+    return skills, seniority
+
+
+def parse_cv_synthesis(cv_text):
+    """
+    Sections of the step 4 synthesis: {'Profil_Type', 'Competences', 'Soft_Skills', 'Seniority'}.
+    Skills are the bullet lines of sections 2 and 3.
+    """
+    sections, current = {}, None
+    for line in str(cv_text).splitlines():
+        match = _SECTION.match(line)
+        if match:
+            current = int(match.group(1))
+            continue
+        if current is not None and line.strip():
+            sections.setdefault(current, []).append(line.strip())
+
+    def bullets(number):
+        return [_BULLET.sub("", line) for line in sections.get(number, []) if normalize_skill(_BULLET.sub("", line))]
+
+    def labelled(number, label):
+        for line in sections.get(number, []):
+            match = _LABEL.match(line)
+            if match and normalize_skill(match.group(1)).startswith(label):
+                return match.group(2).strip(" *")
+        return ''
+
+    return {
+        'Profil_Type': labelled(1, 'intitule'),
+        'Competences': bullets(2),
+        'Soft_Skills': bullets(3),
+        'Seniority': seniority_level(labelled(4, 'niveau')),
+    }
+
+
+def _text_digest(text):
+    return hashlib.sha1(str(text).encode('utf-8')).hexdigest()[:16]
+
+
+def cv_profile_json(cv_text):
+    """Content of data/cv_profile.json for a step 4 synthesis: its sections plus the digest of the text."""
+    return json.dumps({**parse_cv_synthesis(cv_text), 'digest': _text_digest(cv_text)}, ensure_ascii=False, indent=2)
+
+
+def cv_profile(cv_text, path=CV_PROFILE_PATH):
+    """
+    Sections of the CV synthesis: read from data/cv_profile.json when it was written for this
+    exact text (step 4), else parsed from the text (another CV, or a file edited by hand).
+    """
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            profile = json.load(f)
+        if profile.get('digest') == _text_digest(cv_text):
+            return profile
+    except (OSError, ValueError, AttributeError):
+        pass
+    return parse_cv_synthesis(cv_text)
+
+
+class SkillIndex:
+    """
+    Inverted skill -> offers index over the structured fields of step 2, stored on disk
+    (data/index/skills.json) as one entry per offer; the postings (skill term -> job keys,
+    seniority -> job keys) are rebuilt in memory on load.
+    """
+
+    def __init__(self, path=INDEX_PATH):
+        self.path = path
+        self.docs = {}
+        self.postings = {}
+        self.seniority = {}
+
+    @classmethod
+    def load(cls, path=INDEX_PATH):
+        index = cls(path)
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                index.docs = json.load(f)['docs']
+        for key, doc in index.docs.items():
+            index._post(key, doc)
+        return index
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"docs": self.docs}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def __len__(self):
+        return len(self.docs)
+
+    def __contains__(self, key):
+        return key in self.docs
+
+    def _post(self, key, doc):
+        for term in doc['terms']:
+            self.postings.setdefault(term, set()).add(key)
+        if doc['seniority']:
+            self.seniority.setdefault(doc['seniority'], set()).add(key)
+
+    def _unpost(self, key, doc):
+        for term in doc['terms']:
+            self.postings.get(term, set()).discard(key)
+        if doc['seniority']:
+            self.seniority.get(doc['seniority'], set()).discard(key)
+
+    def add_documents(self, df_jobs):
+        """Indexes (or re-indexes, when rewritten again) the offers of `df_jobs`. Returns the number changed."""
+        changed = 0
+        for row in df_jobs.fillna('').to_dict(orient='records'):
+            key = job_key(row)
+            digest = _row_digest(row)
+            old = self.docs.get(key)
+            # Unchanged offers are not parsed again
+            if old is not None and old.get('digest') == digest:
+                continue
+            skills, seniority = row_fields(row)
+            terms = sorted(set().union(*(skill_terms(s) for s in skills))) if skills else []
+            doc = {"Poste": str(row.get('Poste', '')), "Entreprise": str(row.get('Entreprise', '')),
+                   "skills": skills, "terms": terms, "seniority": seniority, "digest": digest}
+            if old is not None:
+                self._unpost(key, old)
+            self.docs[key] = doc
+            self._post(key, doc)
+            changed += 1
+        return changed
+
+    def query(self, skills=(), seniority=None, any_skill=False):
+        """
+        Job keys of the offers requiring every skill of `skills` (or at least one with
+        `any_skill`), optionally restricted to a seniority level. Skills are matched on
+        their normalized terms ('python', 'spark', 'machine learning').
+        """
+        sets = [self.postings.get(normalize_skill(skill), set()) for skill in skills if normalize_skill(skill)]
+        if sets:
+            keys = set().union(*sets) if any_skill else set.intersection(*sorted(sets, key=len))
+        else:
+            keys = set(self.docs)
+        if seniority:
+            keys = keys & self.seniority.get(seniority_level(seniority) or normalize_skill(seniority), set())
+        return keys
+
+    def cv_terms(self, cv_text):
+        """
+        Indexed skill terms found in the hard skills of the CV synthesis (word n-grams up to 4).
+        Single-letter terms ('r', 'c') only count when listed as a skill item, not as a word
+        of a sentence ("c'est").
+        """
+        profile = cv_profile(cv_text)
+        lines = profile.get('Competences') or [cv_text]
+        terms = set()
+        for line in lines:
+            terms.update(t for skill in split_items(line) for t in skill_terms(skill))
+            words = _WORDS.findall(_fold(line))
+            terms.update(word for word in words if len(word) > 1)
+            for n in range(2, 5):
+                terms.update(" ".join(words[i:i + n]) for i in range(len(words) - n + 1))
+        return {term for term in terms if term in self.postings}
+
+    def overlap(self, terms, keys=None):
+        """Number of `terms` shared with each offer: {job key: count} (offers without overlap are left out)."""
+        counts = {}
+        for term in terms:
+            for key in self.postings.get(term, ()):
+                if keys is None or key in keys:
+                    counts[key] = counts.get(key, 0) + 1
+        return counts
+
+
+def update_index(df_jobs, path=INDEX_PATH, progress_callback=None):
+    """Adds / refreshes the offers of `df_jobs` in the on-disk index (called after step 2)."""
+    index = SkillIndex.load(path)
+    changed = index.add_documents(df_jobs)
+    if changed:
+        index.save()
+    if progress_callback:
+        progress_callback(f"Index des compétences : {changed} offre(s) indexée(s), {len(index)} au total.")
+    return index
+
+
+def load_index_for(df_jobs, path=INDEX_PATH, progress_callback=None):
+    """Loads the index and indexes any offer of `df_jobs` that is missing or outdated."""
+    index = SkillIndex.load(path)
+    changed = index.add_documents(df_jobs)
+    if changed:
+        if progress_callback:
+            progress_callback(f"Index des compétences : {changed} offre(s) manquante(s) indexée(s).")
+        index.save()
+    return index
+
+
+def prefilter(df_jobs, cv_text=None, skills=None, seniority=None, min_overlap=None, progress_callback=None):
+    """
+    Cheap filter applied before scoring. Configured by the arguments or by the environment:
+    JOBAPP_SKILL_FILTER (required skills, comma-separated), JOBAPP_SENIORITY_FILTER (level) and
+    JOBAPP_SKILL_MIN_OVERLAP (minimum number of skills shared with the CV synthesis).
+    Returns `df_jobs` unchanged when no filter is set, or when it would remove every offer.
+    """
+    if skills is None:
+        skills = split_items(os.environ.get("JOBAPP_SKILL_FILTER", ""))
+    if seniority is None:
+        seniority = os.environ.get("JOBAPP_SENIORITY_FILTER", "")
+    if min_overlap is None:
+        min_overlap = int(os.environ.get("JOBAPP_SKILL_MIN_OVERLAP", "0"))
+    if not (skills or seniority or (min_overlap and cv_text)):
+        return df_jobs
+
+    t0 = time.perf_counter()
+    index = load_index_for(df_jobs, progress_callback=progress_callback)
+    keys = index.query(skills, seniority)
+    if min_overlap and cv_text:
+        counts = index.overlap(index.cv_terms(cv_text), keys)
+        keys = {key for key, count in counts.items() if count >= min_overlap}
+
+    mask = [key in keys for key in (job_key(row) for row in df_jobs.fillna('').to_dict(orient='records'))]
+    filtered = df_jobs[mask]
+    if filtered.empty:
+        if progress_callback:
+            progress_callback("⚠️ Filtre compétences : aucune offre ne correspond, toutes les offres sont conservées.")
+        return df_jobs
+    if progress_callback:
+        progress_callback(f"Filtre compétences : {len(filtered)}/{len(df_jobs)} offres retenues "
+                          f"({(time.perf_counter() - t0) * 1000:.1f} ms).")
+    return filtered.copy()
+
+
+if __name__ == '__main__':
+    import argparse
+    import pandas as pd
+
+    parser = argparse.ArgumentParser(description="Index inversé des compétences (construction et recherche).")
+    parser.add_argument("--jobs", default=os.path.join(DATA_DIR, "jobs_rewritten.csv"), help="CSV des offres à indexer")
+    parser.add_argument("--skills", default="", help="Compétences requises, séparées par des virgules (ex. python,spark)")
+    parser.add_argument("--any", action="store_true", help="Au moins une des compétences au lieu de toutes")
+    parser.add_argument("--seniority", default=None, help="stage, junior, confirme, senior ou lead")
+    parser.add_argument("--cv", action="store_true", help="Classer par compétences communes avec data/cv_synthesized.txt")
+    args = parser.parse_args()
+
+    index = update_index(pd.read_csv(args.jobs), progress_callback=print) if os.path.exists(args.jobs) else SkillIndex.load()
+    t0 = time.perf_counter()
+    keys = index.query(split_items(args.skills), args.seniority, any_skill=args.any)
+    counts = {}
+    if args.cv:
+        with open(os.path.join(DATA_DIR, "cv_synthesized.txt"), 'r', encoding='utf-8') as f:
+            counts = index.overlap(index.cv_terms(f.read()), keys)
+    elapsed_ms = (time.perf_counter() - t0) * 1000
+
+    for key in sorted(keys, key=lambda k: -counts.get(k, 0)):
+        doc = index.docs[key]
+        shared = f"{counts.get(key, 0):3d}  " if args.cv else ""
+        print(f"{shared}{doc['seniority'] or '-':<9} {doc['Poste']} — {doc['Entreprise']}")
+    print(f"{len(keys)} offre(s) sur {len(index)} en {elapsed_ms:.2f} ms")
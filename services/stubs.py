@@ -0,0 +1,43 @@
+import os
+import time
+
+# Stand-ins for the pipeline entry points (JOBAPP_STUB_SERVICES=1): same call signature,
+# no model, no browser, no file written. They only sleep and log, so that the HTTP layer
+# (threads, logger, polling, previews) can be exercised and load-tested on any machine.
+DEFAULT_SECONDS = 2.0
+LOG_LINES = 10
+
+
+def stub_seconds():
+    return float(os.environ.get("JOBAPP_STUB_SECONDS", DEFAULT_SECONDS))
+
+
+def _run(name, progress_callback):
+    seconds = stub_seconds()
+    for i in range(1, LOG_LINES + 1):
+        time.sleep(seconds / LOG_LINES)
+        if progress_callback:
+            progress_callback(f"[stub] {name} : {i}/{LOG_LINES}")
+
+
+def make_stub(name):
+    """Returns a stub for the service entry point `name` (see services.registry.SERVICES)."""
+    if name == "explain_match":
+        def explain_match(rank, source=None, generate=True, progress_callback=None, **kwargs):
+            if not generate:
+                return None
+            time.sleep(stub_seconds() / LOG_LINES)
+            return {
+                "rank": int(rank),
+                "Poste": "",
+                "Entreprise": "",
+                "match_score": None,
+                "Explanation": f"[stub] explication du match {rank}",
+                "cached": False,
+            }
+        return explain_match
+
+    def stub(*args, progress_callback=None, **kwargs):
+        _run(name, progress_callback)
+    stub.__name__ = name
+    return stub
@@ -0,0 +1,286 @@
+import numpy as np
+import os
+import re
+import json
+import time
+import hashlib
+
+from utils.artifacts import write_csv
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data')
+STORE_DIR = os.path.join(DATA_DIR, 'index', 'vectors')
+
+# none : float32 vectors in RAM, exact scan (default)
+# int8 : int8 copy with one float32 scale per vector (~4x smaller)
+# The float32 vectors stay on disk (memmap) and are only read to rescore the best candidates.
+# There is no float16 mode: numpy converts half floats element by element, which made its scan
+# about 8x slower than float32 for only half the memory.
+VECTOR_MODES = ("none", "int8")
+
+# Rows scanned per block: the float32 temporary created from the compressed copy stays in cache
+SCAN_BLOCK = 2048
+
+# Below this fraction of the store, the rows of a key subset are gathered before the scan;
+# above it, every row is scanned and the scores are indexed (cheaper than copying the rows)
+GATHER_FRACTION = 0.125
+
+
+def get_vector_mode(mode=None):
+    """
+    Resolves the vector storage mode: explicit argument first, then JOBAPP_VECTOR_STORE.
+    """
+    mode = (mode or os.environ.get("JOBAPP_VECTOR_STORE") or "none").strip().lower()
+    if mode not in VECTOR_MODES:
+        raise ValueError(f"Mode de stockage vectoriel inconnu '{mode}' (attendu : {', '.join(VECTOR_MODES)})")
+    return mode
+
+
+def text_key(text):
+    """Vectors are cached by content: a rewritten offer gets a new vector."""
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()[:20]
+
+
+def normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def quantize_int8(vectors):
+    """Symmetric per-vector int8 quantization. Returns (int8 codes, float32 scales)."""
+    scales = np.abs(vectors).max(axis=1) / 127.0
+    scales = np.maximum(scales, 1e-12).astype(np.float32)
+    codes = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+    return codes, scales
+
+
+def scan(data, scales, query, block=SCAN_BLOCK):
+    """Dot products of `query` with every compressed vector, block by block."""
+    scores = np.empty(len(data), dtype=np.float32)
+    for start in range(0, len(data), block):
+        chunk = data[start:start + block].astype(np.float32, copy=False)
+        scores[start:start + block] = chunk @ query
+    if scales is not None:
+        scores *= scales
+    return scores
+
+
+def top_k(scores, k):
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    best = np.argpartition(-scores, k - 1)[:k]
+    return best[np.argsort(-scores[best], kind='stable')]
+
+
+class VectorStore:
+    """
+    Append-only store of normalized job embeddings for one encoder:
+    keys.json (text keys, in row order), vectors.f32 (disk only, memmap), vectors.i8 and
+    scales.f32 (compressed copy loaded in RAM).
+    """
+
+    def __init__(self, directory, dim=None):
+        self.directory = directory
+        self.dim = dim
+        self.keys = []
+        self._positions = {}
+        self._compressed = {}
+
+    @classmethod
+    def open(cls, model_name, quantization="none", backend="torch", root=STORE_DIR):
+        # Vectors depend on the encoder and on its precision / runtime
+        name = re.sub(r"[^A-Za-z0-9_.-]+", "_", f"{model_name}-{quantization}-{backend}")
+        store = cls(os.path.join(root, name))
+        meta_path = os.path.join(store.directory, "keys.json")
+        if os.path.exists(meta_path):
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            store.dim = meta['dim']
+            store.keys = meta['keys']
+        store._positions = {key: i for i, key in enumerate(store.keys)}
+        return store
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _append(self, name, array):
+        """Appends rows to a raw binary file, dropping bytes left by an interrupted write."""
+        path = self._path(name)
+        row_bytes = array.dtype.itemsize * (array.shape[1] if array.ndim == 2 else 1)
+        expected = len(self.keys) * row_bytes
+        with open(path, 'ab') as f:
+            if f.tell() != expected:
+                f.truncate(expected)
+                f.seek(expected)
+            f.write(np.ascontiguousarray(array).tobytes())
+
+    def add(self, keys, vectors):
+        """Appends new (key, vector) rows; vectors are normalized before storage."""
+        vectors = normalize(vectors)
+        if self.dim is None:
+            self.dim = vectors.shape[1]
+        os.makedirs(self.directory, exist_ok=True)
+
+        self._append("vectors.f32", vectors)
+        codes, scales = quantize_int8(vectors)
+        self._append("vectors.i8", codes)
+        self._append("scales.f32", scales)
+
+        for key in keys:
+            self._positions[key] = len(self.keys)
+            self.keys.append(key)
+        # keys.json is written last: it defines how many rows are valid
+        tmp_path = self._path("keys.json.tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"dim": self.dim, "keys": self.keys}, f)
+        os.replace(tmp_path, self._path("keys.json"))
+        self._compressed = {}
+
+    def ensure(self, texts, model, batch_size=32, progress_callback=None):
+        """Encodes and stores the texts that are not in the store yet. Returns their keys."""
+        keys = [text_key(text) for text in texts]
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in self._positions and key not in missing:
+                missing[key] = text
+        if progress_callback:
+            progress_callback(f"Vecteurs en cache : {len(keys) - len(missing)}/{len(keys)} offres, {len(missing)} à encoder.")
+        if missing:
+            vectors = model.encode(list(missing.values()), batch_size=batch_size)
+            self.add(list(missing.keys()), vectors)
+        return keys
+
+    def positions(self, keys):
+        return np.asarray([self._positions[key] for key in keys], dtype=np.int64)
+
+    def full_precision(self):
+        """float32 vectors, memory-mapped (read from disk on access)."""
+        return np.memmap(self._path("vectors.f32"), dtype=np.float32, mode='r', shape=(len(self.keys), self.dim))
+
+    def compressed(self, mode):
+        """In-RAM copy used for the first-pass scan: (data, scales or None)."""
+        if mode not in self._compressed:
+            n = len(self.keys) * self.dim
+            if mode == "none":
+                data = np.fromfile(self._path("vectors.f32"), dtype=np.float32, count=n).reshape(-1, self.dim)
+                scales = None
+            else:
+                data = np.fromfile(self._path("vectors.i8"), dtype=np.int8, count=n).reshape(-1, self.dim)
+                scales = np.fromfile(self._path("scales.f32"), dtype=np.float32, count=len(self.keys))
+            self._compressed[mode] = (data, scales)
+        return self._compressed[mode]
+
+    def scores(self, query, keys=None, mode="int8", rescore_k=200):
+        """
+        Cosine scores of `query` against the stored vectors of `keys` (all rows by default):
+        first pass on the compressed copy, then exact float32 rescoring of the `rescore_k`
+        best candidates. The other rows keep their approximate score.
+        """
+        query = normalize(np.asarray(query).reshape(1, -1))[0]
+        positions = self.positions(keys) if keys is not None else np.arange(len(self.keys))
+        data, scales = self.compressed(mode)
+        if keys is None:
+            scores = scan(data, scales, query)
+        elif len(positions) < GATHER_FRACTION * len(data):
+            scores = scan(data[positions], scales[positions] if scales is not None else None, query)
+        else:
+            scores = scan(data, scales, query)[positions]
+        if mode != "none" and rescore_k:
+            best = top_k(scores, rescore_k)
+            exact = np.asarray(self.full_precision()[np.sort(positions[best])], dtype=np.float32)
+            order = np.argsort(positions[best])
+            scores[best[order]] = exact @ query
+        return scores
+
+
+def benchmark(vectors, queries, modes=VECTOR_MODES, top_n=10, rescore_k=200, directory=None, progress_callback=None):
+    """
+    Compares each mode to the float32 exact scan: memory of the scanned copy, scan latency,
+    recall@top_n before and after rescoring, and maximum score error.
+    Returns a DataFrame (also written to data/vector_store_benchmark.csv).
+    """
+    import pandas as pd
+    import tempfile
+
+    vectors = normalize(vectors)
+    queries = normalize(queries)
+    with tempfile.TemporaryDirectory() as tmp:
+        store = VectorStore(directory or os.path.join(tmp, "bench"))
+        store.add([str(i) for i in range(len(vectors))], vectors)
+
+        reference = [scan(vectors, None, q) for q in queries]
+        reference_top = [set(top_k(s, top_n)) for s in reference]
+
+        rows = []
+        for mode in modes:
+            data, scales = store.compressed(mode)
+            memory = data.nbytes + (scales.nbytes if scales is not None else 0)
+
+            t0 = time.perf_counter()
+            first_pass = [scan(data, scales, q) for q in queries]
+            scan_ms = (time.perf_counter() - t0) * 1000 / len(queries)
+
+            t0 = time.perf_counter()
+            rescored = [store.scores(q, mode=mode, rescore_k=rescore_k) for q in queries]
+            total_ms = (time.perf_counter() - t0) * 1000 / len(queries)
+
+            recall_first = np.mean([len(set(top_k(s, top_n)) & ref) / len(ref) for s, ref in zip(first_pass, reference_top)])
+            recall_final = np.mean([len(set(top_k(s, top_n)) & ref) / len(ref) for s, ref in zip(rescored, reference_top)])
+            max_error = max(float(np.max(np.abs(s - ref))) for s, ref in zip(first_pass, reference))
+
+            rows.append({
+                "Mode": mode,
+                "Vecteurs": len(vectors),
+                "Memoire_MB": memory / (1024 * 1024),
+                "Gain_memoire": (vectors.nbytes / memory) if memory else None,
+                "Scan_ms": scan_ms,
+                "Scan_et_rescoring_ms": total_ms,
+                f"Rappel@{top_n}_scan": recall_first,
+                f"Rappel@{top_n}_final": recall_final,
+                "Erreur_score_max": max_error,
+            })
+            if progress_callback:
+                progress_callback(
+                    f"{mode:<8} | {memory / (1024 * 1024):8.1f} MB | scan {scan_ms:7.1f} ms | "
+                    f"+rescoring {total_ms:7.1f} ms | rappel@{top_n} {recall_first:.3f} -> {recall_final:.3f} | "
+                    f"erreur max {max_error:.4f}"
+                )
+        del store
+
+    df = pd.DataFrame(rows)
+    output_path = os.path.join(DATA_DIR, "vector_store_benchmark.csv")
+    write_csv(df, output_path, inputs=(len(vectors), len(queries), modes, top_n, rescore_k), index=False)
+    if progress_callback:
+        progress_callback(f"✅ Benchmark : {output_path}")
+    return df
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark du stockage compressé des vecteurs d'offres.")
+    parser.add_argument("--store", default=None, help="Dossier d'un store existant (défaut : vecteurs synthétiques)")
+    parser.add_argument("--n", type=int, default=100000, help="Nombre de vecteurs synthétiques")
+    parser.add_argument("--dim", type=int, default=1024)
+    parser.add_argument("--queries", type=int, default=20)
+    parser.add_argument("--top-n", type=int, default=10)
+    parser.add_argument("--rescore-k", type=int, default=200)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    if args.store:
+        with open(os.path.join(args.store, "keys.json"), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        vectors = np.fromfile(os.path.join(args.store, "vectors.f32"), dtype=np.float32,
+                              count=len(meta['keys']) * meta['dim']).reshape(-1, meta['dim'])
+    else:
+        # Clustered vectors: closer to real embeddings (many near ties) than isotropic noise
+        centers = rng.standard_normal((256, args.dim)).astype(np.float32)
+        vectors = centers[rng.integers(0, 256, args.n)] + 0.5 * rng.standard_normal((args.n, args.dim)).astype(np.float32)
+    queries = vectors[rng.choice(len(vectors), args.queries, replace=False)] + 0.3 * rng.standard_normal((args.queries, vectors.shape[1])).astype(np.float32)
+
+    benchmark(vectors, queries, top_n=args.top_n, rescore_k=args.rescore_k, progress_callback=print)
@@ -25,6 +25,35 @@ document.addEventListener('DOMContentLoaded', () => {
         });
     }
 
+    // Bulk ads file upload handler (Step 1, raw text tab)
+    const adsFileInput = document.getElementById('adsFile');
+    const adsFileNameDisplay = document.getElementById('adsFileName');
+
+    if (adsFileInput) {
+        adsFileInput.addEventListener('change', (e) => {
+            if (e.target.files.length > 0) {
+                adsFileNameDisplay.textContent = e.target.files[0].name;
+                document.getElementById('bulk_mode_input').checked = true;
+                const formData = new FormData();
+                formData.append('file', e.target.files[0]);
+
+                fetch('/api/step1/upload', {
+                    method: 'POST',
+                    body: formData
+                })
+                    .then(r => r.json())
+                    .then(data => {
+                        if (data.error) {
+                            appendLog('❌ ' + data.error);
+                            return;
+                        }
+                        appendLog('Fichier d\'annonces chargé : ' + data.filename);
+                    })
+                    .catch(err => appendLog('Erreur upload: ' + err));
+            }
+        });
+    }
+
     // Validated poller
     // Validated poller
     setInterval(pollLogs, 1000);
@@ -66,6 +95,7 @@ async function runStep1() {
     let mode = 'scrape';
     let keyword = '';
     let text = '';
+    let filename = null;
 
     if (currentTab === 'keyword') {
         keyword = document.getElementById('keyword_input').value;
@@ -76,28 +106,40 @@ async function runStep1() {
     } else {
         text = document.getElementById('raw_text_input').value;
         mode = 'text';
+        if (document.getElementById('bulk_mode_input').checked) {
+            mode = 'bulk';
+            const adsFileName = document.getElementById('adsFileName').textContent;
+            if (adsFileName !== "Aucun fichier") filename = adsFileName;
+        }
     }
 
     const num = document.getElementById('num_jobs').value;
 
     resetStatus('status1');
     try {
-        await fetch('/api/step1', {
+        await fetch(stepUrl(1), {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
             body: JSON.stringify({
                 mode: mode,
                 keyword: keyword,
                 num_jobs: num,
-                text: text
+                text: text,
+                filename: filename
             })
         });
     } catch (e) { console.error(e); }
 }
 
+function stepUrl(step) {
+    // Opt-in profiling: the profile files are listed in the logs at the end of the task
+    const profile = document.getElementById('profile_input').checked;
+    return `/api/step${step}` + (profile ? '?profile=1' : '');
+}
+
 async function runStep2() {
     resetStatus('status2');
-    await fetch('/api/step2', { method: 'POST' });
+    await fetch(stepUrl(2), { method: 'POST' });
 }
 
 async function runStep3() {
@@ -107,7 +149,7 @@ async function runStep3() {
         return;
     }
     resetStatus('status3');
-    await fetch('/api/step3', {
+    await fetch(stepUrl(3), {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify({ filename: fileName })
@@ -116,22 +158,54 @@ async function runStep3() {
 
 async function runStep4() {
     resetStatus('status4');
-    await fetch('/api/step4', { method: 'POST' });
+    await fetch(stepUrl(4), { method: 'POST' });
 }
 
 async function runStep5() {
     resetStatus('status5');
-    await fetch('/api/step5', { method: 'POST' });
+    await fetch(stepUrl(5), { method: 'POST' });
 }
 
 async function runStep6() {
     resetStatus('status6');
-    await fetch('/api/step6', { method: 'POST' });
+    await fetch(stepUrl(6), { method: 'POST' });
 }
 
 async function runStep7() {
     resetStatus('status7');
-    await fetch('/api/step7', { method: 'POST' });
+    const heuristic = document.getElementById('heuristic_explain_input').checked;
+    await fetch(stepUrl(7), {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ mode: heuristic ? 'heuristic' : 'llm' })
+    });
+}
+
+async function explainMatch(button, source, rank) {
+    // Generated on the server on first request, then served from the explanations cache
+    const slot = button.parentElement;
+    button.disabled = true;
+    button.textContent = "Analyse en cours...";
+    try {
+        // Cache misses are generated in the background: poll until the explanation is ready
+        let res = await fetch(`/api/explain/${rank}?source=${source}`, { method: 'POST' });
+        while (res.status === 202) {
+            await new Promise(resolve => setTimeout(resolve, 2000));
+            res = await fetch(`/api/explain/${rank}?source=${source}&t=${Date.now()}`);
+        }
+        const data = await res.json();
+        if (data.error) {
+            button.disabled = false;
+            button.textContent = "Expliquer ce match";
+            alert("Erreur explication: " + data.error);
+            return;
+        }
+        slot.innerHTML = `<div style="background:#1e1e2f; padding:8px; margin-top:5px; border-left:3px solid #6c5ce7;"><strong>Explication:</strong> ${data.Explanation.replace(/\n/g, '<br>')}</div>`;
+    } catch (e) {
+        console.error(e);
+        button.disabled = false;
+        button.textContent = "Expliquer ce match";
+    }
 }
 
 function resetStatus(id) {
@@ -202,7 +276,7 @@ async function fetchPreview(taskName) {
                    </div>
                     <div class="match-details">
                         <p><strong>IA Résumé:</strong> ${row.Resume_IA || 'N/A'}</p>
-                        ${row.Explanation ? `<div style="background:#1e1e2f; padding:8px; margin-top:5px; border-left:3px solid #6c5ce7;"><strong>Explication:</strong> ${row.Explanation.replace(/\n/g, '<br>')}</div>` : ''}
+                        ${row.Explanation_Mode === 'heuristic' ? `<div class="explanation-slot"><div style="background:#1e1e2f; padding:8px; margin-top:5px; border-left:3px solid #636e72;"><strong>${row.Verdict}:</strong> ${row.Explanation}</div><button class="btn btn-primary" onclick="explainMatch(this, '${taskName}', ${row.rank})">Approfondir avec Qwen</button></div>` : row.Explanation ? `<div style="background:#1e1e2f; padding:8px; margin-top:5px; border-left:3px solid #6c5ce7;"><strong>Explication:</strong> ${row.Explanation.replace(/\n/g, '<br>')}</div>` : `<div class="explanation-slot"><button class="btn btn-primary" onclick="explainMatch(this, '${taskName}', ${row.rank})">Expliquer ce match</button></div>`}
                         <a href="${row.Lien}" target="_blank" class="match-link">Voir l'offre →</a>
                     </div>
                </div>`;
@@ -241,6 +315,7 @@ async function fetchPreview(taskName) {
 // Logic to track state changes
 let currentKnownState = "IDLE";
 let currentActiveTask = null;
+let lastLogCount = 0;
 
 async function pollLogs() {
     try {
@@ -281,7 +356,11 @@ async function pollLogs() {
             if (statusEl && statusEl.textContent !== "Erreur") {
                 markError(serverTask, "Erreur détéctée");
             }
+        } else if (serverState === "RUNNING" && (serverTask === 'step2' || serverTask === 'step7') && newLogs.length !== lastLogCount) {
+            // Partial results are served from the step checkpoint while the run is in progress
+            fetchPreview(serverTask);
         }
+        lastLogCount = newLogs.length;
 
         currentKnownState = serverState;
         currentActiveTask = serverTask;
@@ -0,0 +1,140 @@
+import os
+import json
+import time
+import uuid
+import threading
+
+from utils.checkpoint import fingerprint
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data')
+MANIFEST_PATH = os.path.join(DATA_DIR, 'artifacts.json')
+
+# Pipeline artifacts (jobs_raw.csv, jobs_rewritten.csv, matches.csv, cv_*.txt...) are
+# written to a temporary file in the same directory and swapped in with os.replace: a reader
+# opens either the previous complete file or the new one, never a partial write. Every write
+# bumps the version of the artifact in data/artifacts.json (run id, inputs hash, row count).
+_manifest_lock = threading.Lock()
+_read_lock = threading.Lock()
+_read_cache = {}
+
+
+def artifact_name(path):
+    """Manifest key of `path`: relative to data/ when inside it, else the absolute path."""
+    path = os.path.abspath(path)
+    data_dir = os.path.abspath(DATA_DIR)
+    if os.path.commonpath([path, data_dir]) == data_dir:
+        return os.path.relpath(path, data_dir).replace(os.sep, "/")
+    return path
+
+
+def _atomic_write(path, write):
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = os.path.join(directory, f".{os.path.basename(path)}.{uuid.uuid4().hex[:8]}.tmp")
+    try:
+        write(tmp_path)
+        with open(tmp_path, 'rb') as f:
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def load_manifest():
+    if not os.path.exists(MANIFEST_PATH):
+        return {}
+    try:
+        with open(MANIFEST_PATH, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except ValueError:
+        return {}
+
+
+def record_version(path, rows=None, inputs=(), run_id=None):
+    """
+    Bumps the version of the artifact `path` in the manifest. Called by the writers below;
+    worker processes write with record=False and leave this to their parent, since the
+    manifest lock only covers the threads of one process.
+    """
+    def write(tmp_path):
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2, ensure_ascii=False)
+
+    with _manifest_lock:
+        manifest = load_manifest()
+        name = artifact_name(path)
+        entry = {
+            "version": manifest.get(name, {}).get("version", 0) + 1,
+            "run_id": run_id or uuid.uuid4().hex[:12],
+            "inputs": fingerprint(*inputs)[:16] if inputs else None,
+            "rows": rows,
+            "bytes": os.path.getsize(path),
+            "written": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        }
+        manifest[name] = entry
+        _atomic_write(MANIFEST_PATH, write)
+    return entry
+
+
+def write_csv(df, path, inputs=(), run_id=None, record=True, **to_csv_kwargs):
+    """
+    Atomically replaces `path` with `df` (DataFrame.to_csv arguments pass through) and bumps
+    its version. `inputs` (file paths or values) are hashed into the manifest entry.
+    Returns `path`.
+    """
+    _atomic_write(path, lambda tmp_path: df.to_csv(tmp_path, **to_csv_kwargs))
+    if record:
+        record_version(path, len(df), inputs, run_id)
+    return path
+
+
+def write_text(text, path, inputs=(), run_id=None, record=True):
+    """Atomically replaces `path` with `text` (UTF-8) and bumps its version. Returns `path`."""
+    def write(tmp_path):
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(text)
+
+    _atomic_write(path, write)
+    if record:
+        record_version(path, text.count("\n") + 1 if text else 0, inputs, run_id)
+    return path
+
+
+def artifact_version(path):
+    """Manifest entry of `path` ({"version", "run_id", "inputs", "rows", ...}) or None."""
+    return load_manifest().get(artifact_name(path))
+
+
+def _cached_read(path, key, read):
+    # A swapped-in file is a new inode: (inode, mtime, size) identifies the version on disk
+    # without parsing it, so unchanged artifacts are served from memory
+    st = os.stat(path)
+    stamp = (st.st_ino, st.st_mtime_ns, st.st_size)
+    cache_key = (os.path.abspath(path), key)
+    with _read_lock:
+        cached = _read_cache.get(cache_key)
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+    value = read()
+    with _read_lock:
+        _read_cache[cache_key] = (stamp, value)
+    return value
+
+
+def read_csv(path, **read_csv_kwargs):
+    """
+    DataFrame of `path`, parsed once per version of the file. The DataFrame is shared between
+    callers: copy it before modifying it.
+    """
+    import pandas as pd
+    return _cached_read(path, repr(sorted(read_csv_kwargs.items())), lambda: pd.read_csv(path, **read_csv_kwargs))
+
+
+def read_text(path):
+    """Content of `path`, read once per version of the file."""
+    def read():
+        with open(path, 'r', encoding='utf-8') as f:
+            return f.read()
+    return _cached_read(path, "text", read)
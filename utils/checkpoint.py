@@ -0,0 +1,118 @@
+import os
+import json
+import hashlib
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data')
+CHECKPOINT_DIR = os.path.join(DATA_DIR, 'checkpoints')
+
+
+def fingerprint(*parts):
+    """Identifies a run from its inputs (file paths are hashed by content)."""
+    digest = hashlib.sha1()
+    for part in parts:
+        if isinstance(part, str) and os.path.isfile(part):
+            with open(part, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 20), b''):
+                    digest.update(block)
+        else:
+            digest.update(repr(part).encode('utf-8'))
+        digest.update(b"\x1f")
+    return digest.hexdigest()
+
+
+def _read_lines(path):
+    records = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                # Last line cut by a crash: the row is simply redone
+                continue
+    return records
+
+
+def _truncate_partial_line(path):
+    # A line cut by a crash has no trailing newline: drop it before appending, otherwise the
+    # next row would be glued to the fragment and lost as well
+    with open(path, 'rb+') as f:
+        size = f.seek(0, os.SEEK_END)
+        end = size
+        # Backwards, block by block, to the last newline
+        while end > 0:
+            start = max(0, end - 4096)
+            f.seek(start)
+            newline = f.read(end - start).rfind(b"\n")
+            if newline != -1:
+                end = start + newline + 1
+                break
+            end = start
+        if end < size:
+            f.truncate(end)
+            f.flush()
+            os.fsync(f.fileno())
+
+
+class Checkpoint:
+    """
+    Durable row-by-row progress of a step (data/checkpoints/<name>.jsonl).
+    Each completed row is appended and fsynced; the first line holds the run id, so a
+    checkpoint left by a run on other inputs is discarded instead of resumed.
+    """
+
+    def __init__(self, name, run_id):
+        self.name = name
+        self.run_id = run_id
+        self.path = os.path.join(CHECKPOINT_DIR, f"{name}.jsonl")
+
+    def open(self):
+        """Returns the rows already completed by a previous run on the same inputs ({key: value})."""
+        os.makedirs(CHECKPOINT_DIR, exist_ok=True)
+        done = {}
+        if os.path.exists(self.path):
+            records = _read_lines(self.path)
+            if records and records[0].get("run_id") == self.run_id:
+                done = {r["key"]: r["value"] for r in records[1:] if "key" in r}
+        if done:
+            _truncate_partial_line(self.path)
+        if not done:
+            with open(self.path, 'w', encoding='utf-8') as f:
+                f.write(json.dumps({"run_id": self.run_id}) + "\n")
+        return done
+
+    def _append(self, record):
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def commit(self, key, value):
+        self._append({"key": key, "value": value})
+
+    def fail(self, reason):
+        """
+        The run stopped on an error: its rows are kept for the next run on the same inputs,
+        but no longer served as partial results (read_checkpoint) until it commits again.
+        """
+        if os.path.exists(self.path):
+            self._append({"failed": str(reason)})
+
+    def complete(self):
+        """The final artifact is written: the checkpoint is no longer needed."""
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def read_checkpoint(name):
+    """
+    Rows completed so far by a running step, for the previews. None if there is no
+    checkpoint, no row yet, or the run failed (the previews then fall back to the last CSV).
+    """
+    path = os.path.join(CHECKPOINT_DIR, f"{name}.jsonl")
+    if not os.path.exists(path):
+        return None
+    records = _read_lines(path)[1:]
+    if not records or "failed" in records[-1]:
+        return None
+    rows = [r["value"] for r in records if "key" in r]
+    return rows or None
@@ -0,0 +1,18 @@
+import hashlib
+
+# Columns identifying an offer across runs (scraped ads have a unique link, pasted ads usually don't).
+# The step 2 output (Resume_IA...) is not part of the key: the indexes hash the fields they index
+# to detect a rewritten offer
+JOB_KEY_COLUMNS = ('Poste', 'Entreprise', 'Lien', 'Missions')
+
+
+def job_key(row):
+    """Stable identifier of an offer, shared by the on-disk indexes."""
+    values = [row.get(col, '') for col in JOB_KEY_COLUMNS]
+    # NaN (missing CSV cell) and '' must give the same key
+    parts = ['' if value is None or value != value else str(value) for value in values]
+    return hashlib.sha1("\x1f".join(parts).encode('utf-8')).hexdigest()[:16]
+
+
+def job_keys(df_jobs):
+    return [job_key(row) for row in df_jobs.to_dict(orient='records')]
@@ -0,0 +1,220 @@
+import os
+import sys
+import json
+import time
+import random
+import socket
+import threading
+import subprocess
+import urllib.error
+import urllib.request
+
+import numpy as np
+
+from utils.artifacts import write_csv
+
+ROOT_DIR = os.path.dirname(os.path.dirname(__file__))
+DATA_DIR = os.path.join(ROOT_DIR, 'data')
+
+# Steps triggered by the driver client, in pipeline order (step1 and step3 need user input)
+DEFAULT_STEPS = ("step2", "step4", "step5", "step6", "step7")
+
+# Serves app.py without the debug reloader, one thread per request (as in production use)
+_SERVER_CODE = "import app; app.app.run(host='127.0.0.1', port={port}, threaded=True, use_reloader=False)"
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(port, stub_seconds=2.0, timeout=30):
+    """Starts app.py with stub services in a subprocess and waits until it answers."""
+    env = dict(os.environ, JOBAPP_STUB_SERVICES="1", JOBAPP_STUB_SECONDS=str(stub_seconds), JOBAPP_WARMUP="0")
+    process = subprocess.Popen(
+        [sys.executable, "-c", _SERVER_CODE.format(port=port)],
+        cwd=ROOT_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Le serveur s'est arrêté au démarrage (code {process.returncode})")
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/api/logs", timeout=1).read()
+            return process
+        except (urllib.error.URLError, OSError):
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f"Le serveur n'a pas répondu en {timeout}s")
+
+
+class Recorder:
+    """Thread-safe log of (group, latency in seconds, ok) for every request sent."""
+
+    def __init__(self):
+        self.records = []
+        self._lock = threading.Lock()
+
+    def add(self, group, seconds, ok):
+        with self._lock:
+            self.records.append((group, seconds, ok))
+
+
+def request(base_url, path, recorder, group, method="GET", payload=None, timeout=10):
+    """
+    Sends one request and records its latency. Returns the decoded JSON body (or None).
+    A JSON object carrying an "error" key counts as a failure even with a 200 status: the
+    preview routes report a missing or unreadable file that way.
+    """
+    data = json.dumps(payload).encode('utf-8') if payload is not None else None
+    req = urllib.request.Request(base_url + path, data=data, method=method,
+                                 headers={"Content-Type": "application/json"} if data else {})
+    t0 = time.perf_counter()
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as response:
+            body = response.read()
+        seconds = time.perf_counter() - t0
+    except (urllib.error.URLError, OSError, ValueError):
+        # HTTP errors (4xx / 5xx), refused connections and timeouts
+        recorder.add(group, time.perf_counter() - t0, False)
+        return None
+    try:
+        data = json.loads(body)
+    except ValueError:
+        data = None
+    recorder.add(group, seconds, not (isinstance(data, dict) and "error" in data))
+    return data
+
+
+def ui_client(base_url, recorder, stop, poll_interval=1.0):
+    """
+    Replays the polling of one browser tab (static/js/main.js): /api/logs every
+    `poll_interval`, previews when a task completes and while step2 / step7 are running.
+    """
+    # Tabs are not opened at the same instant
+    stop.wait(random.uniform(0, poll_interval))
+    last_state, last_task, last_count = None, None, 0
+    while not stop.is_set():
+        t0 = time.perf_counter()
+        data = request(base_url, f"/api/logs?t={int(time.time() * 1000)}", recorder, "logs")
+        if data:
+            state, task, count = data.get("task_state"), data.get("active_task"), len(data.get("logs", []))
+            if task and state == "COMPLETED" and (last_state, last_task) != (state, task):
+                request(base_url, f"/api/preview/{task}", recorder, "preview")
+            elif task in ("step2", "step7") and state == "RUNNING" and count != last_count:
+                request(base_url, f"/api/preview/{task}", recorder, "preview")
+            last_state, last_task, last_count = state, task, count
+        stop.wait(max(0.0, poll_interval - (time.perf_counter() - t0)))
+
+
+def driver_client(base_url, recorder, stop, steps=DEFAULT_STEPS, interval=1.0, explain_every=3):
+    """Triggers the steps one after the other (the next one once the current task is done)."""
+    i = 0
+    while not stop.is_set():
+        step = steps[i % len(steps)]
+        payload = {"top_n": 10} if step == "step7" else None
+        request(base_url, f"/api/{step}", recorder, "step", method="POST", payload=payload)
+        i += 1
+        if explain_every and i % explain_every == 0:
+            request(base_url, f"/api/explain/{random.randint(0, 9)}?source=step7", recorder, "explain", method="POST")
+        while not stop.wait(interval):
+            data = request(base_url, "/api/logs", recorder, "logs")
+            if data and data.get("task_state") != "RUNNING":
+                break
+
+
+def summarize(records, duration):
+    """Throughput, latency percentiles and error rate per request group (plus a 'total' row)."""
+    import pandas as pd
+
+    groups = {}
+    for group, seconds, ok in records:
+        groups.setdefault(group, []).append((seconds, ok))
+    groups["total"] = [(seconds, ok) for _, seconds, ok in records]
+
+    rows = []
+    for group, values in groups.items():
+        latencies = np.array([s for s, _ in values]) * 1000
+        errors = sum(1 for _, ok in values if not ok)
+        p50, p90, p99 = np.percentile(latencies, [50, 90, 99]) if len(latencies) else (np.nan,) * 3
+        rows.append({
+            "Groupe": group,
+            "Requetes": len(values),
+            "Req_par_s": len(values) / duration,
+            "Erreurs": errors,
+            "Taux_erreur": errors / len(values) if values else 0.0,
+            "p50_ms": p50,
+            "p90_ms": p90,
+            "p99_ms": p99,
+            "Max_ms": latencies.max() if len(latencies) else np.nan,
+        })
+    return pd.DataFrame(rows)
+
+
+def load_test(clients=20, duration=30.0, poll_interval=1.0, steps=DEFAULT_STEPS, stub_seconds=2.0,
+              url=None, output_path=None, progress_callback=None):
+    """
+    Starts app.py with stub services (unless `url` points to a running server), runs
+    `clients` simulated UI tabs plus one driver triggering the steps for `duration` seconds,
+    and writes the report to data/load_test_report.csv. Returns the report as a DataFrame.
+    """
+    process = None
+    if url is None:
+        port = free_port()
+        process = start_server(port, stub_seconds=stub_seconds)
+        url = f"http://127.0.0.1:{port}"
+    if progress_callback:
+        progress_callback(f"Charge : {clients} client(s) sur {url} pendant {duration:.0f}s...")
+
+    recorder = Recorder()
+    stop = threading.Event()
+    threads = [threading.Thread(target=ui_client, args=(url, recorder, stop, poll_interval), daemon=True)
+               for _ in range(clients)]
+    if steps:
+        threads.append(threading.Thread(target=driver_client, args=(url, recorder, stop, steps), daemon=True))
+    try:
+        t0 = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        stop.wait(duration)
+        stop.set()
+        for thread in threads:
+            thread.join(timeout=15)
+        elapsed = time.perf_counter() - t0
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=10)
+
+    report = summarize(recorder.records, elapsed)
+    if output_path is None:
+        output_path = os.path.join(DATA_DIR, "load_test_report.csv")
+    write_csv(report, output_path, inputs=(clients, duration, poll_interval, steps, url), index=False)
+
+    if progress_callback:
+        for row in report.to_dict(orient='records'):
+            progress_callback(
+                f"{row['Groupe']:<8} | {row['Requetes']:6d} req | {row['Req_par_s']:7.1f} req/s | "
+                f"p50 {row['p50_ms']:7.1f} ms | p90 {row['p90_ms']:7.1f} ms | p99 {row['p99_ms']:7.1f} ms | "
+                f"erreurs {row['Taux_erreur']:.1%}"
+            )
+        progress_callback(f"✅ Rapport : {output_path}")
+    return report
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Test de charge de l'API Flask (services simulés, 100% local).")
+    parser.add_argument("--clients", type=int, default=20, help="Onglets UI simulés")
+    parser.add_argument("--duration", type=float, default=30.0, help="Durée du test (s)")
+    parser.add_argument("--poll-interval", type=float, default=1.0, help="Intervalle de polling /api/logs (s)")
+    parser.add_argument("--steps", default=",".join(DEFAULT_STEPS), help="Étapes déclenchées en boucle ('' : aucune)")
+    parser.add_argument("--stub-seconds", type=float, default=2.0, help="Durée simulée de chaque étape (s)")
+    parser.add_argument("--url", default=None, help="Serveur déjà lancé (défaut : app.py démarré avec JOBAPP_STUB_SERVICES=1)")
+    args = parser.parse_args()
+
+    load_test(clients=args.clients, duration=args.duration, poll_interval=args.poll_interval,
+              steps=tuple(s for s in args.steps.split(",") if s), stub_seconds=args.stub_seconds,
+              url=args.url, progress_callback=print)
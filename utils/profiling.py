@@ -0,0 +1,157 @@
+import os
+import sys
+import time
+import threading
+import importlib.util
+from collections import Counter
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data')
+PROFILE_DIR = os.path.join(DATA_DIR, 'profiles')
+
+# 200 samples/s: enough to see where a multi-second step spends its time, negligible overhead
+DEFAULT_INTERVAL = 0.005
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """
+    Samples the Python stack of one thread at a fixed interval from a background thread.
+    Stacks are aggregated in the "folded" format (frame;frame;frame count), readable by
+    flamegraph.pl, speedscope or inferno.
+    """
+
+    def __init__(self, thread_id=None, interval=DEFAULT_INTERVAL):
+        self.thread_id = thread_id or threading.get_ident()
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        frame = sys._current_frames().get(self.thread_id)
+        if frame is None:
+            return
+        stack = []
+        while frame is not None:
+            stack.append(_frame_label(frame))
+            frame = frame.f_back
+        self.stacks[";".join(reversed(stack))] += 1
+        self.samples += 1
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def write_folded(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+    def summary(self, top=40):
+        """Functions by self and cumulative share of the samples."""
+        own, total = Counter(), Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(";")
+            own[frames[-1]] += count
+            for label in set(frames):
+                total[label] += count
+
+        n = max(self.samples, 1)
+        lines = [f"{self.samples} échantillons ({self.interval * 1000:.0f} ms)", "",
+                 f"{'Propre':>8} {'Cumulé':>8}  Fonction"]
+        for label, count in own.most_common(top):
+            lines.append(f"{100 * count / n:7.1f}% {100 * total[label] / n:7.1f}%  {label}")
+        lines += ["", f"{'Cumulé':>8}  Fonction"]
+        for label, count in total.most_common(top):
+            lines.append(f"{100 * count / n:7.1f}%  {label}")
+        return "\n".join(lines) + "\n"
+
+
+def torch_available():
+    return importlib.util.find_spec("torch") is not None
+
+
+class TaskProfiler:
+    """
+    Wraps one task run: sampling CPU profiler on the calling thread, plus the torch profiler
+    (operators, CPU/CUDA time) when torch is installed. On exit, the profiles are written to
+    data/profiles/<task_id>_<timestamp>.* and their file names are in `files`.
+    """
+
+    def __init__(self, task_id, interval=DEFAULT_INTERVAL, use_torch=True):
+        self.task_id = task_id
+        self.interval = interval
+        self.use_torch = use_torch and torch_available()
+        self.files = []
+        self._sampler = None
+        self._torch_profiler = None
+
+    def __enter__(self):
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        self.prefix = f"{self.task_id}_{time.strftime('%Y%m%d_%H%M%S')}"
+
+        if self.use_torch:
+            import torch
+            activities = [torch.profiler.ProfilerActivity.CPU]
+            self._cuda = torch.cuda.is_available()
+            if self._cuda:
+                activities.append(torch.profiler.ProfilerActivity.CUDA)
+            self._torch_profiler = torch.profiler.profile(activities=activities, record_shapes=True)
+            self._torch_profiler.__enter__()
+
+        self._sampler = SamplingProfiler(interval=self.interval)
+        self._sampler.start()
+        # Task time only (the torch import and profiler setup are not counted)
+        self._t0 = time.perf_counter()
+        return self
+
+    def _path(self, suffix):
+        name = f"{self.prefix}.{suffix}"
+        self.files.append(name)
+        return os.path.join(PROFILE_DIR, name)
+
+    def __exit__(self, exc_type, exc, tb):
+        self._sampler.stop()
+        elapsed = time.perf_counter() - self._t0
+
+        self._sampler.write_folded(self._path("folded"))
+        with open(self._path("txt"), 'w', encoding='utf-8') as f:
+            f.write(f"Tâche {self.task_id} : {elapsed:.2f} s\n\n")
+            f.write(self._sampler.summary())
+
+        if self._torch_profiler is not None:
+            self._torch_profiler.__exit__(exc_type, exc, tb)
+            events = self._torch_profiler.key_averages()
+            # Nothing to report when the step did not run any torch operator (scraping, pandas...)
+            if len(events):
+                sort_by = "cuda_time_total" if self._cuda else "cpu_time_total"
+                with open(self._path("torch.txt"), 'w', encoding='utf-8') as f:
+                    f.write(events.table(sort_by=sort_by, row_limit=50))
+                # Chrome trace: chrome://tracing or https://ui.perfetto.dev
+                self._torch_profiler.export_chrome_trace(self._path("torch.json"))
+        return False
+
+
+def profile_call(task_id, func, *args, progress_callback=None, **kwargs):
+    """Runs func under TaskProfiler and reports the profile files (even if func fails)."""
+    profiler = TaskProfiler(task_id)
+    try:
+        with profiler:
+            return func(*args, progress_callback=progress_callback, **kwargs)
+    finally:
+        if progress_callback and profiler.files:
+            progress_callback("Profils : " + ", ".join(f"/api/profiles/{name}" for name in profiler.files))
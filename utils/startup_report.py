@@ -0,0 +1,85 @@
+import os
+import re
+import subprocess
+import sys
+
+ROOT_DIR = os.path.dirname(os.path.dirname(__file__))
+DATA_DIR = os.path.join(ROOT_DIR, 'data')
+
+# Heavy dependencies that must not be imported before the first request
+HEAVY_PACKAGES = ("torch", "transformers", "sentence_transformers", "sklearn", "selenium", "pdfplumber", "onnxruntime")
+
+_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s+)(\S+)\s*$")
+
+
+def measure_imports(statement="import app", cwd=ROOT_DIR):
+    """
+    Runs `statement` in a fresh interpreter with `python -X importtime` and returns
+    the parsed entries as (module, self_us, cumulative_us, depth).
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        cwd=cwd, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"'{statement}' a échoué :\n{result.stderr[-2000:]}")
+
+    entries = []
+    for line in result.stderr.splitlines():
+        match = _LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, module = match.groups()
+            # importtime indents nested imports by two spaces per level
+            entries.append((module, int(self_us), int(cumulative_us), (len(indent) - 1) // 2))
+    return entries
+
+
+def startup_report(statement="import app", top=15, output_path=None, progress_callback=None):
+    """
+    Breaks down the import cost of `statement` by top-level package and writes it to
+    data/startup_report.csv. Returns the report as a DataFrame.
+    """
+    import pandas as pd
+    from utils.artifacts import write_csv
+
+    entries = measure_imports(statement)
+    df = pd.DataFrame(entries, columns=["Module", "Self_us", "Cumulative_us", "Depth"])
+    df["Package"] = df["Module"].str.split(".").str[0]
+
+    report = (
+        df.groupby("Package")
+        .agg(Self_ms=("Self_us", "sum"), Modules=("Module", "count"))
+        .sort_values("Self_ms", ascending=False)
+        .reset_index()
+    )
+    report["Self_ms"] = report["Self_ms"] / 1000
+    total_ms = df.loc[df["Depth"] == 0, "Cumulative_us"].sum() / 1000
+    report["Part"] = report["Self_ms"] / total_ms if total_ms else 0.0
+
+    if output_path is None:
+        output_path = os.path.join(DATA_DIR, "startup_report.csv")
+    write_csv(report, output_path, inputs=(statement,), index=False)
+
+    if progress_callback:
+        progress_callback(f"Temps d'import total de '{statement}' : {total_ms:.0f} ms ({len(df)} modules)")
+        for row in report.head(top).itertuples():
+            progress_callback(f"  {row.Package:<28} {row.Self_ms:8.1f} ms  {row.Part:6.1%}  ({row.Modules} modules)")
+        heavy = [p for p in HEAVY_PACKAGES if p in set(report["Package"])]
+        if heavy:
+            progress_callback(f"⚠️ Dépendances lourdes importées au démarrage : {', '.join(heavy)}")
+        else:
+            progress_callback("✅ Aucune dépendance lourde importée au démarrage.")
+        progress_callback(f"Rapport : {output_path}")
+
+    return report
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Décompose le temps d'import au démarrage, par paquet.")
+    parser.add_argument("--statement", default="import app", help="Instruction mesurée (défaut : import app)")
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    startup_report(args.statement, top=args.top, progress_callback=print)